@@ -1,20 +1,47 @@
 # -*- coding: utf-8 -*-
-"""Top-level package for detection-models."""
+"""Top-level package for detection-models.
+
+The public classes are imported lazily (on first attribute access), so that
+tools which only need `detection_models.results` or `detection_models.utils`
+do not pay for importing TensorFlow and the Object Detection API.
+"""
 
 __author__ = """Gavin C. Martin"""
 __email__ = 'gavinmartin@utexas.edu'
 __version__ = '0.1.2'
 
-import sys
+import importlib
+
+# public attribute -> the submodule that defines it
+_LAZY_ATTRIBUTES = {
+    "ObjectDetector": "object_detector",
+    "BBoxDetector": "bbox_detector",
+    "MaskDetector": "mask_detector",
+    "DetectorPool": "pool",
+    "SessionOptions": "options",
+    "ResultCache": "cache",
+    "EnsembleDetector": "ensemble",
+    "ResultsWriter": "serialization",
+    "ResultsReader": "serialization",
+    "Instrumentation": "instrumentation",
+    "MetricsHook": "instrumentation",
+    "Evaluator": "evaluation",
+    "DetectionServer": "server",
+    "DetectionClient": "server",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name))
+    module = importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
 
-try:
-    import object_detection
-except ModuleNotFoundError:
-    raise ImportError(
-        """ You must have the TensorFlow Object Detection API installed to use
-            detection_models. Follow the instructions at:
-            https://github.com/tensorflow/models/blob/master/research/object_detection/g3doc/installation.md"""
-    )
 
-from .object_detector import ObjectDetector
-from .bbox_detector import BBoxDetector
+def __dir__():
+    return sorted(list(globals()) + __all__)
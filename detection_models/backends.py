@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""Inference backends that run a detection model on batches of images
+
+Every backend is fed a stacked batch of images and returns the raw outputs of
+a TF Object Detection API model (`detection_boxes`, `detection_scores`,
+etc.) as numpy arrays with the same shapes, dtypes, and conventions (e.g.
+1-based class IDs), so that the post-processing of `BBoxDetector` and
+`MaskDetector` does not depend on the backend the model runs on.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from PIL import Image
+
+import detection_models.loading
+
+# the names of the backends understood by `detection_models.loading`
+BACKENDS = ("session", "tflite")
+
+# the outputs of the TFLite_Detection_PostProcess op (as emitted by the
+# Object Detection API's export_tflite_ssd_graph.py), in order
+POSTPROCESS_OUTPUT_KEYS = ('detection_boxes', 'detection_classes',
+                           'detection_scores', 'num_detections')
+
+# the quantization modes understood by `convert_to_tflite`
+QUANTIZATION_MODES = ("dynamic", "float16", "int8")
+
+
+class InferenceBackend(ABC):
+    """An abstract base class for the runtimes a detection model runs on
+
+    Attributes:
+        outputs (tuple): the keys of
+            `detection_models.loading.OUTPUT_TENSOR_KEYS` the model provides
+        traceable (bool): whether `run` can record TensorFlow step statistics
+            into a `tf.RunMetadata`
+        filter_in_graph (bool): whether the outputs returned by `run` are
+            already filtered by the `filters` it was passed
+    """
+
+    outputs = ()
+    traceable = False
+    filter_in_graph = False
+
+    @abstractmethod
+    def run(self,
+            images: np.ndarray,
+            fetch_keys: Sequence[str],
+            run_metadata=None,
+            filters: dict = None) -> Dict[str, np.ndarray]:
+        """Runs the model once on a stacked batch of images
+
+        Args:
+            images (np.ndarray): a batch of images of identical size in the RGB
+                colorspace (batch, height, width, 3)
+            fetch_keys (Sequence[str]): the outputs to return
+            run_metadata (tf.RunMetadata, optional): Defaults to None. If
+                given (and the backend is `traceable`), the run is traced with
+                `RunOptions(trace_level=FULL_TRACE)` into it
+            filters (dict, optional): Defaults to None. The values of the
+                in-graph filter placeholders (see
+                `detection_models.loading.load_model`), keyed by placeholder
+                name; ignored by backends that do not `filter_in_graph`
+
+        Returns:
+            dict: the output arrays keyed by output name; the first dimension
+                of each array indexes the images in the batch
+        """
+
+    def close(self) -> None:
+        """Releases the resources held by the backend"""
+
+
+class SessionBackend(InferenceBackend):
+    """Runs a frozen inference graph in a `tf.Session`
+
+    tf.Session.run() is thread-safe, so a `SessionBackend` may be used by
+    several threads (and detectors) at once.
+
+    Attributes:
+        graph (tf.Graph): the graph the frozen inference graph was imported
+            into
+        session (tf.Session): the session running `graph`
+        image_tensor (tf.Tensor): the tensor the batch of images is fed to
+        output_scope (str): the name scope the fetched outputs (and the
+            filter placeholders) are in; the graph's own outputs if None
+    """
+
+    traceable = True
+
+    def __init__(self,
+                 graph: tf.Graph,
+                 session: tf.Session,
+                 input_tensor_name: str,
+                 outputs: tuple,
+                 output_scope: str = None):
+        self.graph = graph
+        self.session = session
+        self.image_tensor = graph.get_tensor_by_name(input_tensor_name)
+        self.outputs = outputs
+        self.output_scope = output_scope
+        self.filter_in_graph = output_scope is not None
+        self._fetches = {}
+
+    def _tensor_name(self, key: str) -> str:
+        if self.output_scope is None:
+            return key + ':0'
+        return "{}/{}:0".format(self.output_scope, key)
+
+    def _tensor_dict(self, fetch_keys: Sequence[str]) -> Dict[str, tf.Tensor]:
+        fetch_keys = tuple(fetch_keys)
+        tensor_dict = self._fetches.get(fetch_keys)
+        if tensor_dict is None:
+            tensor_dict = self._fetches[fetch_keys] = {
+                key: self.graph.get_tensor_by_name(self._tensor_name(key))
+                for key in fetch_keys
+            }
+        return tensor_dict
+
+    def run(self,
+            images: np.ndarray,
+            fetch_keys: Sequence[str],
+            run_metadata=None,
+            filters: dict = None) -> Dict[str, np.ndarray]:
+        run_options = None
+        if run_metadata is not None:
+            run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        feed_dict = {self.image_tensor: images}
+        if filters and self.filter_in_graph:
+            for key, value in filters.items():
+                feed_dict[self.graph.get_tensor_by_name(
+                    self._tensor_name(key))] = value
+        return self.session.run(
+            fetches=self._tensor_dict(fetch_keys),
+            feed_dict=feed_dict,
+            options=run_options,
+            run_metadata=run_metadata)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class TFLiteBackend(InferenceBackend):
+    """Runs a TensorFlow Lite model with the TFLite interpreter
+
+    Two kinds of models are supported: models converted from a frozen
+    inference graph by `convert_to_tflite` (whose outputs keep the Object
+    Detection API's names), and SSD models exported with the Object Detection
+    API's export_tflite_ssd_graph.py (whose outputs come from the
+    TFLite_Detection_PostProcess op, with 0-based class IDs).
+
+    Images are resized to the model's input size if it is fixed, and are
+    converted to the model's input type: uint8 inputs are fed raw pixels,
+    float inputs are fed pixels scaled into `input_range`, and quantized
+    inputs are fed `input_range`-scaled pixels quantized with the input's
+    scale and zero point. Quantized outputs are dequantized.
+
+    The interpreter is not thread-safe, so runs are serialized.
+
+    Attributes:
+        interpreter (tf.lite.Interpreter): the interpreter running the model
+        input_range (tuple): the (min, max) pixel values are scaled to for
+            models with float (or quantized) inputs
+    """
+
+    def __init__(self,
+                 model_content: bytes,
+                 num_threads: int = None,
+                 input_range: Tuple[float, float] = (-1.0, 1.0)):
+        """Loads a TensorFlow Lite model
+
+        Args:
+            model_content (bytes): the contents of the .tflite file
+            num_threads (int, optional): Defaults to None. The number of
+                threads the interpreter may use; TFLite's default if None
+            input_range (tuple, optional): Defaults to (-1.0, 1.0). See
+                `input_range`
+        """
+
+        self.interpreter = tf.lite.Interpreter(
+            model_content=model_content, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_range = input_range
+        self._input = self.interpreter.get_input_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._output_details, self._class_id_offset = self._map_outputs(
+            self.interpreter.get_output_details())
+        self.outputs = tuple(
+            key for key in detection_models.loading.OUTPUT_TENSOR_KEYS
+            if key in self._output_details)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _map_outputs(output_details: Sequence[dict]
+                     ) -> Tuple[Dict[str, dict], int]:
+        """Maps the model's output tensors to Object Detection API outputs
+
+        Returns:
+            tuple: the output details keyed by output name, and the offset to
+                add to the model's class IDs
+        """
+
+        names = [detail["name"].split(":")[0] for detail in output_details]
+        if names[0] == "TFLite_Detection_PostProcess":
+            return dict(zip(POSTPROCESS_OUTPUT_KEYS, output_details)), 1
+        outputs = {
+            name: detail
+            for name, detail in zip(names, output_details)
+            if name in detection_models.loading.OUTPUT_TENSOR_KEYS
+        }
+        if not outputs:
+            raise ValueError(
+                "the TFLite model has none of the outputs {}".format(
+                    list(detection_models.loading.OUTPUT_TENSOR_KEYS)))
+        return outputs, 0
+
+    def _prepare(self, images: np.ndarray) -> np.ndarray:
+        """Resizes and converts images to the model's input size and type"""
+        height, width = (int(size) for size in self._input["shape"][1:3])
+        if images.shape[1:3] != (height, width):
+            images = np.stack([
+                np.asarray(
+                    Image.fromarray(image).resize((width, height),
+                                                  Image.BILINEAR))
+                for image in images
+            ])
+
+        dtype = self._input["dtype"]
+        scale, zero_point = self._input["quantization"]
+        if dtype == np.uint8 and not scale:
+            return images
+        low, high = self.input_range
+        images = images.astype(np.float32) * ((high - low) / 255.0) + low
+        if scale:
+            info = np.iinfo(dtype)
+            images = np.clip(
+                np.round(images / scale + zero_point), info.min, info.max)
+        return images.astype(dtype)
+
+    def _invoke(self, images: np.ndarray,
+                fetch_keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        if len(images) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input["index"],
+                                                 images.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(images)
+        self.interpreter.set_tensor(self._input["index"], images)
+        self.interpreter.invoke()
+
+        output_dict = {}
+        for key in fetch_keys:
+            detail = self._output_details[key]
+            output = self.interpreter.get_tensor(detail["index"])
+            scale, zero_point = detail["quantization"]
+            if scale:
+                output = (output.astype(np.float32) - zero_point) * scale
+            output_dict[key] = output.astype(np.float32, copy=False)
+        if self._class_id_offset and "detection_classes" in output_dict:
+            output_dict["detection_classes"] = (
+                output_dict["detection_classes"] + self._class_id_offset)
+        return output_dict
+
+    def run(self,
+            images: np.ndarray,
+            fetch_keys: Sequence[str],
+            run_metadata=None,
+            filters: dict = None) -> Dict[str, np.ndarray]:
+        images = self._prepare(images)
+        with self._lock:
+            # models with a fixed batch size (such as those using the
+            # TFLite_Detection_PostProcess op) are run one image at a time
+            if self._input["shape_signature"][0] != -1:
+                outputs = [
+                    self._invoke(image[np.newaxis], fetch_keys)
+                    for image in images
+                ]
+                return {
+                    key: np.concatenate([output[key] for output in outputs])
+                    for key in fetch_keys
+                }
+            return self._invoke(images, fetch_keys)
+
+
+def convert_to_tflite(model_path: Path,
+                      output_path: Path,
+                      input_size: Tuple[int, int],
+                      quantization: str = None,
+                      representative_images: Sequence[np.ndarray] = None,
+                      input_array: str = None,
+                      output_arrays: Sequence[str] = None) -> Path:
+    """Converts a frozen inference graph into a TensorFlow Lite model
+
+    The converted model has a fixed input size and a batch size of 1 (which
+    `TFLiteBackend` runs images through one at a time). Graphs that rely on
+    ops TFLite lacks (such as the control flow of most two-stage models)
+    cannot be converted; for SSD models, export the graph with the Object
+    Detection API's export_tflite_ssd_graph.py first and pass its input and
+    output arrays.
+
+    Args:
+        model_path (pathlib.Path): the frozen inference graph (.pb)
+        output_path (pathlib.Path): the TFLite model (.tflite) to write
+        input_size (tuple): the (height, width) of the converted model's
+            input; images are resized to it by `TFLiteBackend`
+        quantization (str, optional): Defaults to None. One of
+            `QUANTIZATION_MODES`: "dynamic" quantizes weights to 8 bits,
+            "float16" quantizes weights to float16, and "int8" quantizes
+            weights and activations to 8 bits (which requires
+            `representative_images`); no quantization is done if None
+        representative_images (Sequence[np.ndarray], optional): Defaults to
+            None. Images in the RGB colorspace (height, width, 3) used to
+            calibrate "int8" quantization
+        input_array (str, optional): Defaults to "image_tensor". The name of
+            the graph's input placeholder
+        output_arrays (Sequence[str], optional): Defaults to the Object
+            Detection API outputs the graph provides. The names of the
+            graph's output tensors
+
+    Returns:
+        pathlib.Path: `output_path`
+    """
+
+    if quantization is not None and quantization not in QUANTIZATION_MODES:
+        raise ValueError("quantization must be one of {}".format(
+            QUANTIZATION_MODES))
+    if quantization == "int8" and not representative_images:
+        raise ValueError("int8 quantization requires representative_images")
+
+    if input_array is None:
+        input_array = detection_models.loading.INPUT_TENSOR_KEY
+    model_path = Path(model_path)
+    if output_arrays is None:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(model_path.read_bytes())
+        node_names = {node.name for node in graph_def.node}
+        output_arrays = [
+            key for key in detection_models.loading.OUTPUT_TENSOR_KEYS
+            if key in node_names
+        ]
+        del graph_def
+
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        str(model_path), [input_array],
+        list(output_arrays),
+        input_shapes={input_array: [1] + list(input_size) + [3]})
+    converter.allow_custom_ops = True
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        height, width = input_size
+
+        def representative_dataset():
+            for image in representative_images:
+                image = Image.fromarray(image).resize((width, height),
+                                                      Image.BILINEAR)
+                yield [np.asarray(image)[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+
+    output_path = Path(output_path)
+    output_path.write_bytes(converter.convert())
+    return output_path
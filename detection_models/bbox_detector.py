@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
 import numpy as np
 
-import detection_models
+import detection_models.object_detector
+import detection_models.ops
 import detection_models.results
+import detection_models.video
 
 
-class BBoxDetector(detection_models.ObjectDetector):
+class BBoxDetector(detection_models.object_detector.ObjectDetector):
     """A class for representing bounding box detectors
 
     This class inherits from `detection_models.ObjectDetector` and abstracts
@@ -17,20 +22,18 @@ class BBoxDetector(detection_models.ObjectDetector):
     
     Attributes:
         _graph (tf.Graph): the TensorFlow Graph object that represents the
-            frozen inference graph
+            frozen inference graph; None unless the model runs on the
+            "session" backend
         _category_index (dict): a dictionary that stores the model's ID->label
             associations from the input label map; the keys are the class IDs
             (stored as `int`s), and each value is a dict with:
                 "id": the class ID
                 "name": the class name
         _session (tf.Session): the running TensorFlow session that represents
-            the connection between the Python runtime and underlying C++ engine
-        _tensor_dict (dict): a dictionary that stores the tensor names (as
-            `str` keys) and tf.Tensor objects for the given model that will
-            be supplied as "fetches" to a tf.Session.run() call; these are the
-            return values of the session run
-        _image_tensor (tf.Tensor): the image tensor that constitutes the
-            tf.Session.run() feed_dict when paired with input images
+            the connection between the Python runtime and underlying C++
+            engine; None unless the model runs on the "session" backend
+        _backend (detection_models.backends.InferenceBackend): the backend
+            that runs the model
     """
 
     def detect(self, image: np.ndarray, detection_threshold: float = 0.5
@@ -39,7 +42,8 @@ class BBoxDetector(detection_models.ObjectDetector):
     
         Args:
             image (np.ndarray): an image loaded into memory as a numpy array in
-                the RGB colorspace (height, width, 3)
+                the RGB colorspace (height, width, 3); or, if the detector has
+                `encoded_input`, the bytes of an encoded image
             detection_threshold (float, optional): Defaults to 0.5. A threshold
                 with which to discard detected objects that have a low
                 detection score
@@ -51,39 +55,245 @@ class BBoxDetector(detection_models.ObjectDetector):
                 of this object type
         """
 
-        output_dict = self._session.run(
-            fetches=self._tensor_dict,
-            feed_dict={self._image_tensor: np.expand_dims(image, 0)})
-
-        # get rid of extra dimensions, convert to appropriate types
-        num_detections = int(output_dict['num_detections'][0])
-        detection_classes = output_dict['detection_classes'][0].astype(
-            np.uint8)[0:num_detections]
-        detection_boxes = output_dict['detection_boxes'][0][0:num_detections]
-        detection_scores = output_dict['detection_scores'][0][0:num_detections]
-
-        detection_results = detection_models.results.DetectionResults()
-        for (label_id, box, score) in zip(
-                detection_classes,
-                detection_boxes,
-                detection_scores,
-        ):
-            if score < detection_threshold:
-                break
-
-            label = self._category_index[label_id]["name"]
-            detected_bbox = detection_models.results.DetectedBBox(
-                label=label, confidence=score, box=box)
-
-            # if label does not yet exist in DetectionResults, add the
-            # DetectedBBox as a list (of only one element) to DetectionResults
-            # at that label
-            if label not in detection_results.keys():
-                detection_results[label] = [detected_bbox]
-
-            # else, append the DetectedBBox to the list at that label since
-            # multiple instances of that category have been found
-            else:
-                detection_results[label].append(detected_bbox)
-
-        return detection_results
+        if self.result_cache is not None:
+            return self.result_cache.detect_batch(self, [image],
+                                                  detection_threshold)[0]
+        with self._timed("prepare"):
+            batch = self._stack([image])
+        output_dict = self._run(batch, detection_threshold)
+        return self._build_results(output_dict, 0, detection_threshold,
+                                   self._image_size(image))
+
+    def detect_batch(self,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5,
+                     max_batch_size: int = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection on many images with batched inference
+
+        Images of the same size are stacked into a single `image_tensor` feed
+        so that the model is run once per batch rather than once per image.
+        Images of different sizes are bucketed by size and run as separate
+        batches. If the detector has a `result_cache`, only the images whose
+        results are not cached are run.
+
+        Args:
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3); or, if the
+                detector has `encoded_input`, the bytes of encoded images
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            max_batch_size (int, optional): Defaults to `self.max_batch_size`.
+                The maximum number of images fed to the model at once; bounds
+                the memory used by a single tf.Session.run() call
+
+        Returns:
+            list: one `detection_models.results.DetectionResults` per image,
+                in the same order as `images`
+        """
+
+        if self.result_cache is not None:
+            return self.result_cache.detect_batch(self, images,
+                                                  detection_threshold,
+                                                  max_batch_size)
+        return self._detect_batch(images, detection_threshold, max_batch_size)
+
+    def _detect_batch(self, images: Sequence[np.ndarray],
+                      detection_threshold: float, max_batch_size: int
+                      ) -> List[detection_models.results.DetectionResults]:
+        """Runs batched inference on images, bypassing the result cache"""
+        if max_batch_size is None:
+            max_batch_size = self.max_batch_size
+
+        all_results = [None] * len(images)
+        for indices, batch, image_size in self._iter_batches(
+                images, max_batch_size):
+            output_dict = self._run(batch, detection_threshold)
+            for batch_index, image_index in enumerate(indices):
+                all_results[image_index] = self._build_results(
+                    output_dict, batch_index, detection_threshold, image_size)
+        return all_results
+
+    def detect_tiled(self,
+                     image: np.ndarray,
+                     detection_threshold: float = 0.5,
+                     tile_size: Tuple[int, int] = (1024, 1024),
+                     overlap: int = 128,
+                     max_batch_size: int = None,
+                     nms_iou_threshold: float = 0.5
+                     ) -> detection_models.results.ColumnarDetectionResults:
+        """Performs object detection on a very large image tile by tile
+
+        The image is cut into overlapping tiles of `tile_size` (views into the
+        image, not copies), which are run through the model in batches of
+        `max_batch_size`, so that small objects are not lost to the model's
+        internal resizing and memory use is bounded by the batch rather than
+        the image. The detections of all tiles are mapped back to normalized
+        coordinates of the whole image, and duplicate detections of objects
+        on tile seams are merged with class-aware non-max suppression.
+
+        Args:
+            image (np.ndarray): an image loaded into memory as a numpy array in
+                the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            tile_size (tuple, optional): Defaults to (1024, 1024). The
+                (height, width) of each tile; clipped to the image size
+            overlap (int, optional): Defaults to 128. The number of pixels
+                adjacent tiles overlap by; should be at least the size of the
+                objects of interest so that each object lies wholly within
+                some tile
+            max_batch_size (int, optional): Defaults to `self.max_batch_size`.
+                The maximum number of tiles fed to the model at once
+            nms_iou_threshold (float, optional): Defaults to 0.5. Detections
+                of the same class overlapping a higher scoring detection by
+                more than this IoU are discarded
+
+        Returns:
+            detection_models.results.ColumnarDetectionResults: the set of
+                prediction results for the whole image; boxes are normalized
+                to the whole image
+        """
+
+        if self.encoded_input:
+            raise ValueError(
+                "detect_tiled requires a detector fed decoded images")
+        height, width = image.shape[:2]
+        tile_height = min(tile_size[0], height)
+        tile_width = min(tile_size[1], width)
+        origins = [(top, left)
+                   for top in self._tile_origins(height, tile_height, overlap)
+                   for left in self._tile_origins(width, tile_width, overlap)]
+        tiles = [
+            image[top:top + tile_height, left:left + tile_width]
+            for top, left in origins
+        ]
+        tile_results = self._detect_batch(tiles, detection_threshold,
+                                          max_batch_size)
+
+        # tile-normalized -> image-normalized coordinates
+        scale = np.array([tile_height / height, tile_width / width] * 2,
+                         dtype=np.float32)
+        offsets = np.array([(top / height, left / width) * 2
+                            for top, left in origins],
+                           dtype=np.float32).reshape(-1, 4)
+        boxes = np.concatenate(
+            [results.boxes * scale + offset
+             for results, offset in zip(tile_results, offsets)])
+        scores = np.concatenate([results.scores for results in tile_results])
+        class_ids = np.concatenate(
+            [results.class_ids for results in tile_results])
+
+        keep = detection_models.ops.non_max_suppression(
+            boxes, scores, nms_iou_threshold, class_ids)
+        return detection_models.results.ColumnarDetectionResults(
+            boxes=boxes[keep],
+            scores=scores[keep],
+            class_ids=class_ids[keep],
+            label_table=self._label_lookup)
+
+    @staticmethod
+    def _tile_origins(length: int, tile_length: int,
+                      overlap: int) -> List[int]:
+        """Computes the start offsets of overlapping tiles along one axis
+
+        Tiles are spaced `tile_length - overlap` apart; the last tile is
+        aligned with the end of the axis so that every tile has the same size.
+        """
+
+        if tile_length >= length:
+            return [0]
+        stride = tile_length - overlap
+        if stride < 1:
+            raise ValueError("overlap must be smaller than the tile size")
+        origins = list(range(0, length - tile_length + 1, stride))
+        if origins[-1] + tile_length < length:
+            origins.append(length - tile_length)
+        return origins
+
+    def detect_video(self,
+                     video: Union[Path, str, Iterable[np.ndarray]],
+                     detection_threshold: float = 0.5,
+                     keyframe_interval: int = 10,
+                     scene_change_threshold: float = None,
+                     min_iou: float = 0.3
+                     ) -> Iterator[detection_models.video.VideoFrameResult]:
+        """Performs object detection on the frames of a video
+
+        The model is only run on keyframes (every `keyframe_interval`-th
+        frame, and frames where the scene changes); detections on the frames
+        in between are interpolated by associating the boxes of consecutive
+        keyframes. See `detection_models.video.detect_video` for details.
+
+        Args:
+            video (pathlib.Path, str, or Iterable[np.ndarray]): a video file
+                (decoded with imageio or OpenCV), or an iterable of frames in
+                the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            keyframe_interval (int, optional): Defaults to 10. The maximum
+                number of frames between keyframes
+            scene_change_threshold (float, optional): Defaults to None. The
+                mean absolute grayscale difference (0-255) from the previous
+                keyframe above which a frame becomes a keyframe; disabled if
+                None
+            min_iou (float, optional): Defaults to 0.3. The minimum IoU for
+                associating detections of consecutive keyframes
+
+        Yields:
+            detection_models.video.VideoFrameResult: the frame index, frame,
+                `DetectionResults`, and whether the model was run on the
+                frame, for each frame in order
+        """
+
+        if isinstance(video, (Path, str)):
+            video = detection_models.video.iter_video_frames(video)
+        return detection_models.video.detect_video(
+            self, video, detection_threshold, keyframe_interval,
+            scene_change_threshold, min_iou)
+
+    def _build_results(self, output_dict: Dict[str, np.ndarray],
+                       batch_index: int, detection_threshold: float,
+                       image_size: Tuple[int, int]
+                       ) -> detection_models.results.DetectionResults:
+        """Converts one image's raw model outputs into `DetectionResults`
+
+        Args:
+            output_dict (dict): the fetched output arrays of a (possibly
+                batched) tf.Session.run() call
+            batch_index (int): the index of the image within the batch
+            detection_threshold (float): a threshold with which to discard
+                detected objects that have a low detection score
+            image_size (tuple): the (height, width) of the image; used by
+                subclasses whose outputs are not normalized to the image size
+
+        Returns:
+            detection_models.results.DetectionResults: the set of prediction
+                results for the image at `batch_index`
+        """
+
+        with self._timed("convert_outputs"):
+            # discard low-confidence (and unwanted) detections; the remaining
+            # ones are sorted and grouped by class by ColumnarDetectionResults
+            keep = self._keep(output_dict, batch_index, detection_threshold)
+
+            # get rid of extra dimensions; class IDs are kept as integers
+            # wide enough for any label map
+            detection_classes = output_dict['detection_classes'][
+                batch_index][keep].astype(np.int64)
+            detection_boxes = output_dict['detection_boxes'][batch_index][keep]
+            detection_scores = output_dict['detection_scores'][batch_index][
+                keep]
+
+        with self._timed("build_results"):
+            results = detection_models.results.ColumnarDetectionResults(
+                boxes=detection_boxes,
+                scores=detection_scores,
+                class_ids=detection_classes,
+                label_table=self._label_lookup)
+        if self.instrumentation is not None:
+            self.instrumentation.detections(len(results.scores))
+        return results
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+import detection_models.results
+
+
+class CacheStats:
+    """Counters describing the behavior of a `ResultCache`
+
+    Attributes:
+        memory_hits (int): lookups answered by the in-memory tier
+        disk_hits (int): lookups answered by the on-disk tier
+        misses (int): lookups that required running the model
+        memory_evictions (int): entries dropped from the in-memory tier
+        disk_evictions (int): entries dropped from the on-disk tier
+    """
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    @property
+    def hits(self) -> int:
+        """int: lookups answered by either tier"""
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        """float: the fraction of lookups answered without running the model"""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    def as_dict(self) -> dict:
+        """Returns the counters (and derived values) as a plain dictionary"""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_evictions": self.memory_evictions,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class ResultCache:
+    """A content-addressed cache of detection results
+
+    Results are keyed by a hash of the image's pixels, the detector's
+    fingerprint (which identifies the frozen graph, the label map, and any
+    detector settings that affect the results), and the threshold the results
+    were computed at. Results are computed and stored at `storage_threshold`
+    (rather than at the requested threshold), so that a request at any higher
+    threshold is answered by filtering the stored results; requests below
+    `storage_threshold` are cached at their own threshold.
+
+    The cache has two tiers: a size-bounded in-memory LRU, and (if `path` is
+    given) a persistent SQLite database that survives restarts and can be
+    shared by several processes. Entries found on disk are promoted to the
+    in-memory tier. Only point the cache at databases written by trusted
+    processes, as entries are stored pickled.
+
+    A cache may be shared by several detectors (even of different models)
+    and is thread-safe.
+
+    Attributes:
+        storage_threshold (float): the detection threshold results are
+            computed and stored at
+        max_memory_entries (int): the maximum number of results kept in memory
+        max_disk_entries (int): the maximum number of results kept on disk
+            (least recently used entries are evicted first); unbounded if None
+        stats (CacheStats): hit, miss, and eviction counters
+    """
+
+    def __init__(self,
+                 max_memory_entries: int = 1024,
+                 path: Path = None,
+                 max_disk_entries: int = None,
+                 storage_threshold: float = 0.05):
+        """Creates a result cache
+
+        Args:
+            max_memory_entries (int, optional): Defaults to 1024. The maximum
+                number of results kept in memory; 0 disables the tier
+            path (pathlib.Path, optional): Defaults to None. The SQLite
+                database backing the on-disk tier; created if it does not
+                exist. The on-disk tier is disabled if None
+            max_disk_entries (int, optional): Defaults to None. The maximum
+                number of results kept on disk; unbounded if None
+            storage_threshold (float, optional): Defaults to 0.05. The
+                detection threshold results are computed and stored at
+        """
+
+        self.storage_threshold = storage_threshold
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.stats = CacheStats()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(
+                str(path), check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "accessed REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed "
+                "ON results (accessed)")
+
+    @staticmethod
+    def image_digest(image: np.ndarray) -> str:
+        """Hashes the pixels (and shape) of an image
+
+        Args:
+            image (np.ndarray or bytes): an image (height, width, 3), or the
+                bytes of an encoded image
+
+        Returns:
+            str: the hex SHA-256 digest of the image
+        """
+
+        if not isinstance(image, np.ndarray):
+            return hashlib.sha256(b"encoded:" + bytes(image)).hexdigest()
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha256(
+            "{}:{}:".format(image.dtype.str, image.shape).encode("ascii"))
+        digest.update(memoryview(image).cast("B"))
+        return digest.hexdigest()
+
+    def _key(self, image: np.ndarray, fingerprint: str,
+             threshold: float) -> str:
+        return "{}:{}:{!r}".format(fingerprint, self.image_digest(image),
+                                   float(threshold))
+
+    def get(self, key: str) -> detection_models.results.DetectionResults:
+        """Returns the results stored under `key`, or None on a miss"""
+        with self._lock:
+            results = self._memory.get(key)
+            if results is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return results
+
+            if self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT value FROM results WHERE key = ?",
+                    (key, )).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE results SET accessed = ? WHERE key = ?",
+                        (time.time(), key))
+                    results = pickle.loads(row[0])
+                    self._put_memory(key, results)
+                    self.stats.disk_hits += 1
+                    return results
+
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: str,
+            results: detection_models.results.DetectionResults) -> None:
+        """Stores results under `key` in both tiers"""
+        with self._lock:
+            self._put_memory(key, results)
+            if self._connection is None:
+                return
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (key, pickle.dumps(results, pickle.HIGHEST_PROTOCOL),
+                 time.time()))
+            if self.max_disk_entries is not None:
+                evicted = self._connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM "
+                    "results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries, )).rowcount
+                self.stats.disk_evictions += max(evicted, 0)
+
+    def _put_memory(self, key: str,
+                    results: detection_models.results.DetectionResults
+                    ) -> None:
+        if self.max_memory_entries <= 0:
+            return
+        self._memory[key] = results
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats.memory_evictions += 1
+
+    def clear(self) -> None:
+        """Removes all entries from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM results")
+
+    def close(self) -> None:
+        """Closes the on-disk tier; the in-memory tier remains usable"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def detect_batch(self,
+                     detector,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5,
+                     max_batch_size: int = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection through the cache
+
+        Images whose results are cached are answered from the cache; the
+        remaining images are run through the detector in a single batched
+        call (and their results cached). Repeated images within `images` are
+        only run once.
+
+        Args:
+            detector (detection_models.ObjectDetector): the detector to run on
+                cache misses; its `fingerprint` is part of the cache key
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            max_batch_size (int, optional): Defaults to the detector's. The
+                maximum number of images fed to the model at once
+
+        Returns:
+            list: one `detection_models.results.DetectionResults` per image,
+                in the same order as `images`
+        """
+
+        stored_threshold = min(detection_threshold, self.storage_threshold)
+        keys = [
+            self._key(image, detector.fingerprint, stored_threshold)
+            for image in images
+        ]
+
+        stored = {}
+        missing = OrderedDict()
+        for image, key in zip(images, keys):
+            if key in stored or key in missing:
+                continue
+            results = self.get(key)
+            if results is None:
+                missing[key] = image
+            else:
+                stored[key] = results
+
+        if missing:
+            computed = detector._detect_batch(
+                list(missing.values()), stored_threshold, max_batch_size)
+            for key, results in zip(missing, computed):
+                self.put(key, results)
+                stored[key] = results
+
+        # results can be changed by their callers, so every image gets its
+        # own copy rather than the cached (or a repeated image's) results
+        if detection_threshold == stored_threshold:
+            return [stored[key].copy() for key in keys]
+        return [stored[key].filter(detection_threshold) for key in keys]
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""The `detection-models` command line tool"""
+
+import argparse
+import glob
+import json
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Iterator, Sequence, Tuple
+
+# the file extensions of the images found in input directories
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png")
+
+# the file extensions of TFRecord inputs and of lists of image paths
+TFRECORD_EXTENSIONS = (".record", ".tfrecord", ".tfrecords")
+LIST_EXTENSIONS = (".list", ".lst", ".txt")
+
+# the characters that make an input a glob pattern
+GLOB_CHARACTERS = "*?["
+
+# the JSON-lines file, in the results store, to which `detect` appends the
+# key and error of each image it fails to process
+FAILURES_FILE = "failures.jsonl"
+
+
+def _parse_size(value: str) -> tuple:
+    """Parses a HEIGHTxWIDTH image size"""
+    try:
+        height, width = (int(size) for size in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected HEIGHTxWIDTH, got {!r}".format(value))
+    return height, width
+
+
+def _iter_tfrecord(path: Path) -> Iterator[Tuple[str, bytes]]:
+    """Yields the key and encoded image of each tf.Example in a TFRecord
+
+    Examples are expected to store their encoded image under the Object
+    Detection API's "image/encoded" feature.
+    """
+
+    import tensorflow as tf
+
+    for index, record in enumerate(
+            tf.python_io.tf_record_iterator(str(path))):
+        example = tf.train.Example.FromString(record)
+        encoded = example.features.feature["image/encoded"].bytes_list.value
+        if not encoded:
+            raise ValueError("record {} of {} has no image/encoded feature"
+                             .format(index, path))
+        yield "{}:{}".format(path, index), encoded[0]
+
+
+def iter_inputs(inputs: Sequence[str]) -> Iterator[Tuple[str, object]]:
+    """Expands input arguments into a stream of images
+
+    Each input is either a glob, a directory (searched recursively for
+    images), a TFRecord of tf.Examples, a list file with one image path per
+    line (relative paths are relative to the list file), or an image path.
+
+    Args:
+        inputs (Sequence[str]): the input arguments
+
+    Yields:
+        tuple: a key identifying each image (its path, or
+            "<tfrecord>:<index>" for TFRecord records) and the image's source
+            (its path, or its encoded bytes)
+    """
+
+    for value in inputs:
+        path = Path(value)
+        if any(character in value for character in GLOB_CHARACTERS):
+            paths = sorted(glob.iglob(value, recursive=True))
+        elif path.is_dir():
+            paths = sorted(
+                str(child) for child in path.rglob("*")
+                if child.suffix.lower() in IMAGE_EXTENSIONS)
+        elif path.suffix.lower() in TFRECORD_EXTENSIONS:
+            yield from _iter_tfrecord(path)
+            continue
+        elif path.suffix.lower() in LIST_EXTENSIONS:
+            with open(str(path), "r") as f:
+                paths = [
+                    str(path.parent / line.strip()) for line in f
+                    if line.strip()
+                ]
+        else:
+            paths = [value]
+        for image_path in paths:
+            yield image_path, image_path
+
+
+def _image_size(image) -> Tuple[int, int]:
+    """Returns the (height, width) of a decoded (or encoded) image
+
+    Only the header of an encoded image is read.
+    """
+
+    if not isinstance(image, bytes):
+        return image.shape[:2]
+
+    import io
+
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image)) as decoded:
+        width, height = decoded.size
+    return height, width
+
+
+def detect(args: argparse.Namespace) -> int:
+    """Runs a detector over images, appending the results to a results store
+
+    Images whose key is already in the store (or was already seen in this
+    run) are skipped, so an interrupted run continues where it stopped when
+    rerun with the same output. The store is flushed every
+    `args.checkpoint_every` images.
+
+    An image that cannot be decoded or detected is reported, and its key and
+    error are appended to `FAILURES_FILE` in the store; the run continues
+    with the next image, and exits with status 1. Failed images are not
+    added to the store, so a rerun retries them.
+    """
+
+    import detection_models
+    import detection_models.serialization
+
+    done = set()
+    if (args.output / detection_models.serialization.META_FILE).exists():
+        done = {
+            record["key"] for record in detection_models.serialization.
+            ResultsReader(args.output).records
+        }
+
+    options = detection_models.SessionOptions(intra_op_threads=args.threads)
+    detector = detection_models.BBoxDetector(
+        args.model,
+        args.label_map,
+        max_batch_size=args.batch_size,
+        options=options,
+        encoded_input=args.encoded_input,
+        backend=args.backend)
+
+    keys = deque()
+    skipped = 0
+
+    def sources() -> Iterator:
+        nonlocal skipped
+        for key, source in iter_inputs(args.inputs):
+            if key in done:
+                skipped += 1
+                continue
+            done.add(key)
+            keys.append(key)
+            yield source
+
+    count = 0
+    failed = 0
+    start = last_report = time.monotonic()
+    with detection_models.serialization.ResultsWriter(args.output) as writer, \
+            open(str(args.output / FAILURES_FILE), "a") as failures:
+        for _, image, results in detector.detect_stream(
+                sources(),
+                args.threshold,
+                prefetch=args.prefetch,
+                decode_workers=args.decode_workers,
+                batch_size=args.batch_size,
+                return_images=True,
+                return_exceptions=True):
+            key = keys.popleft()
+            if isinstance(results, Exception):
+                print("failed to process {}: {}".format(key, results),
+                      file=sys.stderr)
+                failures.write(
+                    json.dumps({
+                        "key": key,
+                        "error": "{}: {}".format(
+                            type(results).__name__, results)
+                    }) + "\n")
+                failures.flush()
+                failed += 1
+                continue
+            writer.write(results, key=key, image_size=_image_size(image))
+            count += 1
+            if count % args.checkpoint_every == 0:
+                writer.flush()
+            now = time.monotonic()
+            if now - last_report >= args.report_interval:
+                print("{} images ({:.1f} images/sec)".format(
+                    count, count / (now - start)), file=sys.stderr)
+                last_report = now
+
+    elapsed = time.monotonic() - start
+    print("processed {} images in {:.1f}s ({:.1f} images/sec); skipped {} "
+          "already processed; {} failed".format(
+              count, elapsed, count / max(elapsed, 1e-9), skipped, failed),
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+def convert(args: argparse.Namespace) -> int:
+    """Converts a frozen inference graph into a TensorFlow Lite model"""
+    import detection_models.backends
+    import detection_models.utils
+
+    representative_images = [
+        detection_models.utils.load_image_as_array(path)
+        for path in args.representative_images
+    ]
+    output_path = detection_models.backends.convert_to_tflite(
+        args.model,
+        args.output,
+        args.input_size,
+        quantization=args.quantization,
+        representative_images=representative_images,
+        input_array=args.input_array,
+        output_arrays=args.output_arrays)
+    print("wrote {} ({} bytes)".format(output_path,
+                                       output_path.stat().st_size))
+    return 0
+
+
+def serve(args: argparse.Namespace) -> int:
+    """Hosts detectors behind a local socket until interrupted"""
+    import detection_models
+    import detection_models.server
+
+    if not args.model and not args.mask_model:
+        raise SystemExit("serve: at least one --model or --mask-model is "
+                         "required")
+    options = detection_models.SessionOptions(intra_op_threads=args.threads)
+    detectors = {}
+    for models, detector_class in (
+            (args.model, detection_models.BBoxDetector),
+            (args.mask_model, detection_models.MaskDetector)):
+        for name, model_path, label_map_path in models:
+            if name in detectors:
+                raise SystemExit(
+                    "serve: duplicate model name {!r}".format(name))
+            detectors[name] = detector_class(Path(model_path),
+                                             Path(label_map_path),
+                                             max_batch_size=args.batch_size,
+                                             options=options)
+
+    server = detection_models.server.DetectionServer(
+        detectors, args.socket, max_delay=args.max_delay)
+    print("serving {} on {}".format(", ".join(sorted(detectors)),
+                                    args.socket), file=sys.stderr)
+    server.serve_forever()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="detection-models",
+        description="Tools for TensorFlow Object Detection API models")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_detect = subparsers.add_parser(
+        "detect",
+        help="detect objects in a set of images",
+        description="Runs a model over images, appending the results to a "
+        "results store (see detection_models.serialization). Images already "
+        "in the store are skipped, so an interrupted run resumes where it "
+        "stopped.")
+    parser_detect.add_argument(
+        "model", type=Path, help="the frozen inference graph (.pb) or TFLite "
+        "model (.tflite)")
+    parser_detect.add_argument("label_map", type=Path,
+                               help="the label map (.pbtxt)")
+    parser_detect.add_argument(
+        "inputs", nargs="+", metavar="INPUT",
+        help="an image, directory, glob, TFRecord of tf.Examples "
+        "({}), or list of image paths ({})".format(
+            ", ".join(TFRECORD_EXTENSIONS), ", ".join(LIST_EXTENSIONS)))
+    parser_detect.add_argument("-o", "--output", type=Path, required=True,
+                               help="the results store to append to")
+    parser_detect.add_argument(
+        "--threshold", type=float, default=0.5,
+        help="the minimum detection score (default: %(default)s)")
+    parser_detect.add_argument(
+        "--batch-size", type=int, default=8,
+        help="the number of images per model run (default: %(default)s)")
+    parser_detect.add_argument(
+        "--decode-workers", type=int, default=4,
+        help="the number of image decoding threads (default: %(default)s)")
+    parser_detect.add_argument(
+        "--prefetch", type=int, default=32,
+        help="the maximum number of images decoded ahead of the model "
+        "(default: %(default)s)")
+    parser_detect.add_argument(
+        "--threads", type=int,
+        help="the number of threads each TensorFlow op may use")
+    parser_detect.add_argument("--backend", choices=("session", "tflite"),
+                               help="the inference backend")
+    parser_detect.add_argument(
+        "--encoded-input", action="store_true",
+        help="decode images inside the TensorFlow graph")
+    parser_detect.add_argument(
+        "--checkpoint-every", type=int, default=256, metavar="IMAGES",
+        help="flush the results store every IMAGES images "
+        "(default: %(default)s)")
+    parser_detect.add_argument(
+        "--report-interval", type=float, default=10.0, metavar="SECONDS",
+        help="report throughput every SECONDS seconds "
+        "(default: %(default)s)")
+    parser_detect.set_defaults(function=detect)
+
+    parser_convert = subparsers.add_parser(
+        "convert",
+        help="convert a frozen inference graph into a TFLite model",
+        description="Converts a frozen inference graph (.pb) into a "
+        "TensorFlow Lite model (.tflite) that can be loaded with "
+        "backend=\"tflite\".")
+    parser_convert.add_argument("model", type=Path,
+                                help="the frozen inference graph (.pb)")
+    parser_convert.add_argument("output", type=Path,
+                                help="the TFLite model (.tflite) to write")
+    parser_convert.add_argument(
+        "--input-size", type=_parse_size, required=True,
+        metavar="HEIGHTxWIDTH", help="the fixed input size of the model")
+    parser_convert.add_argument(
+        "--quantization", choices=("dynamic", "float16", "int8"),
+        help="quantize the model's weights (and, for int8, activations)")
+    parser_convert.add_argument(
+        "--representative-images", type=Path, nargs="+", default=[],
+        metavar="IMAGE", help="images used to calibrate int8 quantization")
+    parser_convert.add_argument(
+        "--input-array", help="the name of the graph's input placeholder "
+        "(default: image_tensor)")
+    parser_convert.add_argument(
+        "--output-arrays", nargs="+", metavar="NAME",
+        help="the names of the graph's outputs (default: the Object "
+        "Detection API outputs the graph provides)")
+    parser_convert.set_defaults(function=convert)
+
+    parser_serve = subparsers.add_parser(
+        "serve",
+        help="host models for local clients",
+        description="Hosts models behind a Unix domain socket, so that "
+        "local processes share one loaded copy of each model; connect with "
+        "detection_models.server.DetectionClient. Requests from all clients "
+        "are run together in batches.")
+    parser_serve.add_argument("socket", type=Path,
+                              help="the path of the socket to listen on")
+    parser_serve.add_argument(
+        "--model", nargs=3, action="append", default=[],
+        metavar=("NAME", "MODEL", "LABEL_MAP"),
+        help="host a bounding box model under NAME (repeatable)")
+    parser_serve.add_argument(
+        "--mask-model", nargs=3, action="append", default=[],
+        metavar=("NAME", "MODEL", "LABEL_MAP"),
+        help="host a mask model under NAME (repeatable)")
+    parser_serve.add_argument(
+        "--batch-size", type=int, default=8,
+        help="the maximum number of images per model run "
+        "(default: %(default)s)")
+    parser_serve.add_argument(
+        "--max-delay", type=float, default=0.005, metavar="SECONDS",
+        help="the maximum time to wait for more requests before running a "
+        "batch (default: %(default)s)")
+    parser_serve.add_argument(
+        "--threads", type=int,
+        help="the number of threads each TensorFlow op may use")
+    parser_serve.set_defaults(function=serve)
+
+    return parser
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """Runs the command line tool
+
+    Args:
+        argv (Sequence[str], optional): Defaults to `sys.argv[1:]`. The
+            command line arguments
+
+    Returns:
+        int: the exit status
+    """
+
+    args = build_parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+import detection_models.ops
+import detection_models.results
+import detection_models.utils
+
+
+class EnsembleDetector:
+    """Runs several detectors on the same images and fuses their detections
+
+    Each image is decoded once and passed to every member detector; the
+    members' tf.Session.run() calls release the GIL, so they run concurrently
+    on a pool of threads (one per member). The members may have different
+    label maps: labels are reconciled by name (optionally through
+    `label_aliases`) into one label table shared by the fused results.
+
+    Detections are fused per class either with weighted box fusion (which
+    averages the overlapping boxes of all members, see
+    `detection_models.ops.weighted_box_fusion`) or with non-max suppression
+    (which keeps the highest scoring of the overlapping boxes).
+
+    The ensemble mirrors the `detect`/`detect_batch` API of `ObjectDetector`
+    and can be used as a context manager, which calls `close` on exit.
+
+    Attributes:
+        detectors (list): the member `ObjectDetector`s; their results must be
+            `detection_models.results.ColumnarDetectionResults`
+        fusion (str): "wbf" for weighted box fusion or "nms" for non-max
+            suppression
+        iou_threshold (float): the IoU above which detections of the same
+            class are fused (or suppressed)
+        weights (np.ndarray): the weight of each member's detections
+        label_table (np.ndarray): an object array mapping the class IDs of
+            the fused results (as indices) to labels
+    """
+
+    FUSION_METHODS = ("wbf", "nms")
+
+    def __init__(self,
+                 detectors: Sequence,
+                 fusion: str = "wbf",
+                 iou_threshold: float = 0.55,
+                 weights: Sequence[float] = None,
+                 label_aliases: Dict[str, str] = None):
+        """Creates an ensemble of detectors
+
+        Args:
+            detectors (Sequence): the member detectors (e.g.
+                `detection_models.BBoxDetector`s of different models)
+            fusion (str, optional): Defaults to "wbf". The fusion method;
+                "wbf" (weighted box fusion) or "nms" (non-max suppression)
+            iou_threshold (float, optional): Defaults to 0.55. The IoU above
+                which detections of the same class are fused (or suppressed)
+            weights (Sequence[float], optional): Defaults to equal weights.
+                The weight of each member's detections
+            label_aliases (dict, optional): Defaults to None. Maps labels of
+                the members' label maps to the label they are reported as,
+                e.g. {"motorbike": "motorcycle"}
+        """
+
+        if not detectors:
+            raise ValueError("an ensemble needs at least one detector")
+        if fusion not in self.FUSION_METHODS:
+            raise ValueError("fusion must be one of {}, not {!r}".format(
+                self.FUSION_METHODS, fusion))
+        if weights is None:
+            weights = np.ones(len(detectors), dtype=np.float32)
+        weights = np.asarray(weights, dtype=np.float32)
+        if weights.shape != (len(detectors), ):
+            raise ValueError("expected one weight per detector")
+
+        self.detectors = list(detectors)
+        self.fusion = fusion
+        self.iou_threshold = iou_threshold
+        self.weights = weights
+        self._label_aliases = dict(label_aliases or {})
+        self._label_ids = {}
+        self.label_table = np.array([None], dtype=object)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.detectors))
+
+    def _unified_class_ids(
+            self, results: detection_models.results.ColumnarDetectionResults
+    ) -> np.ndarray:
+        """Maps the class IDs of a member's results into `label_table`"""
+        member_ids, inverse = np.unique(results.class_ids,
+                                        return_inverse=True)
+        unified = np.empty(len(member_ids), dtype=np.int64)
+        with self._lock:
+            for i, label in enumerate(
+                    detection_models.results.lookup_labels(
+                        results.label_table, member_ids)):
+                label = self._label_aliases.get(label, label)
+                class_id = self._label_ids.get(label)
+                if class_id is None:
+                    class_id = len(self.label_table)
+                    self._label_ids[label] = class_id
+                    self.label_table = np.append(
+                        self.label_table, np.array([label], dtype=object))
+                unified[i] = class_id
+        return unified[inverse.reshape(-1)]
+
+    def _fuse(self,
+              member_results: List[
+                  detection_models.results.ColumnarDetectionResults]
+              ) -> detection_models.results.ColumnarDetectionResults:
+        """Fuses the results of all members for one image"""
+        boxes = np.concatenate([results.boxes for results in member_results])
+        scores = np.concatenate(
+            [results.scores for results in member_results])
+        class_ids = np.concatenate(
+            [self._unified_class_ids(results) for results in member_results])
+        model_ids = np.repeat(
+            np.arange(len(member_results)),
+            [len(results.scores) for results in member_results])
+
+        if self.fusion == "wbf":
+            fused = detection_models.ops.weighted_box_fusion(
+                boxes, scores, class_ids, model_ids, len(member_results),
+                self.iou_threshold, self.weights)
+            boxes, scores, class_ids = fused
+        else:
+            keep = detection_models.ops.non_max_suppression(
+                boxes, scores * self.weights[model_ids], self.iou_threshold,
+                class_ids)
+            boxes, scores, class_ids = (boxes[keep], scores[keep],
+                                        class_ids[keep])
+
+        return detection_models.results.ColumnarDetectionResults(
+            boxes=boxes,
+            scores=scores,
+            class_ids=class_ids,
+            label_table=self.label_table)
+
+    def detect(self, image, detection_threshold: float = 0.5
+               ) -> detection_models.results.DetectionResults:
+        """Performs object detection with every member and fuses the results
+
+        Args:
+            image (np.ndarray or ImageSource): an image loaded into memory as
+                a numpy array in the RGB colorspace (height, width, 3), or
+                anything accepted by `detection_models.utils.load_image`,
+                which is then decoded once for all members
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard each member's low-scoring detections;
+                with weighted box fusion, the fused score of a detection that
+                only some members found is scaled down and may fall below it
+
+        Returns:
+            detection_models.results.DetectionResults: the fused prediction
+                results for the image
+        """
+
+        return self.detect_batch([image], detection_threshold)[0]
+
+    def detect_batch(self,
+                     images: Sequence,
+                     detection_threshold: float = 0.5,
+                     max_batch_size: int = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection on many images with every member
+
+        Each member runs `detect_batch` on all of the images concurrently with
+        the other members.
+
+        Args:
+            images (Sequence): images loaded into memory as numpy arrays in
+                the RGB colorspace (height, width, 3), or anything accepted by
+                `detection_models.utils.load_image`
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard each member's low-scoring detections
+            max_batch_size (int, optional): Defaults to each member's
+                `max_batch_size`. The maximum number of images fed to a model
+                at once
+
+        Returns:
+            list: one fused `detection_models.results.DetectionResults` per
+                image, in the same order as `images`
+        """
+
+        images = [
+            image if isinstance(image, np.ndarray) else
+            detection_models.utils.load_image(image) for image in images
+        ]
+        futures = [
+            self._executor.submit(detector.detect_batch, images,
+                                  detection_threshold, max_batch_size)
+            for detector in self.detectors
+        ]
+        member_results = [future.result() for future in futures]
+        return [
+            self._fuse(list(image_results))
+            for image_results in zip(*member_results)
+        ]
+
+    def close(self) -> None:
+        """Shuts down the thread pool; the members are left open"""
+        self._executor.shutdown()
+
+    def __enter__(self) -> "EnsembleDetector":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
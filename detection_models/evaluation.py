@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Streaming COCO-style evaluation of detection results
+
+Detections are matched to ground truth image by image, and only the outcome
+of each match is kept: per label and IoU threshold, the number of true and
+false positives in each of a fixed number of score bins. Memory use is
+therefore independent of the number of images evaluated, and evaluators of
+disjoint image sets can be merged.
+"""
+
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from typing import Iterable, Sequence, Tuple
+
+import numpy as np
+
+import detection_models.ops
+import detection_models.results
+
+# the IoU thresholds COCO averages over (0.5, 0.55, ..., 0.95)
+COCO_IOU_THRESHOLDS = tuple(np.round(np.linspace(0.5, 0.95, 10), 2))
+
+# the recall levels COCO interpolates precision at (0, 0.01, ..., 1)
+RECALL_LEVELS = np.linspace(0.0, 1.0, 101)
+
+GroundTruth = namedtuple("GroundTruth", ["boxes", "labels"])
+GroundTruth.__doc__ = """The ground truth objects of one image
+
+Attributes:
+    boxes (np.ndarray): the normalized [ymin, xmin, ymax, xmax] box of each
+        object (N, 4)
+    labels (Sequence[str]): the label of each object (N,)
+"""
+
+
+class Evaluator:
+    """Accumulates COCO-style average precision and recall over images
+
+    Each image's detections (at most `max_detections`, highest scoring
+    first) are matched to its ground truth per label and per IoU threshold,
+    in order of descending score; a detection is a true positive if it
+    overlaps an unmatched ground truth object by at least the threshold.
+    Scores are accumulated into `score_bins` equal bins on [0, 1], so
+    precision is evaluated at the bin edges; with the default 1000 bins the
+    result is within about 0.001 of an exact computation.
+
+    Boxes are normalized, so the COCO small/medium/large breakdown (which
+    depends on pixel areas) is not computed.
+
+    Attributes:
+        labels (tuple): the labels evaluated; detections of other labels are
+            ignored
+        iou_thresholds (np.ndarray): the IoU thresholds matches are evaluated
+            at (T,)
+        max_detections (int): the maximum number of detections per image
+        num_images (int): the number of images evaluated so far
+        num_ground_truth (np.ndarray): the number of ground truth objects of
+            each label (L,)
+        true_positives (np.ndarray): the number of true positives in each
+            score bin, per label and IoU threshold (L, T, score_bins)
+        false_positives (np.ndarray): the number of false positives in each
+            score bin, per label and IoU threshold (L, T, score_bins)
+    """
+
+    def __init__(self,
+                 labels: Sequence[str],
+                 iou_thresholds: Sequence[float] = COCO_IOU_THRESHOLDS,
+                 max_detections: int = 100,
+                 score_bins: int = 1000):
+        """Creates an empty evaluator
+
+        Args:
+            labels (Sequence[str]): the labels to evaluate
+            iou_thresholds (Sequence[float], optional): Defaults to 0.5,
+                0.55, ..., 0.95. The IoU thresholds to evaluate at
+            max_detections (int, optional): Defaults to 100. The maximum
+                number of detections per image
+            score_bins (int, optional): Defaults to 1000. The number of bins
+                scores are accumulated into
+        """
+
+        self.labels = tuple(labels)
+        self._label_indices = {
+            label: i
+            for i, label in enumerate(self.labels)
+        }
+        self.iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+        self.max_detections = max_detections
+        self.num_images = 0
+        shape = (len(self.labels), len(self.iou_thresholds), score_bins)
+        self.num_ground_truth = np.zeros(len(self.labels), dtype=np.int64)
+        self.true_positives = np.zeros(shape, dtype=np.int64)
+        self.false_positives = np.zeros(shape, dtype=np.int64)
+        self._label_tables = {}
+
+    @classmethod
+    def from_label_map(cls, label_map_path: Path, **kwargs) -> "Evaluator":
+        """Creates an evaluator for the labels of a label map
+
+        Args:
+            label_map_path (pathlib.Path): the label map (.pbtxt)
+            **kwargs: passed on to `Evaluator`
+
+        Returns:
+            Evaluator: an empty evaluator
+        """
+
+        import detection_models.loading
+
+        category_index, _ = detection_models.loading.load_label_map(
+            label_map_path)
+        return cls([
+            category["name"]
+            for _, category in sorted(category_index.items())
+        ], **kwargs)
+
+    def _label_indices_of(self, results) -> np.ndarray:
+        """Maps the class IDs of results to label indices (-1 if ignored)"""
+        label_table = results.label_table
+        cached = self._label_tables.get(id(label_table))
+        if cached is None or cached[0] is not label_table:
+            indices = np.array(
+                [self._label_indices.get(label, -1) for label in label_table],
+                dtype=np.int64)
+            cached = self._label_tables[id(label_table)] = (label_table,
+                                                            indices)
+        class_ids = results.class_ids
+        # class IDs beyond the label table are unknown, and never evaluated
+        known = class_ids < len(cached[1])
+        return np.where(known, cached[1][np.where(known, class_ids, 0)], -1)
+
+    def _match(self, scores: np.ndarray, iou: np.ndarray) -> np.ndarray:
+        """Matches one label's detections to its ground truth
+
+        Args:
+            scores (np.ndarray): the detection scores, descending (D,)
+            iou (np.ndarray): the IoU of each detection with each ground
+                truth object (D, G)
+
+        Returns:
+            np.ndarray: whether each detection is a true positive at each IoU
+                threshold (T, D)
+        """
+
+        thresholds = self.iou_thresholds[:, None]
+        if iou.shape[1] == 0:
+            return np.zeros((len(thresholds), len(scores)), dtype=bool)
+        matched = np.zeros((len(thresholds), iou.shape[1]), dtype=bool)
+        true_positive = np.zeros((len(thresholds), len(scores)), dtype=bool)
+        for d in range(len(scores)):
+            candidates = np.where(matched | (iou[d] < thresholds), -1.0,
+                                  iou[d])
+            best = np.argmax(candidates, axis=1)
+            hit = candidates[np.arange(len(thresholds)), best] >= 0
+            matched[hit, best[hit]] = True
+            true_positive[:, d] = hit
+        return true_positive
+
+    def add(self, results: detection_models.results.ColumnarDetectionResults,
+            ground_truth: GroundTruth) -> None:
+        """Evaluates the detections of one image
+
+        Args:
+            results (detection_models.results.ColumnarDetectionResults): the
+                detections of the image, e.g. as returned by
+                `BBoxDetector.detect` (at a low detection threshold)
+            ground_truth (GroundTruth): the ground truth objects of the image
+
+        Raises:
+            ValueError: if a ground truth label is not evaluated
+        """
+
+        gt_boxes = np.asarray(ground_truth.boxes,
+                              dtype=np.float32).reshape(-1, 4)
+        try:
+            gt_labels = np.array(
+                [self._label_indices[label] for label in ground_truth.labels],
+                dtype=np.int64)
+        except KeyError as e:
+            raise ValueError("unknown ground truth label {!r}".format(
+                e.args[0]))
+
+        keep = slice(0, self.max_detections)
+        labels = self._label_indices_of(results)[keep]
+        boxes = results.boxes[keep]
+        scores = results.scores[keep]
+        score_bins = self.true_positives.shape[2]
+        bins = np.clip((scores * score_bins).astype(np.int64), 0,
+                       score_bins - 1)
+
+        self.num_images += 1
+        np.add.at(self.num_ground_truth, gt_labels, 1)
+        for label in np.unique(labels[labels >= 0]):
+            detections = np.flatnonzero(labels == label)
+            objects = np.flatnonzero(gt_labels == label)
+            true_positive = self._match(
+                scores[detections],
+                detection_models.ops.iou_matrix(boxes[detections],
+                                                gt_boxes[objects]))
+            detection_bins = bins[detections]
+            for counts, outcome in ((self.true_positives, true_positive),
+                                    (self.false_positives, ~true_positive)):
+                thresholds, positions = np.nonzero(outcome)
+                np.add.at(counts[label],
+                          (thresholds, detection_bins[positions]), 1)
+
+    def add_all(self, pairs: Iterable[Tuple[
+            detection_models.results.ColumnarDetectionResults, GroundTruth]]
+                ) -> "Evaluator":
+        """Evaluates a stream of (results, ground truth) pairs
+
+        Args:
+            pairs (Iterable): (results, ground_truth) tuples; see `add`
+
+        Returns:
+            Evaluator: `self`
+        """
+
+        for results, ground_truth in pairs:
+            self.add(results, ground_truth)
+        return self
+
+    def merge(self, other: "Evaluator") -> "Evaluator":
+        """Adds the images evaluated by another (compatible) evaluator
+
+        Args:
+            other (Evaluator): an evaluator with the same labels, IoU
+                thresholds, and number of score bins
+
+        Returns:
+            Evaluator: `self`
+        """
+
+        if (other.labels != self.labels
+                or other.true_positives.shape != self.true_positives.shape
+                or not np.allclose(other.iou_thresholds,
+                                   self.iou_thresholds)):
+            raise ValueError("cannot merge incompatible evaluators")
+        self.num_images += other.num_images
+        self.num_ground_truth += other.num_ground_truth
+        self.true_positives += other.true_positives
+        self.false_positives += other.false_positives
+        return self
+
+    def precision_recall(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Computes the precision-recall curves
+
+        Returns:
+            tuple: the interpolated precision at each of `RECALL_LEVELS`
+                (L, T, 101), and the recall at `max_detections` (L, T); both
+                are NaN for labels without ground truth
+        """
+
+        # cumulative counts from the highest score bin down
+        true_positives = np.cumsum(self.true_positives[..., ::-1], axis=-1)
+        false_positives = np.cumsum(self.false_positives[..., ::-1], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            recall = true_positives / self.num_ground_truth[:, None, None]
+            precision = true_positives / np.maximum(
+                true_positives + false_positives, 1)
+        # make precision non-increasing in recall, as COCO does
+        precision = np.maximum.accumulate(precision[..., ::-1], axis=-1)
+        precision = precision[..., ::-1]
+
+        interpolated = np.zeros(precision.shape[:2] + RECALL_LEVELS.shape)
+        for index in np.ndindex(*precision.shape[:2]):
+            positions = np.searchsorted(recall[index], RECALL_LEVELS,
+                                        side="left")
+            found = positions < recall.shape[-1]
+            interpolated[index][found] = precision[index][positions[found]]
+
+        missing = self.num_ground_truth == 0
+        interpolated[missing] = np.nan
+        final_recall = recall[..., -1]
+        final_recall[missing] = np.nan
+        return interpolated, final_recall
+
+    def summarize(self) -> dict:
+        """Computes COCO-style AP and AR, overall and per label
+
+        Returns:
+            dict: "AP" (averaged over IoU thresholds), "AP50" and "AP75" (if
+                those thresholds are evaluated), and "AR" (at
+                `max_detections`, averaged over IoU thresholds), each
+                averaged over the labels with ground truth; and "labels", a
+                `collections.OrderedDict` of the same metrics (plus
+                "num_ground_truth") for each label. Metrics of labels without
+                ground truth are NaN
+        """
+
+        precision, recall = self.precision_recall()
+        average_precision = precision.mean(axis=-1)
+
+        def metrics(ap: np.ndarray, ar: np.ndarray) -> OrderedDict:
+            summary = OrderedDict([("AP", float(ap.mean()))])
+            for name, threshold in (("AP50", 0.5), ("AP75", 0.75)):
+                matches = np.flatnonzero(
+                    np.isclose(self.iou_thresholds, threshold))
+                if len(matches):
+                    summary[name] = float(ap[matches[0]])
+            summary["AR"] = float(ar.mean())
+            return summary
+
+        evaluated = self.num_ground_truth > 0
+        if evaluated.any():
+            summary = metrics(average_precision[evaluated].mean(axis=0),
+                              recall[evaluated].mean(axis=0))
+        else:
+            summary = metrics(np.full(len(self.iou_thresholds), np.nan),
+                              np.full(len(self.iou_thresholds), np.nan))
+
+        summary["labels"] = OrderedDict()
+        for i, label in enumerate(self.labels):
+            label_summary = metrics(average_precision[i], recall[i])
+            label_summary["num_ground_truth"] = int(self.num_ground_truth[i])
+            summary["labels"][label] = label_summary
+        return summary
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Sequence
+
+# the stages of a detection call, in order
+STAGES = ("prepare", "session_run", "convert_outputs", "build_results")
+
+# default histogram buckets (upper bounds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DETECTION_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class DetectionHook:
+    """A callback interface for observing a detector's work
+
+    Subclasses override any of the methods below; hooks are called
+    synchronously on the thread running the detector, so they should be cheap.
+    """
+
+    def on_stage(self, stage: str, seconds: float) -> None:
+        """Called after each stage (see `STAGES`) of a detection call"""
+
+    def on_batch(self, batch_size: int) -> None:
+        """Called for each batch of images run through the model"""
+
+    def on_detections(self, count: int) -> None:
+        """Called with the number of detections kept for each image"""
+
+
+class Histogram:
+    """A cumulative histogram in the style of a Prometheus histogram
+
+    Attributes:
+        buckets (tuple): the upper bounds of the buckets, ascending
+        counts (list): the number of observations in each bucket (not
+            cumulative), with a final overflow bucket
+        total (float): the sum of all observations
+        count (int): the number of observations
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def _prometheus_lines(self, name: str, labels: str = "") -> Iterable[str]:
+        separator = "," if labels else ""
+        cumulative = itertools.accumulate(self.counts)
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, cumulative):
+            yield '{}_bucket{{{}{}le="{}"}} {}'.format(
+                name, labels, separator, bound, count)
+        braces = "{{{}}}".format(labels) if labels else ""
+        yield "{}_sum{} {!r}".format(name, braces, float(self.total))
+        yield "{}_count{} {}".format(name, braces, self.count)
+
+
+class MetricsHook(DetectionHook):
+    """Collects latency, detection count, and batch size histograms
+
+    Attributes:
+        stage_seconds (collections.OrderedDict): a `Histogram` of the
+            latency (in seconds) of each stage, keyed by stage name
+        detections_per_image (Histogram): the number of detections kept per
+            image
+        batch_sizes (Histogram): the number of images per model run
+    """
+
+    def __init__(self,
+                 latency_buckets: Sequence[float] = LATENCY_BUCKETS,
+                 detection_buckets: Sequence[float] = DETECTION_BUCKETS,
+                 batch_size_buckets: Sequence[float] = BATCH_SIZE_BUCKETS):
+        self._latency_buckets = latency_buckets
+        self.stage_seconds = OrderedDict(
+            (stage, Histogram(latency_buckets)) for stage in STAGES)
+        self.detections_per_image = Histogram(detection_buckets)
+        self.batch_sizes = Histogram(batch_size_buckets)
+        self._lock = threading.Lock()
+
+    def on_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.stage_seconds.get(stage)
+            if histogram is None:
+                histogram = self.stage_seconds[stage] = Histogram(
+                    self._latency_buckets)
+            histogram.observe(seconds)
+
+    def on_batch(self, batch_size: int) -> None:
+        with self._lock:
+            self.batch_sizes.observe(batch_size)
+
+    def on_detections(self, count: int) -> None:
+        with self._lock:
+            self.detections_per_image.observe(count)
+
+    def to_prometheus(self, prefix: str = "detection_models") -> str:
+        """Exports the histograms in the Prometheus text exposition format
+
+        Args:
+            prefix (str, optional): Defaults to "detection_models". The prefix
+                of each metric name
+
+        Returns:
+            str: the metrics, ready to be served on a /metrics endpoint
+        """
+
+        lines = []
+        with self._lock:
+            name = prefix + "_stage_seconds"
+            lines += [
+                "# HELP {} Time spent in each stage of detection".format(name),
+                "# TYPE {} histogram".format(name),
+            ]
+            for stage, histogram in self.stage_seconds.items():
+                lines += histogram._prometheus_lines(
+                    name, 'stage="{}"'.format(stage))
+
+            for suffix, histogram, description in (
+                ("_detections_per_image", self.detections_per_image,
+                 "Number of detections kept per image"),
+                ("_batch_size", self.batch_sizes,
+                 "Number of images per model run"),
+            ):
+                lines += [
+                    "# HELP {} {}".format(prefix + suffix, description),
+                    "# TYPE {} histogram".format(prefix + suffix),
+                ]
+                lines += histogram._prometheus_lines(prefix + suffix)
+        return "\n".join(lines) + "\n"
+
+
+class Instrumentation:
+    """Dispatches a detector's timings and counters to hooks
+
+    Assign an `Instrumentation` to `ObjectDetector.instrumentation` (or pass
+    one to the constructor) to time each stage of detection (see `STAGES`)
+    and count batches and detections. Detectors without instrumentation skip
+    all of this.
+
+    If `trace_dir` is set, every `trace_every`-th model run is made with
+    `RunOptions(trace_level=FULL_TRACE)`, and the resulting step statistics
+    are saved to `trace_dir` as a Chrome trace (open it at
+    chrome://tracing), which shows where time is spent inside TensorFlow.
+    Trace files are named after the time they were saved, the process ID and
+    a per-process counter, so several processes (or restarts) can share a
+    `trace_dir`. Tracing slows down the traced runs considerably.
+
+    Attributes:
+        hooks (list): the `DetectionHook`s notified of each event
+        trace_dir (pathlib.Path): the directory traces are saved to; tracing
+            is disabled if None
+        trace_every (int): the sampling interval of traced model runs
+    """
+
+    def __init__(self,
+                 hooks: Sequence[DetectionHook] = (),
+                 trace_dir: Path = None,
+                 trace_every: int = 100):
+        """Creates instrumentation
+
+        Args:
+            hooks (Sequence[DetectionHook], optional): Defaults to no hooks.
+                The hooks to notify
+            trace_dir (pathlib.Path, optional): Defaults to None. The
+                directory Chrome traces are saved to; created if necessary.
+                Tracing is disabled if None
+            trace_every (int, optional): Defaults to 100. Trace one in every
+                `trace_every` model runs (starting with the first)
+        """
+
+        if trace_every < 1:
+            raise ValueError("trace_every must be a positive integer")
+        self.hooks = list(hooks)
+        self.trace_dir = Path(trace_dir) if trace_dir is not None else None
+        self.trace_every = trace_every
+        self._runs = itertools.count()
+        self._traces = itertools.count()
+
+    def stage(self, stage: str, seconds: float) -> None:
+        for hook in self.hooks:
+            hook.on_stage(stage, seconds)
+
+    def batch(self, batch_size: int) -> None:
+        for hook in self.hooks:
+            hook.on_batch(batch_size)
+
+    def detections(self, count: int) -> None:
+        for hook in self.hooks:
+            hook.on_detections(count)
+
+    def should_trace(self) -> bool:
+        """Returns whether the next model run should be traced"""
+        if self.trace_dir is None:
+            return False
+        return next(self._runs) % self.trace_every == 0
+
+    def save_trace(self, run_metadata) -> Path:
+        """Saves the step statistics of a traced run as a Chrome trace
+
+        Args:
+            run_metadata (tf.RunMetadata): the metadata of a run made with
+                `RunOptions(trace_level=FULL_TRACE)`
+
+        Returns:
+            pathlib.Path: the trace file written
+        """
+
+        from tensorflow.python.client import timeline
+
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        path = self.trace_dir / "trace_{}_{}_{:06d}.json".format(
+            time.strftime("%Y%m%dT%H%M%S"), os.getpid(), next(self._traces))
+        # "x" never overwrites an existing trace
+        with open(str(path), "x") as f:
+            f.write(
+                timeline.Timeline(
+                    run_metadata.step_stats).generate_chrome_trace_format())
+        return path
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+import detection_models.backends
+import detection_models.options
+import detection_models.utils
+
+# the output tensors a TF Object Detection API frozen graph may provide
+OUTPUT_TENSOR_KEYS = ('num_detections', 'detection_boxes', 'detection_scores',
+                      'detection_classes', 'detection_masks')
+
+# the name of the input placeholder of a TF Object Detection API graph
+INPUT_TENSOR_KEY = 'image_tensor'
+
+# the name of the placeholder fed with encoded images by `load_model` when
+# in-graph decoding is enabled
+ENCODED_INPUT_TENSOR_KEY = 'encoded_image_tensor'
+
+# the name scope of the filtered outputs (and the placeholders controlling
+# them) added by `load_model` when in-graph filtering is enabled
+FILTER_SCOPE = 'filtered'
+FILTER_THRESHOLD_KEY = 'detection_threshold'
+FILTER_CLASSES_KEY = 'allowed_classes'
+FILTER_MAX_DETECTIONS_KEY = 'max_detections'
+
+# bumped whenever the format of the cached metadata files changes
+METADATA_VERSION = 2
+
+LABEL_TABLE_SUFFIX = ".labels.json"
+DIGEST_SUFFIX = ".sha256.json"
+
+# the content digests computed by this process, keyed by file identity
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def metadata_cache_dir() -> Path:
+    """Returns the directory the cached model metadata is stored in
+
+    This is `detection_models` under `$XDG_CACHE_HOME`, or under
+    `~/.cache` if that is not set.
+
+    Returns:
+        pathlib.Path: the (possibly not yet existing) cache directory
+    """
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        "~", ".cache")
+    return Path(cache_home).expanduser() / "detection_models"
+
+
+def file_identity(path: Path) -> Tuple[str, int, int, int, int]:
+    """Identifies a file by its resolved path and the status of its inode
+
+    The identity tells whether metadata cached about a file is still valid
+    without reading the file. Besides the modification time and size, which
+    a writer can preserve, it holds the inode number and the inode change
+    time, which change whenever the file is replaced or written (at the
+    granularity of the file system's timestamps).
+
+    Args:
+        path (pathlib.Path): the file to identify
+
+    Returns:
+        tuple: the resolved path, the inode number, the modification and
+            inode change times in nanoseconds, and the size of the file
+    """
+
+    path = Path(path).resolve()
+    stat = path.stat()
+    return (str(path), stat.st_ino, stat.st_mtime_ns, stat.st_ctime_ns,
+            stat.st_size)
+
+
+def file_digest(path: Path, cache_metadata: bool = True) -> str:
+    """Returns the SHA-256 digest of a file's contents
+
+    Hashing a large model file takes a while, so digests are memoized by the
+    file's identity (see `file_identity`): in memory, and in a JSON file in
+    `metadata_cache_dir()`. A file is only hashed again once it has changed.
+
+    Args:
+        path (pathlib.Path): the file to hash
+        cache_metadata (bool, optional): Defaults to True. Whether to read
+            and write the cached digest
+
+    Returns:
+        str: the hex digest of the file's contents
+    """
+
+    identity = file_identity(path)
+    with _digests_lock:
+        digest = _digests.get(identity)
+    if digest is not None:
+        return digest
+
+    cache_path = _metadata_path(path, DIGEST_SUFFIX)
+    metadata = (_read_metadata(cache_path, identity)
+                if cache_metadata else None)
+    if metadata is not None:
+        digest = metadata["sha256"]
+    else:
+        sha256 = hashlib.sha256()
+        with open(str(path), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        if file_identity(path) != identity:
+            # changed while it was being read
+            return digest
+        if cache_metadata:
+            _write_metadata(cache_path, identity, {"sha256": digest})
+
+    with _digests_lock:
+        _digests[identity] = digest
+    return digest
+
+
+def _metadata_path(path: Path, suffix: str) -> Path:
+    """Returns the cached metadata file of a model or label map file"""
+    path = Path(path).resolve()
+    path_digest = hashlib.sha256(str(path).encode("utf-8")).hexdigest()
+    return metadata_cache_dir() / "{}.{}{}".format(
+        path.name, path_digest[:16], suffix)
+
+
+def _read_metadata(path: Path, identity: tuple) -> dict:
+    """Reads a cached metadata file if it matches the given file identity"""
+    try:
+        with open(str(path), "r") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (metadata.get("version") != METADATA_VERSION
+            or metadata.get("file") != list(identity)):
+        return None
+    return metadata
+
+
+def _write_metadata(path: Path, identity: tuple, metadata: dict) -> None:
+    """Writes a metadata file atomically, ignoring unwritable locations"""
+    metadata = dict(metadata, version=METADATA_VERSION, file=list(identity))
+    temp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(temp_path), "w") as f:
+            json.dump(metadata, f)
+        os.replace(str(temp_path), str(path))
+    except OSError:
+        pass
+
+
+def build_label_lookup(category_index: Dict[int, dict]) -> np.ndarray:
+    """Builds an ID->label lookup array from a category index
+
+    Args:
+        category_index (dict): a category index as produced by
+            `label_map_util.create_category_index_from_labelmap`
+
+    Returns:
+        np.ndarray: an object array where index `i` holds the name of the
+            class with ID `i` (or `None` if no such class exists)
+    """
+
+    size = max(category_index.keys(), default=0) + 1
+    label_lookup = np.full(size, None, dtype=object)
+    for class_id, category in category_index.items():
+        label_lookup[class_id] = category["name"]
+    return label_lookup
+
+
+def load_label_map(label_map_path: Path, cache_metadata: bool = True
+                   ) -> Tuple[Dict[int, dict], str]:
+    """Loads a label map as a category index
+
+    Parsing a label map requires the Object Detection API (and its protobuf
+    definitions); the parsed ID->name table is therefore cached in a compact
+    JSON file in `metadata_cache_dir()`, keyed by the label map's identity
+    (see `file_identity`), and read from there on subsequent loads.
+
+    Args:
+        label_map_path (pathlib.Path): the label map (.pbtxt) to load
+        cache_metadata (bool, optional): Defaults to True. Whether to read
+            and write the cached label table and digest
+
+    Returns:
+        tuple: the category index (see
+            `label_map_util.create_category_index_from_labelmap`) and the
+            digest of the label map file (see `file_digest`)
+    """
+
+    label_map_path = Path(label_map_path)
+    identity = file_identity(label_map_path)
+    digest = file_digest(label_map_path, cache_metadata)
+    cache_path = _metadata_path(label_map_path, LABEL_TABLE_SUFFIX)
+
+    if cache_metadata:
+        metadata = _read_metadata(cache_path, identity)
+        if metadata is not None:
+            return {
+                class_id: {
+                    "id": class_id,
+                    "name": name
+                }
+                for class_id, name in metadata["categories"]
+            }, digest
+
+    label_map_util = detection_models.utils.import_object_detection(
+        "utils.label_map_util")
+    category_index = label_map_util.create_category_index_from_labelmap(
+        str(label_map_path.absolute()))
+
+    if cache_metadata:
+        _write_metadata(
+            cache_path, identity, {
+                "categories": [[class_id, category["name"]]
+                               for class_id, category in sorted(
+                                   category_index.items())]
+            })
+    return category_index, digest
+
+
+class LoadedModel:
+    """A model loaded into an inference backend, with its label map
+
+    Attributes:
+        graph (tf.Graph): the graph the frozen inference graph was imported
+            into; None for models not run by a `SessionBackend`
+        session (tf.Session): the session running `graph`; None for models
+            not run by a `SessionBackend`
+        backend (detection_models.backends.InferenceBackend): the backend
+            that runs the model
+        outputs (tuple): the keys of `OUTPUT_TENSOR_KEYS` the graph provides
+        category_index (dict): the model's ID->label associations; see
+            `detection_models.ObjectDetector`
+        label_lookup (np.ndarray): an object array mapping class IDs (as
+            indices) to class names
+        model_digest (str): the digest of the model file (see
+            `file_digest`)
+        label_map_digest (str): the digest of the label map file
+        input_tensor_name (str): the name of the tensor images are fed to;
+            `ENCODED_INPUT_TENSOR_KEY` if the model decodes images in-graph
+        encoded_input (bool): whether the model is fed encoded (JPEG, PNG,
+            etc.) images rather than decoded image arrays
+        input_size (tuple): the (height, width) decoded images are resized
+            to in-graph, or None if they are not resized
+        filter_in_graph (bool): whether detections are filtered in-graph;
+            see `load_model`
+    """
+
+    def __init__(self,
+                 graph: tf.Graph,
+                 session: tf.Session,
+                 outputs: tuple,
+                 category_index: Dict[int, dict],
+                 model_digest: str,
+                 label_map_digest: str,
+                 encoded_input: bool = False,
+                 input_size: Tuple[int, int] = None,
+                 backend: "detection_models.backends.InferenceBackend" = None,
+                 filter_in_graph: bool = False):
+        self.graph = graph
+        self.session = session
+        self.outputs = outputs
+        self.category_index = category_index
+        self.label_lookup = build_label_lookup(category_index)
+        self.model_digest = model_digest
+        self.label_map_digest = label_map_digest
+        self.encoded_input = encoded_input
+        self.input_size = tuple(input_size) if input_size else None
+        self.input_tensor_name = (ENCODED_INPUT_TENSOR_KEY if encoded_input
+                                  else INPUT_TENSOR_KEY) + ":0"
+        self.filter_in_graph = filter_in_graph
+        if backend is None:
+            backend = detection_models.backends.SessionBackend(
+                graph, session, self.input_tensor_name, outputs,
+                FILTER_SCOPE if filter_in_graph else None)
+        self.backend = backend
+
+    @property
+    def fingerprint(self) -> str:
+        """str: a digest identifying both the frozen graph and the label map"""
+        return hashlib.sha256(
+            (self.model_digest + self.label_map_digest).encode(
+                "ascii")).hexdigest()
+
+
+def _decode_images(encoded_images: tf.Tensor,
+                   input_size: Tuple[int, int] = None) -> tf.Tensor:
+    """Builds ops that decode (and optionally resize) a batch of images
+
+    Args:
+        encoded_images (tf.Tensor): a string tensor of encoded images (batch,)
+        input_size (tuple, optional): Defaults to None. The (height, width)
+            to resize the decoded images to; the images of a batch must all
+            have the same size if None
+
+    Returns:
+        tf.Tensor: the decoded RGB images (batch, height, width, 3), uint8
+    """
+
+    def decode(encoded_image):
+        image = tf.image.decode_image(
+            encoded_image, channels=3, expand_animations=False)
+        image.set_shape([None, None, 3])
+        if input_size is not None:
+            image = tf.cast(
+                tf.round(tf.image.resize_images(image, input_size)),
+                tf.uint8)
+        return image
+
+    return tf.map_fn(
+        decode, encoded_images, dtype=tf.uint8, back_prop=False)
+
+
+def _filter_detections(graph: tf.Graph, outputs: tuple) -> None:
+    """Adds ops that filter the detections of a graph before they are fetched
+
+    Each image's valid detections are filtered by score (at least the
+    `FILTER_THRESHOLD_KEY` placeholder, 0 by default) and class (one of the
+    `FILTER_CLASSES_KEY` placeholder's class IDs; any class if empty, the
+    default), and at most `FILTER_MAX_DETECTIONS_KEY` (unlimited by default)
+    of the highest scoring survivors are kept. The survivors are packed into
+    outputs under `FILTER_SCOPE` that are only as wide as the largest number
+    of survivors of any image in the batch.
+
+    Args:
+        graph (tf.Graph): a graph with the imported detection outputs
+        outputs (tuple): the keys of `OUTPUT_TENSOR_KEYS` the graph provides
+    """
+
+    required_keys = ('num_detections', 'detection_boxes', 'detection_scores',
+                     'detection_classes')
+    missing_keys = set(required_keys) - set(outputs)
+    if missing_keys:
+        raise ValueError(
+            "in-graph filtering requires the output tensors {}".format(
+                sorted(missing_keys)))
+
+    with graph.as_default(), tf.name_scope(FILTER_SCOPE + "/"):
+        tensors = {
+            key: graph.get_tensor_by_name(key + ":0")
+            for key in outputs
+        }
+        threshold = tf.placeholder_with_default(
+            0.0, [], name=FILTER_THRESHOLD_KEY)
+        allowed_classes = tf.placeholder_with_default(
+            tf.zeros([0], tf.float32), [None], name=FILTER_CLASSES_KEY)
+        max_detections = tf.placeholder_with_default(
+            np.int32(np.iinfo(np.int32).max), [],
+            name=FILTER_MAX_DETECTIONS_KEY)
+
+        scores = tensors['detection_scores']
+        classes = tensors['detection_classes']
+        positions = tf.range(tf.shape(scores)[1])[tf.newaxis]
+        keep = tf.logical_and(
+            positions < tf.cast(tensors['num_detections'], tf.int32)[:, None],
+            scores >= threshold)
+        class_allowed = tf.logical_or(
+            tf.equal(tf.size(allowed_classes), 0),
+            tf.reduce_any(
+                tf.equal(classes[..., tf.newaxis], allowed_classes), axis=-1))
+        keep = tf.logical_and(keep, class_allowed)
+
+        counts = tf.minimum(
+            tf.reduce_sum(tf.cast(keep, tf.int32), axis=1), max_detections)
+        width = tf.reduce_max(tf.concat([counts, [0]], 0))
+        # top_k orders ties by position, so the original order is kept
+        top_scores, indices = tf.nn.top_k(
+            tf.where(keep, scores, tf.fill(tf.shape(scores), -np.inf)),
+            k=width, sorted=True)
+        valid = tf.range(width)[tf.newaxis] < counts[:, None]
+
+        tf.identity(
+            tf.where(valid, top_scores, tf.zeros_like(top_scores)),
+            name='detection_scores')
+        tf.identity(tf.cast(counts, tf.float32), name='num_detections')
+        for key in ('detection_boxes', 'detection_classes',
+                    'detection_masks'):
+            if key in tensors:
+                tf.identity(
+                    tf.gather(tensors[key], indices, batch_dims=1), name=key)
+
+
+def load_model(model_path: Path,
+               label_map_path: Path,
+               options: detection_models.options.SessionOptions,
+               cache_metadata: bool = True,
+               encoded_input: bool = False,
+               input_size: Tuple[int, int] = None,
+               backend: str = "session",
+               filter_in_graph: bool = False) -> LoadedModel:
+    """Loads a model and its label map into a new inference backend
+
+    With the "session" backend, `model_path` is a frozen inference graph,
+    which is imported into a new `tf.Session`. With the "tflite" backend,
+    `model_path` is a TensorFlow Lite model (see
+    `detection_models.backends.convert_to_tflite`), which is run by a
+    `detection_models.backends.TFLiteBackend` with
+    `options.intra_op_threads` threads; the remaining options only apply to
+    sessions.
+
+    If `encoded_input` is set, a string placeholder named
+    `ENCODED_INPUT_TENSOR_KEY` is spliced in before the model's
+    `image_tensor`: images fed to it are decoded (and resized to
+    `input_size`, if given) in-graph, on TensorFlow's thread pools.
+
+    If `filter_in_graph` is set, ops that filter the detections by score and
+    class and keep only the top scoring ones are appended to the graph (see
+    `_filter_detections`), so that only the surviving detections are copied
+    out of the session rather than every padded output row.
+
+    The SHA-256 digests of the model and label map files (see
+    `file_digest`) and the parsed label map (see `load_label_map`) are
+    cached in `metadata_cache_dir()`. Cache files are silently skipped if
+    they cannot be written.
+
+    Args:
+        model_path (pathlib.Path): the frozen inference graph (.pb) or, with
+            the "tflite" backend, the TFLite model (.tflite) to load
+        label_map_path (pathlib.Path): the label map (.pbtxt) to load
+        options (detection_models.options.SessionOptions): the session and
+            graph optimization options to load the model with
+        cache_metadata (bool, optional): Defaults to True. Whether to read
+            and write the cached digests and label table
+        encoded_input (bool, optional): Defaults to False. Whether to decode
+            encoded images in-graph; requires the "session" backend
+        input_size (tuple, optional): Defaults to None. The (height, width)
+            encoded images are resized to after decoding; only used if
+            `encoded_input` is set
+        backend (str, optional): Defaults to "session". The inference
+            backend to run the model on; one of
+            `detection_models.backends.BACKENDS`
+        filter_in_graph (bool, optional): Defaults to False. Whether to
+            filter detections in-graph; requires the "session" backend
+
+    Returns:
+        LoadedModel: the loaded model
+    """
+
+    if backend not in detection_models.backends.BACKENDS:
+        raise ValueError("backend must be one of {}".format(
+            detection_models.backends.BACKENDS))
+    if backend == "tflite":
+        if encoded_input or filter_in_graph:
+            raise ValueError("encoded_input and filter_in_graph require the "
+                             "session backend")
+        model_content = Path(model_path).read_bytes()
+        model_digest = file_digest(model_path, cache_metadata)
+        inference_backend = detection_models.backends.TFLiteBackend(
+            model_content, num_threads=options.intra_op_threads)
+        category_index, label_map_digest = load_label_map(
+            label_map_path, cache_metadata)
+        return LoadedModel(None, None, inference_backend.outputs,
+                           category_index, model_digest, label_map_digest,
+                           backend=inference_backend)
+
+    model_path = Path(model_path)
+    model_digest = file_digest(model_path, cache_metadata)
+    with tf.gfile.GFile(str(model_path.absolute()), 'rb') as fid:
+        serialized_graph = fid.read()
+
+    graph_def = options.load_graph_def(
+        serialized_graph, [INPUT_TENSOR_KEY], list(OUTPUT_TENSOR_KEYS))
+    del serialized_graph
+
+    node_names = {node.name for node in graph_def.node}
+    outputs = tuple(key for key in OUTPUT_TENSOR_KEYS if key in node_names)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        input_map = None
+        if encoded_input:
+            encoded_images = tf.placeholder(
+                tf.string, [None], name=ENCODED_INPUT_TENSOR_KEY)
+            input_map = {
+                INPUT_TENSOR_KEY + ":0":
+                _decode_images(encoded_images, input_size)
+            }
+        tf.import_graph_def(graph_def, input_map=input_map, name='')
+    if filter_in_graph:
+        _filter_detections(graph, outputs)
+    session = tf.Session(graph=graph, config=options.to_config_proto())
+
+    category_index, label_map_digest = load_label_map(label_map_path,
+                                                      cache_metadata)
+    return LoadedModel(graph, session, outputs, category_index, model_digest,
+                       label_map_digest, encoded_input,
+                       input_size if encoded_input else None,
+                       filter_in_graph=filter_in_graph)
+
+
+class ModelRegistry:
+    """An in-process registry of loaded models
+
+    Loading the same model twice (with the same options) through the
+    registry returns the same `LoadedModel`, so that all detectors of that
+    model share one graph and one session (or, more generally, one inference
+    backend). tf.Session.run() is thread-safe, so a shared session can serve
+    several detectors concurrently.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_path: Path, label_map_path: Path,
+             options: detection_models.options.SessionOptions,
+             encoded_input: bool, input_size: Tuple[int, int],
+             backend: str, filter_in_graph: bool) -> tuple:
+        key = [
+            backend, encoded_input,
+            tuple(input_size) if input_size else None, filter_in_graph
+        ]
+        for path in (model_path, label_map_path):
+            key.append(file_identity(path))
+        key.append(tuple(sorted((name, str(value))
+                                for name, value in vars(options).items())))
+        return tuple(key)
+
+    def load(self,
+             model_path: Path,
+             label_map_path: Path,
+             options: detection_models.options.SessionOptions,
+             cache_metadata: bool = True,
+             encoded_input: bool = False,
+             input_size: Tuple[int, int] = None,
+             backend: str = "session",
+             filter_in_graph: bool = False) -> LoadedModel:
+        """Returns the registered model, loading it first if necessary
+
+        Args:
+            model_path (pathlib.Path): the frozen inference graph (.pb) or
+                TFLite model (.tflite)
+            label_map_path (pathlib.Path): the label map (.pbtxt)
+            options (detection_models.options.SessionOptions): the session
+                and graph optimization options; models loaded with different
+                options are not shared
+            cache_metadata (bool, optional): Defaults to True. Whether to read
+                and write the cached digests and label table
+            encoded_input (bool, optional): Defaults to False. Whether to
+                decode encoded images in-graph; see `load_model`
+            input_size (tuple, optional): Defaults to None. The size encoded
+                images are resized to; see `load_model`
+            backend (str, optional): Defaults to "session". The inference
+                backend to run the model on; see `load_model`
+            filter_in_graph (bool, optional): Defaults to False. Whether to
+                filter detections in-graph; see `load_model`
+
+        Returns:
+            LoadedModel: the (possibly shared) loaded model
+        """
+
+        if not encoded_input:
+            input_size = None
+        key = self._key(model_path, label_map_path, options, encoded_input,
+                        input_size, backend, filter_in_graph)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = load_model(model_path, label_map_path, options,
+                                   cache_metadata, encoded_input, input_size,
+                                   backend, filter_in_graph)
+                self._models[key] = model
+            return model
+
+    def clear(self) -> None:
+        """Forgets all registered models
+
+        Detectors that already use a registered model keep using it.
+        """
+
+        with self._lock:
+            self._models = {}
+
+
+# the default in-process registry used by `ObjectDetector`
+registry = ModelRegistry()
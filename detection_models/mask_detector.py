@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+from PIL import Image
+
+import detection_models.bbox_detector
+import detection_models.results
+
+
+class MaskDetector(detection_models.bbox_detector.BBoxDetector):
+    """A class for representing instance segmentation detectors
+
+    This class inherits from `detection_models.BBoxDetector` and is made for
+    models (such as Mask R-CNN) that supply an instance mask for each
+    detected bounding box through a `detection_masks` output tensor. The
+    box-relative masks output by the model are only reframed to the size of
+    the image for detections that pass the detection threshold, and are
+    stored run-length encoded in `detection_models.results.DetectedMask`
+    objects rather than as dense arrays.
+
+    Attributes:
+        mask_threshold (float): the probability above which a mask pixel is
+            considered part of the detected object
+        (see `detection_models.BBoxDetector` for the remaining attributes)
+    """
+
+    _fetch_keys = detection_models.bbox_detector.BBoxDetector._fetch_keys + (
+        'detection_masks', )
+
+    def __init__(self, *args, mask_threshold: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mask_threshold = mask_threshold
+
+    @property
+    def fingerprint(self) -> str:
+        return "{}:{!r}".format(super().fingerprint, self.mask_threshold)
+
+    def _build_results(self, output_dict: Dict[str, np.ndarray],
+                       batch_index: int, detection_threshold: float,
+                       image_size: Tuple[int, int]
+                       ) -> detection_models.results.MaskDetectionResults:
+        """Converts one image's raw model outputs into `MaskDetectionResults`
+
+        Args:
+            output_dict (dict): the fetched output arrays of a (possibly
+                batched) tf.Session.run() call
+            batch_index (int): the index of the image within the batch
+            detection_threshold (float): a threshold with which to discard
+                detected objects that have a low detection score
+            image_size (tuple): the (height, width) of the image
+
+        Returns:
+            detection_models.results.MaskDetectionResults: the set of
+                prediction results for the image at `batch_index`
+        """
+
+        with self._timed("convert_outputs"):
+            keep = self._keep(output_dict, batch_index, detection_threshold)
+
+            detection_boxes = output_dict['detection_boxes'][batch_index][
+                keep]
+            detection_masks = output_dict['detection_masks'][batch_index][
+                keep]
+            mask_rles = [
+                detection_models.results.encode_rle(
+                    self._reframe_mask(mask, box, image_size))
+                for mask, box in zip(detection_masks, detection_boxes)
+            ]
+
+        with self._timed("build_results"):
+            results = detection_models.results.MaskDetectionResults(
+                boxes=detection_boxes,
+                scores=output_dict['detection_scores'][batch_index][keep],
+                class_ids=output_dict['detection_classes'][batch_index][keep]
+                .astype(np.int64),
+                label_table=self._label_lookup,
+                mask_rles=mask_rles,
+                image_size=image_size)
+        if self.instrumentation is not None:
+            self.instrumentation.detections(len(results.scores))
+        return results
+
+    def _reframe_mask(self, mask: np.ndarray, box: np.ndarray,
+                      image_size: Tuple[int, int]) -> np.ndarray:
+        """Resizes a box-relative mask and places it within the image
+
+        Args:
+            mask (np.ndarray): the mask probabilities output by the model,
+                relative to the detection's bounding box (mask_h, mask_w)
+            box (np.ndarray): the normalized [ymin, xmin, ymax, xmax] box
+            image_size (tuple): the (height, width) of the image
+
+        Returns:
+            np.ndarray: the binary mask of the whole image (height, width)
+        """
+
+        image_height, image_width = image_size
+        image_mask = np.zeros((image_height, image_width), dtype=bool)
+        ymin, xmin, ymax, xmax = np.clip(box, 0.0, 1.0)
+        top, left = int(ymin * image_height), int(xmin * image_width)
+        bottom = max(int(np.ceil(ymax * image_height)), top + 1)
+        right = max(int(np.ceil(xmax * image_width)), left + 1)
+        bottom, right = min(bottom, image_height), min(right, image_width)
+        if bottom <= top or right <= left:
+            return image_mask
+
+        resized = Image.fromarray(mask.astype(np.float32)).resize(
+            (right - left, bottom - top), Image.BILINEAR)
+        image_mask[top:bottom, left:right] = (
+            np.asarray(resized) > self.mask_threshold)
+        return image_mask
@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import io
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
 
 import numpy as np
 import tensorflow as tf
 
-from object_detection.utils import label_map_util
+from PIL import Image
 
+import detection_models.cache
+import detection_models.instrumentation
+import detection_models.loading
+import detection_models.options
 import detection_models.results
+import detection_models.scheduler
+import detection_models.utils
 
 
 class ObjectDetector(ABC):
@@ -20,54 +31,524 @@ class ObjectDetector(ABC):
     
     Attributes:
         _graph (tf.Graph): the TensorFlow Graph object that represents the
-            frozen inference graph
+            frozen inference graph; None unless the model runs on the
+            "session" backend
         _category_index (dict): a dictionary that stores the model's ID->label
             associations from the input label map; the keys are the class IDs
             (stored as `int`s), and each value is a dict with:
                 "id": the class ID
                 "name": the class name
+        _label_lookup (np.ndarray): an object array built from
+            `_category_index` that maps class IDs (as indices) directly to
+            class names; IDs missing from the label map map to `None`, and
+            results label them as `detection_models.results.lookup_labels`
+            describes
         _session (tf.Session): the running TensorFlow session that represents
-            the connection between the Python runtime and underlying C++ engine
-        _tensor_dict (dict): a dictionary that stores the tensor names (as 
-            `str` keys) and tf.Tensor objects for the given model that will
-            be supplied as "fetches" to a tf.Session.run() call; these are the
-            return values of the session run
-        _image_tensor (tf.Tensor): the image tensor that constitutes the
-            tf.Session.run() feed_dict when paired with input images
+            the connection between the Python runtime and underlying C++
+            engine; None unless the model runs on the "session" backend
+        _backend (detection_models.backends.InferenceBackend): the backend
+            that runs the model; its `run` method takes the place of
+            tf.Session.run() for all backends
+        max_batch_size (int): the maximum number of images that are stacked
+            into a single tf.Session.run() call by `detect_batch`; bounds the
+            memory used by batched inference
+        options (detection_models.options.SessionOptions): the session and
+            graph optimization options the detector was created with
+        _model (detection_models.loading.LoadedModel): the loaded graph,
+            session, and label map backing this detector; shared with other
+            detectors of the same model if created with `shared=True`
+        batch_scheduler (detection_models.scheduler.MicroBatchScheduler): the
+            scheduler that groups `adetect` requests into batches; created
+            with default settings on first use if not set
+        _fetch_keys (tuple): the model outputs the detector uses; only these
+            are fetched from the backend, so that unused (and potentially
+            large) outputs such as `detection_masks` never leave TensorFlow
+        result_cache (detection_models.cache.ResultCache): the cache that
+            `detect` and `detect_batch` answer repeated images from; results
+            are not cached if None
+        instrumentation (detection_models.instrumentation.Instrumentation):
+            receives per-stage timings and batch and detection counts, and
+            captures TensorFlow traces of sampled model runs; disabled if None
+        max_detections (int): the maximum number of (highest scoring)
+            detections kept per image; unlimited if None
     """
 
-    def __init__(self, model_path: Path, label_map_path: Path):
-        self._graph = self._load_graph(str(model_path.absolute()))
-        self._category_index = label_map_util.create_category_index_from_labelmap(
-            str(label_map_path.absolute()))
-        self._session = tf.Session(graph=self._graph)
-        self._tensor_dict = self._get_tensor_dict()
-        self._image_tensor = self._graph.get_tensor_by_name("image_tensor:0")
-
-    def _load_graph(self, model_path: Path) -> tf.Graph:
-        detection_graph = tf.Graph()
-        with detection_graph.as_default():
-            od_graph_def = tf.GraphDef()
-            with tf.gfile.GFile(model_path, 'rb') as fid:
-                serialized_graph = fid.read()
-                od_graph_def.ParseFromString(serialized_graph)
-                tf.import_graph_def(od_graph_def, name='')
-        return detection_graph
-
-    def _get_tensor_dict(self) -> Dict[str, tf.Tensor]:
-        ops = self._graph.get_operations()
-        all_tensor_names = {output.name for op in ops for output in op.outputs}
-        tensor_dict = {}
-        for key in [
-                'num_detections', 'detection_boxes', 'detection_scores',
-                'detection_classes', 'detection_masks'
-        ]:
-            tensor_name = key + ':0'
-            if tensor_name in all_tensor_names:
-                tensor_dict[key] = self._graph.get_tensor_by_name(tensor_name)
-        return tensor_dict
+    _fetch_keys = ('num_detections', 'detection_boxes', 'detection_scores',
+                   'detection_classes')
+
+    def __init__(self,
+                 model_path: Path,
+                 label_map_path: Path,
+                 max_batch_size: int = 8,
+                 options: detection_models.options.SessionOptions = None,
+                 shared: bool = False,
+                 result_cache: detection_models.cache.ResultCache = None,
+                 instrumentation: detection_models.instrumentation.
+                 Instrumentation = None,
+                 encoded_input: bool = False,
+                 input_size: Tuple[int, int] = None,
+                 backend: str = None,
+                 filter_in_graph: bool = False,
+                 allowed_labels: Sequence[str] = None,
+                 max_detections: int = None):
+        """Loads a model
+
+        Args:
+            model_path (pathlib.Path): the frozen inference graph (.pb), or a
+                TensorFlow Lite model (.tflite) for the "tflite" backend
+            label_map_path (pathlib.Path): the label map (.pbtxt)
+            max_batch_size (int, optional): Defaults to 8. See
+                `max_batch_size`
+            options (detection_models.options.SessionOptions, optional):
+                Defaults to `SessionOptions()`. The session and graph
+                optimization options
+            shared (bool, optional): Defaults to False. Whether to share the
+                loaded model with other detectors created with `shared=True`
+            result_cache (detection_models.cache.ResultCache, optional):
+                Defaults to None. See `result_cache`
+            instrumentation (detection_models.instrumentation.Instrumentation,
+                optional): Defaults to None. See `instrumentation`
+            encoded_input (bool, optional): Defaults to False. If True, images
+                are passed to `detect`, `detect_batch`, etc. encoded (as the
+                bytes of a JPEG, PNG, GIF, or BMP file) and are decoded
+                in-graph on TensorFlow's thread pools, which avoids decoding
+                with the GIL held and feeding full decoded frames
+            input_size (tuple, optional): Defaults to None. The (height,
+                width) encoded images are resized to in-graph after decoding;
+                only used with `encoded_input`
+            backend (str, optional): Defaults to "tflite" for .tflite models
+                and "session" otherwise. The inference backend to run the
+                model on; see `detection_models.loading.load_model`
+            filter_in_graph (bool, optional): Defaults to False. If True, the
+                detection threshold, `allowed_labels`, and `max_detections`
+                are applied by ops appended to the graph, so that only the
+                surviving detections are copied out of the session; otherwise
+                they are applied to the fetched outputs. Either way, the
+                results are the same
+            allowed_labels (Sequence[str], optional): Defaults to None. The
+                labels whose detections are kept; all labels are kept if None
+            max_detections (int, optional): Defaults to None. See
+                `max_detections`
+        """
+
+        if options is None:
+            options = detection_models.options.SessionOptions()
+        self.options = options
+        if backend is None:
+            backend = ("tflite"
+                       if Path(model_path).suffix == ".tflite" else "session")
+        if shared:
+            self._model = detection_models.loading.registry.load(
+                model_path, label_map_path, options,
+                encoded_input=encoded_input, input_size=input_size,
+                backend=backend, filter_in_graph=filter_in_graph)
+        else:
+            self._model = detection_models.loading.load_model(
+                model_path, label_map_path, options,
+                encoded_input=encoded_input, input_size=input_size,
+                backend=backend, filter_in_graph=filter_in_graph)
+        self._graph = self._model.graph
+        self._category_index = self._model.category_index
+        self._label_lookup = self._model.label_lookup
+        self._session = self._model.session
+        self._backend = self._model.backend
+        self._check_outputs()
+        self.max_batch_size = max_batch_size
+        self.batch_scheduler = None
+        self.result_cache = result_cache
+        self.instrumentation = instrumentation
+        self.max_detections = max_detections
+        self._allowed_labels = None
+        self._allowed_class_ids = None
+        if allowed_labels is not None:
+            self._allowed_labels = tuple(sorted(set(allowed_labels)))
+            unknown = set(self._allowed_labels) - set(self._label_lookup)
+            if unknown:
+                raise ValueError("the label map has no labels {}".format(
+                    sorted(unknown)))
+            self._allowed_class_ids = np.flatnonzero(
+                np.isin(self._label_lookup, self._allowed_labels))
+
+    @property
+    def allowed_labels(self) -> Tuple[str, ...]:
+        """tuple: the labels whose detections are kept, or None for all"""
+        return self._allowed_labels
+
+    @property
+    def fingerprint(self) -> str:
+        """str: identifies the model, label map, and detector type
+
+        Two detectors with the same fingerprint produce the same results for
+        the same image and threshold; used to key cached results. The model
+        and label map are identified by the digests of their contents, and
+        the graph transforms applied to the model (see
+        `detection_models.options.SessionOptions`) are included.
+        """
+
+        fingerprint = "{}:{}".format(type(self).__name__,
+                                     self._model.fingerprint)
+        if self.options.optimize_graph and self._model.graph is not None:
+            fingerprint += ":transforms={}".format(",".join(
+                self.options.graph_transforms))
+        if self._model.input_size is not None:
+            fingerprint += ":{}x{}".format(*self._model.input_size)
+        if self._allowed_labels is not None:
+            fingerprint += ":labels={}".format(",".join(self._allowed_labels))
+        if self.max_detections is not None:
+            fingerprint += ":top={}".format(self.max_detections)
+        return fingerprint
+
+    @property
+    def label_table(self) -> np.ndarray:
+        """np.ndarray: maps class IDs (as indices) to class names
+
+        IDs missing from the label map map to `None`. The table is shared
+        with the detector's results, so it must not be modified.
+        """
+
+        return self._label_lookup
+
+    @property
+    def encoded_input(self) -> bool:
+        """bool: whether the detector is fed encoded images"""
+        return self._model.encoded_input
+
+    def _image_size(self, image) -> Tuple[int, int]:
+        """Returns the (height, width) of an image as the model sees it
+
+        For encoded images, only the image's header is read.
+        """
+
+        if not self._model.encoded_input:
+            return image.shape[:2]
+        if self._model.input_size is not None:
+            return self._model.input_size
+        width, height = Image.open(io.BytesIO(image)).size
+        return height, width
+
+    def _stack(self, images: Sequence) -> np.ndarray:
+        """Stacks images into a batch that can be fed to `_backend`"""
+        if self._model.encoded_input:
+            return np.array([bytes(image) for image in images], dtype=object)
+        if len(images) == 1:
+            return np.expand_dims(images[0], 0)
+        return np.stack(images)
+
+    def _check_outputs(self) -> None:
+        missing_keys = set(self._fetch_keys) - set(self._model.outputs)
+        if missing_keys:
+            raise ValueError(
+                "{} requires a model with the output tensors {}".format(
+                    type(self).__name__, sorted(missing_keys)))
+
+    def _filters(self, detection_threshold: float) -> dict:
+        """Builds the feeds of the in-graph filter placeholders"""
+        if not self._backend.filter_in_graph:
+            return None
+        filters = {
+            detection_models.loading.FILTER_THRESHOLD_KEY:
+            detection_threshold
+        }
+        if self._allowed_class_ids is not None:
+            # an empty allow-list would keep every class, so disallowed
+            # detections are filtered out by an impossible class ID instead
+            filters[detection_models.loading.FILTER_CLASSES_KEY] = (
+                self._allowed_class_ids.astype(np.float32)
+                if len(self._allowed_class_ids) else [-1.0])
+        if self.max_detections is not None:
+            filters[detection_models.loading.
+                    FILTER_MAX_DETECTIONS_KEY] = self.max_detections
+        return filters
+
+    def _keep(self, output_dict: Dict[str, np.ndarray], batch_index: int,
+              detection_threshold: float) -> np.ndarray:
+        """Selects the detections of one image to keep
+
+        Applies the detection threshold, `allowed_labels`, and
+        `max_detections` to the valid detections of the image at
+        `batch_index`; for outputs filtered in-graph, this keeps all of them.
+
+        Args:
+            output_dict (dict): the fetched output arrays of a (possibly
+                batched) model run
+            batch_index (int): the index of the image within the batch
+            detection_threshold (float): a threshold with which to discard
+                detected objects that have a low detection score
+
+        Returns:
+            np.ndarray: the (ascending) indices of the kept detections
+        """
+
+        num_detections = int(output_dict['num_detections'][batch_index])
+        keep = (output_dict['detection_scores'][batch_index][:num_detections]
+                >= detection_threshold)
+        if self._allowed_class_ids is not None:
+            keep &= np.isin(
+                output_dict['detection_classes'][batch_index]
+                [:num_detections], self._allowed_class_ids)
+        keep = np.flatnonzero(keep)
+        if self.max_detections is not None:
+            keep = keep[:self.max_detections]
+        return keep
+
+    def _run(self, images: np.ndarray,
+             detection_threshold: float = 0.0) -> Dict[str, np.ndarray]:
+        """Runs the model once on a stacked batch of images
+
+        Args:
+            images (np.ndarray): a batch of images of identical size in the RGB
+                colorspace (batch, height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.0. The
+                detection threshold applied in-graph, if the detector filters
+                in-graph
+
+        Returns:
+            dict: the fetched output arrays keyed by tensor name; the first
+                dimension of each array indexes the images in the batch
+        """
+
+        filters = self._filters(detection_threshold)
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._backend.run(images, self._fetch_keys, None, filters)
+
+        instrumentation.batch(len(images))
+        run_metadata = None
+        if self._backend.traceable and instrumentation.should_trace():
+            run_metadata = tf.RunMetadata()
+        with self._timed("session_run"):
+            output_dict = self._backend.run(images, self._fetch_keys,
+                                            run_metadata, filters)
+        if run_metadata is not None:
+            instrumentation.save_trace(run_metadata)
+        return output_dict
+
+    @contextmanager
+    def _timed(self, stage: str) -> Iterator[None]:
+        """Reports the time spent in the block to `self.instrumentation`
+
+        Args:
+            stage (str): the name of the stage; see
+                `detection_models.instrumentation.STAGES`
+        """
+
+        if self.instrumentation is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.instrumentation.stage(stage, time.perf_counter() - start)
+
+    def _iter_batches(self, images: Sequence, max_batch_size: int
+                      ) -> Iterator[Tuple[List[int], np.ndarray, tuple]]:
+        """Buckets images by size and stacks each bucket into batches
+
+        The model can only be fed a batch of identically sized images, so
+        images are grouped by shape (preserving their relative order) and each
+        group is split into stacks of at most `max_batch_size` images.
+
+        Args:
+            images (Sequence): images in the RGB colorspace (height, width,
+                3), possibly of different sizes; encoded images if the
+                detector has `encoded_input`
+            max_batch_size (int): the maximum number of images per stack
+
+        Yields:
+            tuple: the indices (into `images`) of the stacked images, the
+                stacked batch itself (batch, height, width, 3) (or (batch,)
+                for encoded images), and the (height, width) of its images
+        """
+
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be a positive integer")
+
+        buckets = OrderedDict()
+        for i, image in enumerate(images):
+            key = (self._image_size(image)
+                   if self._model.encoded_input else image.shape)
+            buckets.setdefault(key, []).append(i)
+
+        for key, indices in buckets.items():
+            for start in range(0, len(indices), max_batch_size):
+                batch_indices = indices[start:start + max_batch_size]
+                with self._timed("prepare"):
+                    batch = self._stack([images[i] for i in batch_indices])
+                yield batch_indices, batch, tuple(key[:2])
 
     @abstractmethod
     def detect(self, image: np.ndarray, detection_threshold: float = 0.5
                ) -> detection_models.results.DetectionResults:
         pass
+
+    def detect_batch(self,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5,
+                     max_batch_size: int = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection on a sequence of images
+
+        Subclasses that can split batched model outputs back into per-image
+        results override this method to run the model once per batch; this
+        default implementation simply calls `detect` on each image.
+
+        Args:
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            max_batch_size (int, optional): Defaults to `self.max_batch_size`.
+                The maximum number of images fed to the model at once
+
+        Returns:
+            list: one `detection_models.results.DetectionResults` per image,
+                in the same order as `images`
+        """
+
+        return [self.detect(image, detection_threshold) for image in images]
+
+    def detect_stream(self,
+                      sources: Iterable[Any],
+                      detection_threshold: float = 0.5,
+                      prefetch: int = 16,
+                      decode_workers: int = 4,
+                      batch_size: int = None,
+                      target_size: Tuple[int, int] = None,
+                      return_images: bool = False,
+                      return_exceptions: bool = False) -> Iterator[Tuple]:
+        """Performs object detection on a stream of images
+
+        Images are decoded on a pool of threads while the model runs on
+        previously decoded images, so decoding and inference overlap. At most
+        `prefetch` images are decoded ahead of the model, which bounds memory
+        use when `sources` is much faster than inference. Decoded images are
+        passed to `detect_batch` in groups of `batch_size`. If the detector
+        has `encoded_input`, sources are only read (not decoded) by the
+        threads, and `target_size` is ignored.
+
+        Args:
+            sources (Iterable): the images to process; each element is either
+                an already decoded image (np.ndarray) or anything accepted by
+                `detection_models.utils.load_image` (a filepath, encoded bytes,
+                or an mmap)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            prefetch (int, optional): Defaults to 16. The maximum number of
+                images that are decoded (or being decoded) ahead of the model;
+                raised to `batch_size` if smaller
+            decode_workers (int, optional): Defaults to 4. The number of
+                threads used for decoding
+            batch_size (int, optional): Defaults to `self.max_batch_size`. The
+                number of images passed to each `detect_batch` call
+            target_size (tuple, optional): Defaults to None. Passed on to
+                `detection_models.utils.load_image` for encoded sources
+            return_images (bool, optional): Defaults to False. Whether to
+                yield the decoded image (or, with `encoded_input`, the encoded
+                bytes) of each source as well
+            return_exceptions (bool, optional): Defaults to False. Whether to
+                yield the exception raised while decoding or detecting an
+                image in place of its results, rather than raising it. The
+                images of a batch that fails are then detected one by one, so
+                that only the failing images are affected
+
+        Yields:
+            tuple: each source (and, if `return_images` is set, its decoded
+                image, or None if decoding failed) and its
+                `detection_models.results.DetectionResults`, in input order
+        """
+
+        if batch_size is None:
+            batch_size = self.max_batch_size
+        prefetch = max(prefetch, batch_size)
+        sources = iter(sources)
+        pending = deque()
+
+        def decode(source: Any) -> np.ndarray:
+            if isinstance(source, np.ndarray):
+                return source
+            if self.encoded_input:
+                if isinstance(source, (Path, str)):
+                    return Path(source).read_bytes()
+                return source
+            return detection_models.utils.load_image(source, target_size)
+
+        def detect_each(images: list) -> Iterator:
+            for image in images:
+                try:
+                    yield self.detect_batch([image], detection_threshold)[0]
+                except Exception as e:
+                    yield e
+
+        def fill_pending() -> None:
+            while len(pending) < prefetch:
+                try:
+                    source = next(sources)
+                except StopIteration:
+                    return
+                pending.append((source, executor.submit(decode, source)))
+
+        with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+            try:
+                fill_pending()
+                while pending:
+                    batch = [
+                        pending.popleft()
+                        for _ in range(min(batch_size, len(pending)))
+                    ]
+                    # queue up more decoding before blocking on the model
+                    fill_pending()
+                    decoded = []
+                    for source, future in batch:
+                        try:
+                            decoded.append((source, future.result(), None))
+                        except Exception as e:
+                            if not return_exceptions:
+                                raise
+                            decoded.append((source, None, e))
+                    images = [
+                        image for _, image, error in decoded if error is None
+                    ]
+                    try:
+                        batch_results = iter(
+                            self.detect_batch(images, detection_threshold,
+                                              max_batch_size=batch_size))
+                    except Exception:
+                        if not return_exceptions:
+                            raise
+                        batch_results = detect_each(images)
+                    for source, image, error in decoded:
+                        results = (error if error is not None else
+                                   next(batch_results))
+                        yield ((source, image, results) if return_images else
+                               (source, results))
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    async def adetect(self, image: np.ndarray, detection_threshold: float = 0.5
+                      ) -> detection_models.results.DetectionResults:
+        """Performs object detection on a given image without blocking
+
+        Concurrent `adetect` calls are grouped into batches by
+        `self.batch_scheduler` and run on an executor thread, so the event
+        loop stays responsive while the model runs.
+
+        Args:
+            image (np.ndarray): an image loaded into memory as a numpy array in
+                the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+
+        Returns:
+            detection_models.results.DetectionResults: the set of prediction
+                results for a given image
+        """
+
+        if self.batch_scheduler is None:
+            self.batch_scheduler = (
+                detection_models.scheduler.MicroBatchScheduler(self))
+        return await self.batch_scheduler.detect(image, detection_threshold)
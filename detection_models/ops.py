@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Vectorized bounding box operations
+
+All boxes are [ymin, xmin, ymax, xmax] rows, in any (but consistent)
+coordinate system.
+"""
+
+import numpy as np
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """Computes the area of each box
+
+    Args:
+        boxes (np.ndarray): boxes (N, 4)
+
+    Returns:
+        np.ndarray: the area of each box (N,); degenerate boxes have area 0
+    """
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return (np.clip(boxes[:, 2] - boxes[:, 0], 0, None) *
+            np.clip(boxes[:, 3] - boxes[:, 1], 0, None))
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Computes the intersection over union of every pair of boxes
+
+    Args:
+        boxes_a (np.ndarray): boxes (N, 4)
+        boxes_b (np.ndarray): boxes (M, 4)
+
+    Returns:
+        np.ndarray: the IoU of each box in `boxes_a` with each box in
+            `boxes_b` (N, M)
+    """
+
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = (box_areas(boxes_a)[:, None] + box_areas(boxes_b)[None, :] -
+             intersection)
+    return np.where(union > 0, intersection / np.maximum(union, 1e-12), 0.0)
+
+
+def greedy_match(iou: np.ndarray, min_iou: float) -> np.ndarray:
+    """Greedily matches rows to columns in order of decreasing IoU
+
+    Args:
+        iou (np.ndarray): an IoU matrix (N, M), e.g. from `iou_matrix`
+        min_iou (float): pairs with a lower IoU are never matched
+
+    Returns:
+        np.ndarray: the matched (row, column) index pairs (K, 2)
+    """
+
+    rows, columns = np.nonzero(iou >= min_iou)
+    order = np.argsort(-iou[rows, columns], kind="stable")
+    matched_rows = np.zeros(iou.shape[0], dtype=bool)
+    matched_columns = np.zeros(iou.shape[1], dtype=bool)
+    matches = []
+    for row, column in zip(rows[order], columns[order]):
+        if not matched_rows[row] and not matched_columns[column]:
+            matched_rows[row] = matched_columns[column] = True
+            matches.append((row, column))
+    return np.array(matches, dtype=np.int64).reshape(-1, 2)
+
+
+def non_max_suppression(boxes: np.ndarray,
+                        scores: np.ndarray,
+                        iou_threshold: float = 0.5,
+                        class_ids: np.ndarray = None,
+                        max_detections: int = None) -> np.ndarray:
+    """Greedily selects high scoring boxes that do not overlap each other
+
+    Boxes are visited in order of decreasing score; each selected box
+    suppresses all remaining boxes that overlap it by more than
+    `iou_threshold`. The overlaps of a selected box with all remaining boxes
+    are computed at once, so there is one vectorized step per selected box.
+    If `class_ids` is given, boxes only suppress boxes of the same class.
+
+    Args:
+        boxes (np.ndarray): boxes (N, 4)
+        scores (np.ndarray): the score of each box (N,)
+        iou_threshold (float, optional): Defaults to 0.5. Boxes overlapping a
+            selected box by more than this are suppressed
+        class_ids (np.ndarray, optional): Defaults to None. The class of each
+            box (N,); all boxes are treated as one class if None
+        max_detections (int, optional): Defaults to None. The maximum number
+            of boxes to select; unbounded if None
+
+    Returns:
+        np.ndarray: the indices of the selected boxes, in order of decreasing
+            score (K,)
+    """
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores).reshape(-1)
+    if class_ids is not None and len(boxes):
+        # move each class into its own disjoint region of the plane, so that
+        # boxes of different classes never overlap
+        class_ids = np.asarray(class_ids).reshape(-1)
+        extent = float(boxes.max() - min(boxes.min(), 0.0)) + 1.0
+        boxes = boxes + (class_ids * extent)[:, None]
+    areas = (np.clip(boxes[:, 2] - boxes[:, 0], 0, None) *
+             np.clip(boxes[:, 3] - boxes[:, 1], 0, None))
+
+    remaining = np.argsort(-scores, kind="stable")
+    selected = []
+    while len(remaining):
+        best = remaining[0]
+        selected.append(best)
+        if max_detections is not None and len(selected) >= max_detections:
+            break
+        others = remaining[1:]
+        top_left = np.maximum(boxes[best, :2], boxes[others, :2])
+        bottom_right = np.minimum(boxes[best, 2:], boxes[others, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None),
+                               axis=1)
+        union = areas[best] + areas[others] - intersection
+        iou = np.where(union > 0, intersection / np.maximum(union, 1e-12),
+                       0.0)
+        remaining = others[iou <= iou_threshold]
+    return np.array(selected, dtype=np.int64)
+
+
+def weighted_box_fusion(boxes: np.ndarray,
+                        scores: np.ndarray,
+                        class_ids: np.ndarray,
+                        model_ids: np.ndarray,
+                        num_models: int,
+                        iou_threshold: float = 0.55,
+                        model_weights: np.ndarray = None):
+    """Fuses the overlapping boxes predicted by several models
+
+    Boxes are visited in order of decreasing weighted score and added to the
+    first cluster of the same class whose fused box they overlap by more than
+    `iou_threshold` (or start a new cluster). Each cluster's fused box is the
+    mean of its boxes weighted by score and model weight; its score is the
+    mean score of its boxes, scaled by the fraction of the total model weight
+    that contributed to it. Unlike non-max suppression, all models' boxes
+    contribute to the result.
+
+    Args:
+        boxes (np.ndarray): the boxes of all models (N, 4)
+        scores (np.ndarray): the score of each box (N,)
+        class_ids (np.ndarray): the class of each box (N,)
+        model_ids (np.ndarray): the index of the model that predicted each
+            box (N,)
+        num_models (int): the number of models in the ensemble
+        iou_threshold (float, optional): Defaults to 0.55. The minimum IoU
+            with a cluster's fused box for a box to join the cluster
+        model_weights (np.ndarray, optional): Defaults to equal weights. The
+            weight of each model (num_models,)
+
+    Returns:
+        tuple: the fused boxes (K, 4), scores (K,), and class IDs (K,)
+    """
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+    model_ids = np.asarray(model_ids, dtype=np.int64).reshape(-1)
+    if model_weights is None:
+        model_weights = np.ones(num_models, dtype=np.float32)
+    model_weights = np.asarray(model_weights, dtype=np.float32)
+    box_weights = scores * model_weights[model_ids]
+
+    # running sums of each cluster: weighted box coordinates, weights,
+    # scores, and the models that contributed
+    weighted_sums = np.zeros((len(boxes), 4), dtype=np.float64)
+    weight_sums = np.zeros(len(boxes), dtype=np.float64)
+    score_sums = np.zeros(len(boxes), dtype=np.float64)
+    box_counts = np.zeros(len(boxes), dtype=np.int64)
+    contributors = np.zeros((len(boxes), num_models), dtype=bool)
+    fused = np.zeros((len(boxes), 4), dtype=np.float32)
+    cluster_classes = np.zeros(len(boxes), dtype=np.int64)
+    num_clusters = 0
+
+    for index in np.argsort(-box_weights, kind="stable"):
+        candidates = np.flatnonzero(
+            cluster_classes[:num_clusters] == class_ids[index])
+        cluster = None
+        if len(candidates):
+            overlaps = iou_matrix(boxes[index], fused[candidates])[0]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] > iou_threshold:
+                cluster = candidates[best]
+        if cluster is None:
+            cluster = num_clusters
+            cluster_classes[cluster] = class_ids[index]
+            num_clusters += 1
+
+        weighted_sums[cluster] += box_weights[index] * boxes[index]
+        weight_sums[cluster] += box_weights[index]
+        score_sums[cluster] += scores[index]
+        box_counts[cluster] += 1
+        contributors[cluster, model_ids[index]] = True
+        fused[cluster] = weighted_sums[cluster] / max(weight_sums[cluster],
+                                                      1e-12)
+
+    counts = box_counts[:num_clusters]
+    fused_scores = (score_sums[:num_clusters] / np.maximum(counts, 1) *
+                    contributors[:num_clusters].dot(model_weights) /
+                    model_weights.sum())
+    return (fused[:num_clusters], fused_scores.astype(np.float32),
+            cluster_classes[:num_clusters])
+
+
+def denormalize_boxes(boxes: np.ndarray, image_height,
+                      image_width) -> np.ndarray:
+    """Converts normalized boxes into pixel coordinates
+
+    Matches `detection_models.results.DetectedBBox.denormalize`:
+    coordinates are truncated to integers.
+
+    Args:
+        boxes (np.ndarray): normalized [ymin, xmin, ymax, xmax] boxes (N, 4)
+        image_height (int or np.ndarray): the height of the image in pixels,
+            or of each box's image (N,)
+        image_width (int or np.ndarray): the width of the image in pixels, or
+            of each box's image (N,)
+
+    Returns:
+        np.ndarray: [ymin, xmin, ymax, xmax] pixel boxes (N, 4), int64
+    """
+
+    image_height = np.asarray(image_height, dtype=np.float64)
+    image_width = np.asarray(image_width, dtype=np.float64)
+    scale = np.stack(np.broadcast_arrays(image_height, image_width,
+                                         image_height, image_width),
+                     axis=-1)
+    return (np.asarray(boxes, dtype=np.float64).reshape(-1, 4) *
+            scale).astype(np.int64)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Sequence
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+# graph transforms applied by `SessionOptions.load_graph_def`; see the
+# TensorFlow Graph Transform Tool documentation for what each one does
+DEFAULT_GRAPH_TRANSFORMS = (
+    "strip_unused_nodes",
+    "fold_constants(ignore_errors=true)",
+    "fold_batch_norms",
+    "fold_old_batch_norms",
+)
+
+
+class SessionOptions:
+    """Configures the TensorFlow session and graph of an `ObjectDetector`
+
+    Options that are left as None keep TensorFlow's defaults.
+
+    Attributes:
+        intra_op_threads (int): the `intra_op_parallelism_threads` of the
+            session, i.e. the number of threads a single op (such as a
+            convolution) may use
+        inter_op_threads (int): the `inter_op_parallelism_threads` of the
+            session, i.e. the number of ops that may run concurrently
+        constant_folding (bool): whether Grappler folds constant subgraphs
+        layout_optimizer (bool): whether Grappler rewrites tensor layouts
+            (e.g. NHWC <-> NCHW) for faster kernels
+        arithmetic_optimization (bool): whether Grappler simplifies
+            arithmetic expressions
+        xla_jit (bool): whether to enable global XLA JIT compilation; on CPU,
+            TensorFlow 1.x additionally requires the environment variable
+            `TF_XLA_FLAGS=--tf_xla_cpu_global_jit` to be set before startup
+        optimize_graph (bool): whether to rewrite the frozen graph with the
+            Graph Transform Tool when it is loaded (see `graph_transforms`)
+        graph_transforms (Sequence[str]): the Graph Transform Tool transforms
+            applied when `optimize_graph` is set
+        graph_cache_dir (pathlib.Path): a directory in which optimized graphs
+            are cached, keyed by the hash of the original graph and the
+            transforms applied, so that repeated startups skip the rewrite;
+            no caching is done if None
+    """
+
+    def __init__(self,
+                 intra_op_threads: int = None,
+                 inter_op_threads: int = None,
+                 constant_folding: bool = None,
+                 layout_optimizer: bool = None,
+                 arithmetic_optimization: bool = None,
+                 xla_jit: bool = False,
+                 optimize_graph: bool = False,
+                 graph_transforms: Sequence[str] = DEFAULT_GRAPH_TRANSFORMS,
+                 graph_cache_dir: Path = None):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.constant_folding = constant_folding
+        self.layout_optimizer = layout_optimizer
+        self.arithmetic_optimization = arithmetic_optimization
+        self.xla_jit = xla_jit
+        self.optimize_graph = optimize_graph
+        self.graph_transforms = tuple(graph_transforms)
+        self.graph_cache_dir = graph_cache_dir
+
+    def to_config_proto(self) -> "tf.ConfigProto":
+        """Builds the session configuration described by these options
+
+        Returns:
+            tf.ConfigProto: the configuration to create a tf.Session with
+        """
+
+        import tensorflow as tf
+        from tensorflow.core.protobuf import rewriter_config_pb2
+
+        config = tf.ConfigProto()
+        if self.intra_op_threads is not None:
+            config.intra_op_parallelism_threads = self.intra_op_threads
+        if self.inter_op_threads is not None:
+            config.inter_op_parallelism_threads = self.inter_op_threads
+
+        rewrite_options = config.graph_options.rewrite_options
+        for field, enabled in [
+            ("constant_folding", self.constant_folding),
+            ("layout_optimizer", self.layout_optimizer),
+            ("arithmetic_optimization", self.arithmetic_optimization),
+        ]:
+            if enabled is not None:
+                setattr(rewrite_options, field,
+                        rewriter_config_pb2.RewriterConfig.ON
+                        if enabled else rewriter_config_pb2.RewriterConfig.OFF)
+
+        if self.xla_jit:
+            config.graph_options.optimizer_options.global_jit_level = (
+                tf.OptimizerOptions.ON_1)
+        return config
+
+    def load_graph_def(self, serialized_graph: bytes,
+                       input_names: List[str],
+                       output_names: List[str]) -> "tf.GraphDef":
+        """Parses a frozen graph, rewriting it if `optimize_graph` is set
+
+        The rewrite uses the Graph Transform Tool. If `graph_cache_dir` is
+        set, a previously rewritten graph is read from the cache (skipping
+        both the rewrite and the parse of the original graph), and newly
+        rewritten graphs are written to it.
+
+        Args:
+            serialized_graph (bytes): the serialized frozen inference graph
+            input_names (List[str]): the names of the graph's input nodes
+            output_names (List[str]): the names of the graph's output nodes;
+                names that are missing from the graph are ignored, and nodes
+                the remaining outputs do not depend on are stripped
+
+        Returns:
+            tf.GraphDef: the (possibly optimized) graph
+        """
+
+        import tensorflow as tf
+
+        cache_path = None
+        if self.optimize_graph and self.graph_cache_dir is not None:
+            key = hashlib.sha256(serialized_graph)
+            key.update(repr((list(input_names), list(output_names),
+                             self.graph_transforms)).encode("utf-8"))
+            cache_path = Path(self.graph_cache_dir) / (
+                "optimized_graph_{}.pb".format(key.hexdigest()[:32]))
+            if cache_path.exists():
+                graph_def = tf.GraphDef()
+                graph_def.ParseFromString(cache_path.read_bytes())
+                return graph_def
+
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(serialized_graph)
+        if not self.optimize_graph:
+            return graph_def
+
+        from tensorflow.tools.graph_transforms import TransformGraph
+        node_names = {node.name for node in graph_def.node}
+        graph_def = TransformGraph(
+            graph_def, [name for name in input_names if name in node_names],
+            [name for name in output_names if name in node_names],
+            list(self.graph_transforms))
+
+        if cache_path is not None:
+            # write atomically so concurrently starting processes never read
+            # a partially written graph
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = cache_path.with_name("{}.{}.tmp".format(
+                cache_path.name, os.getpid()))
+            temp_path.write_bytes(graph_def.SerializeToString())
+            os.replace(str(temp_path), str(cache_path))
+        return graph_def
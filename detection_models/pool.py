@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+import detection_models.options
+import detection_models.results
+
+# (shape, offset) of each image written to a shared memory block
+ImageLayout = List[Tuple[Tuple[int, ...], int]]
+
+# how often (in seconds) the pool checks that its workers are alive
+WORKER_POLL_INTERVAL = 0.5
+
+
+def write_images_to_shared_memory(
+        images: Sequence[np.ndarray],
+        block: shared_memory.SharedMemory = None
+) -> Tuple[shared_memory.SharedMemory, ImageLayout]:
+    """Copies uint8 images into a shared memory block
+
+    The caller owns the returned block and must `close()` and `unlink()` it
+    once every reader is done with it.
+
+    Args:
+        images (Sequence[np.ndarray]): uint8 images in the RGB colorspace
+            (height, width, 3)
+        block (multiprocessing.shared_memory.SharedMemory, optional):
+            Defaults to None. A block to reuse if the images fit in it; a new
+            block is created if None or too small (`block` itself is then
+            left untouched)
+
+    Returns:
+        tuple: the shared memory block and the layout of the images within
+            it, which `read_images_from_shared_memory` uses to recover them
+
+    Raises:
+        ValueError: if an image is not a uint8 array
+    """
+
+    layout = []
+    size = 0
+    for image in images:
+        if not isinstance(image, np.ndarray) or image.dtype != np.uint8:
+            raise ValueError("images must be uint8 arrays, not {}".format(
+                getattr(image, "dtype", type(image).__name__)))
+        layout.append((tuple(image.shape), size))
+        size += image.size
+    if block is None or block.size < size:
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for image, (shape, offset) in zip(images, layout):
+        np.ndarray(shape, dtype=np.uint8, buffer=block.buf,
+                   offset=offset)[...] = image
+    return block, layout
+
+
+def read_images_from_shared_memory(block: shared_memory.SharedMemory,
+                                   layout: ImageLayout) -> List[np.ndarray]:
+    """Creates views of the images stored in a shared memory block
+
+    The views do not copy the image data; they must be released before the
+    block is closed.
+
+    Args:
+        block (multiprocessing.shared_memory.SharedMemory): the block written
+            by `write_images_to_shared_memory`
+        layout (ImageLayout): the layout returned alongside the block
+
+    Returns:
+        list: the images as numpy arrays backed by the shared memory block
+    """
+
+    return [
+        np.ndarray(shape, dtype=np.uint8, buffer=block.buf, offset=offset)
+        for shape, offset in layout
+    ]
+
+
+def _worker_main(worker_index: int, detector_class: type, model_path: Path,
+                 label_map_path: Path,
+                 options: detection_models.options.SessionOptions,
+                 detector_kwargs: dict, tasks: multiprocessing.Queue,
+                 results: multiprocessing.Queue) -> None:
+    # messages are (worker_index, task_id, batch_results, error); a task_id
+    # of None reports that the detector loaded (error is None) or failed to
+    # load. Each worker has its own task queue, so the pool knows which task
+    # a worker is running without the worker having to report it.
+    try:
+        detector = detector_class(
+            model_path, label_map_path, options=options, **detector_kwargs)
+    except Exception as e:
+        results.put((worker_index, None, None, e))
+        return
+    results.put((worker_index, None, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, block_name, layout, detection_threshold = task
+        try:
+            block = shared_memory.SharedMemory(name=block_name)
+            try:
+                images = read_images_from_shared_memory(block, layout)
+                batch_results = detector.detect_batch(
+                    images, detection_threshold)
+                del images
+            finally:
+                block.close()
+        except Exception as e:
+            results.put((worker_index, task_id, None, e))
+        else:
+            results.put((worker_index, task_id, batch_results, None))
+
+
+class DetectorPool:
+    """Runs detection on a pool of worker processes
+
+    Each worker process builds its own detector (and therefore its own
+    tf.Session) from `model_path` and `label_map_path`, with its own intra-
+    and inter-op thread counts (see `options`), so many small sessions can
+    together use all of the cores of a large CPU host. Images are handed to
+    the workers through shared memory rather than being pickled; only the
+    (small) `DetectionResults` are sent back.
+
+    Tasks are queued in the pool and handed to each worker one at a time, as
+    it becomes idle, so the pool always knows which task a worker is
+    running. If a worker process dies, the task it was running fails with a
+    `RuntimeError`; workers are checked every `WORKER_POLL_INTERVAL`
+    seconds. A worker that fails to load its detector is not sent any
+    tasks. Once no worker is left that loaded its detector (or is still
+    loading it), all pending and later tasks fail with the load error (or a
+    `RuntimeError`).
+
+    The pool mirrors the `detect`/`detect_batch` API of `ObjectDetector` and
+    can be used as a context manager, which calls `close` on exit.
+
+    Attributes:
+        num_workers (int): the number of worker processes
+        max_batch_size (int): the maximum number of images sent to a single
+            worker in one task by `detect_batch`
+    """
+
+    def __init__(self,
+                 model_path: Path,
+                 label_map_path: Path,
+                 num_workers: int = None,
+                 detector_class: type = None,
+                 options: detection_models.options.SessionOptions = None,
+                 max_batch_size: int = 8,
+                 start_method: str = "spawn",
+                 **detector_kwargs):
+        """Starts the worker processes
+
+        Args:
+            model_path (pathlib.Path): the frozen inference graph each worker
+                loads
+            label_map_path (pathlib.Path): the label map each worker loads
+            num_workers (int, optional): Defaults to the number of CPUs
+                divided by `options.intra_op_threads`. The number of worker
+                processes
+            detector_class (type, optional): Defaults to
+                `detection_models.BBoxDetector`. The `ObjectDetector` subclass
+                each worker instantiates
+            options (detection_models.options.SessionOptions, optional):
+                Defaults to single-threaded sessions (one intra-op and one
+                inter-op thread). The session options of each worker
+            max_batch_size (int, optional): Defaults to 8. The maximum number
+                of images sent to a single worker in one task
+            start_method (str, optional): Defaults to "spawn". The
+                multiprocessing start method; "spawn" avoids forking a process
+                that may already hold TensorFlow state
+            **detector_kwargs: additional keyword arguments passed to
+                `detector_class`
+        """
+
+        if detector_class is None:
+            from detection_models.bbox_detector import BBoxDetector
+            detector_class = BBoxDetector
+        if options is None:
+            options = detection_models.options.SessionOptions(
+                intra_op_threads=1, inter_op_threads=1)
+        if num_workers is None:
+            num_workers = max(
+                1,
+                multiprocessing.cpu_count() // max(
+                    1, options.intra_op_threads or 1))
+
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        context = multiprocessing.get_context(start_method)
+        self._task_queues = [context.Queue() for _ in range(num_workers)]
+        self._results = context.Queue()
+        # the state below is guarded by _lock. _backlog holds the tasks no
+        # worker has been sent yet, _idle the workers that loaded their
+        # detector and have no task, and _running the task each busy worker
+        # was sent. _starting holds the workers still loading their detector,
+        # and _exited the workers found to have exited.
+        self._pending = {}
+        self._backlog = collections.deque()
+        self._idle = []
+        self._running = {}
+        self._starting = set(range(num_workers))
+        self._exited = set()
+        self._load_error = None
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+        self._stopping = threading.Event()
+        self._failure = None
+        self._workers = [
+            context.Process(
+                target=_worker_main,
+                args=(i, detector_class, model_path, label_map_path, options,
+                      detector_kwargs, self._task_queues[i], self._results),
+                daemon=True) for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._collector = threading.Thread(
+            target=self._collect_results, daemon=True)
+        self._collector.start()
+
+    def submit_batch(self,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5) -> Future:
+        """Sends a batch of images to the next available worker
+
+        Args:
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+
+        Returns:
+            concurrent.futures.Future: resolves to a list with one
+                `detection_models.results.DetectionResults` per image
+
+        Raises:
+            ValueError: if an image is not a uint8 array
+        """
+
+        if self._closed:
+            raise RuntimeError("cannot submit work to a closed DetectorPool")
+
+        future = Future()
+        block, layout = write_images_to_shared_memory(images)
+        task_id = next(self._task_ids)
+        with self._lock:
+            failure = self._failure
+            if failure is None:
+                self._pending[task_id] = (future, block)
+                self._backlog.append(
+                    (task_id, block.name, layout, detection_threshold))
+                self._dispatch()
+        if failure is not None:
+            self._release(block)
+            future.set_exception(failure)
+        return future
+
+    def detect(self, image: np.ndarray, detection_threshold: float = 0.5
+               ) -> detection_models.results.DetectionResults:
+        """Performs object detection on a given image in a worker process
+
+        Args:
+            image (np.ndarray): an image loaded into memory as a numpy array in
+                the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+
+        Returns:
+            detection_models.results.DetectionResults: the set of prediction
+                results for a given image
+        """
+
+        return self.submit_batch([image], detection_threshold).result()[0]
+
+    def detect_batch(self,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5,
+                     max_batch_size: int = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection on many images across the workers
+
+        The images are split into tasks of at most `max_batch_size` images,
+        which the workers process concurrently.
+
+        Args:
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            max_batch_size (int, optional): Defaults to `self.max_batch_size`.
+                The maximum number of images sent to a single worker at once
+
+        Returns:
+            list: one `detection_models.results.DetectionResults` per image,
+                in the same order as `images`
+        """
+
+        if max_batch_size is None:
+            max_batch_size = self.max_batch_size
+        futures = [
+            self.submit_batch(images[start:start + max_batch_size],
+                              detection_threshold)
+            for start in range(0, len(images), max_batch_size)
+        ]
+        return [
+            results for future in futures for results in future.result()
+        ]
+
+    def close(self) -> None:
+        """Stops the worker processes once all submitted work is finished"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            futures = [future for future, _ in self._pending.values()]
+        # every task either finishes or fails once its worker (or the last
+        # worker) has exited
+        wait(futures)
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        # a worker that died while writing a message may have left the
+        # results queue locked, so the collector is stopped by an event
+        # (once it has drained the queue) rather than by a message
+        self._stopping.set()
+        self._collector.join()
+        # only tasks of workers that died while closing can be left
+        self._fail_pending(RuntimeError("the DetectorPool was closed"))
+
+    def __enter__(self) -> "DetectorPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _collect_results(self) -> None:
+        # workers are checked on a schedule rather than when the results
+        # queue is idle, so that a steady stream of results from the other
+        # workers cannot hold back failing a dead worker's task
+        next_check = time.monotonic() + WORKER_POLL_INTERVAL
+        while True:
+            try:
+                message = self._results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    break
+                message = None
+            if message is not None:
+                self._handle_message(*message)
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + WORKER_POLL_INTERVAL
+
+    def _handle_message(self, worker_index: int, task_id: int,
+                        batch_results: list, error: Exception) -> None:
+        with self._lock:
+            if task_id is None:
+                self._starting.discard(worker_index)
+                if error is not None:
+                    self._load_error = error
+                elif worker_index not in self._exited:
+                    self._idle.append(worker_index)
+            elif self._running.get(worker_index) == task_id:
+                del self._running[worker_index]
+                self._idle.append(worker_index)
+            self._dispatch()
+        if task_id is not None:
+            self._finish(task_id, batch_results, error)
+        else:
+            self._fail_if_no_workers()
+
+    def _dispatch(self) -> None:
+        """Sends queued tasks to idle workers; called with `_lock` held"""
+        while self._backlog and self._idle:
+            worker_index = self._idle.pop()
+            task = self._backlog.popleft()
+            self._running[worker_index] = task[0]
+            self._task_queues[worker_index].put(task)
+
+    def _finish(self, task_id: int, batch_results: list,
+                error: Exception) -> None:
+        with self._lock:
+            pending = self._pending.pop(task_id, None)
+        # the task was already failed (e.g. because no worker is left)
+        if pending is None:
+            return
+        future, block = pending
+        self._release(block)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(batch_results)
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Fails every pending task, and every task submitted later"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._backlog.clear()
+            self._failure = error
+        for future, block in pending.values():
+            self._release(block)
+            future.set_exception(error)
+
+    def _fail_if_no_workers(self) -> None:
+        """Fails the pool once no worker can run tasks any more"""
+        with self._lock:
+            if (self._failure is not None or self._starting or self._idle
+                    or self._running):
+                return
+            error = self._load_error or RuntimeError(
+                "every DetectorPool worker has exited")
+        self._fail_pending(error)
+
+    def _check_workers(self) -> None:
+        """Fails the tasks of worker processes that have died"""
+        failed = []
+        with self._lock:
+            for worker_index, worker in enumerate(self._workers):
+                if (worker.exitcode is None
+                        or worker_index in self._exited):
+                    continue
+                self._exited.add(worker_index)
+                self._starting.discard(worker_index)
+                if worker_index in self._idle:
+                    self._idle.remove(worker_index)
+                task_id = self._running.pop(worker_index, None)
+                if task_id is not None:
+                    failed.append((task_id, worker.exitcode))
+        for task_id, exitcode in failed:
+            self._finish(
+                task_id, None,
+                RuntimeError("a DetectorPool worker exited with code "
+                             "{}".format(exitcode)))
+        self._fail_if_no_workers()
+
+    @staticmethod
+    def _release(block: shared_memory.SharedMemory) -> None:
+        block.close()
+        block.unlink()
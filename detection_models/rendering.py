@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from PIL import Image, ImageDraw, ImageFont
+
+# RGB colors assigned to labels; a label always gets the same color
+PALETTE = np.array(
+    [
+        (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200),
+        (245, 130, 48), (145, 30, 180), (70, 240, 240), (240, 50, 230),
+        (210, 245, 60), (250, 190, 212), (0, 128, 128), (220, 190, 255),
+        (170, 110, 40), (255, 250, 200), (128, 0, 0), (170, 255, 195),
+        (128, 128, 0), (255, 215, 180), (0, 0, 128), (128, 128, 128),
+    ],
+    dtype=np.uint8)
+
+
+class BoxRenderer:
+    """Draws bounding boxes, labels, and scores directly onto image arrays
+
+    Boxes are drawn with NumPy slice assignments on the image array itself,
+    so no copy of the image (or round trip through PIL) is made. The font is
+    loaded once per renderer, and the bitmap of each distinct caption (e.g.
+    "person: 96%") is rendered once and cached, so drawing a caption is a
+    masked slice assignment as well. The caption cache is guarded by a lock,
+    so a renderer (such as `default_renderer`) can be shared by threads.
+
+    Attributes:
+        line_thickness (int): the thickness of box outlines in pixels
+        text_color (tuple): the RGB color of caption text
+        max_cached_captions (int): the maximum number of caption bitmaps kept
+            in the cache
+    """
+
+    def __init__(self,
+                 line_thickness: int = 8,
+                 font: ImageFont.ImageFont = None,
+                 text_color: Tuple[int, int, int] = (0, 0, 0),
+                 max_cached_captions: int = 4096):
+        """Creates a renderer
+
+        Args:
+            line_thickness (int, optional): Defaults to 8. The thickness of
+                box outlines in pixels
+            font (PIL.ImageFont.ImageFont, optional): Defaults to PIL's
+                default font. The font used for captions
+            text_color (tuple, optional): Defaults to black. The RGB color of
+                caption text
+            max_cached_captions (int, optional): Defaults to 4096. The maximum
+                number of caption bitmaps kept in the cache
+        """
+
+        self.line_thickness = line_thickness
+        self.text_color = np.array(text_color, dtype=np.uint8)
+        self.max_cached_captions = max_cached_captions
+        self._font = font if font is not None else ImageFont.load_default()
+        self._caption_cache = OrderedDict()
+        self._caption_cache_lock = threading.Lock()
+
+    @staticmethod
+    def color_for(label: str) -> np.ndarray:
+        """Returns the (stable) RGB color assigned to a label"""
+        return PALETTE[zlib.crc32(str(label).encode("utf-8")) % len(PALETTE)]
+
+    def _caption_bitmap(self, caption: str) -> np.ndarray:
+        """Returns the cached boolean bitmap (height, width) of a caption"""
+        with self._caption_cache_lock:
+            bitmap = self._caption_cache.get(caption)
+            if bitmap is not None:
+                self._caption_cache.move_to_end(caption)
+                return bitmap
+
+        # rendered outside the lock; a caption rendered concurrently by two
+        # threads is simply cached twice
+        left, top, right, bottom = self._font.getbbox(caption)
+        canvas = Image.new("L", (max(right - left, 1), max(bottom - top, 1)))
+        ImageDraw.Draw(canvas).text((-left, -top),
+                                    caption,
+                                    fill=255,
+                                    font=self._font)
+        bitmap = np.asarray(canvas) > 127
+        with self._caption_cache_lock:
+            self._caption_cache[caption] = bitmap
+            if len(self._caption_cache) > self.max_cached_captions:
+                self._caption_cache.popitem(last=False)
+        return bitmap
+
+    def draw(self,
+             image: np.ndarray,
+             boxes: np.ndarray,
+             scores: np.ndarray,
+             labels: Sequence[str],
+             score_threshold: float = 0.5,
+             max_detections: int = 20) -> np.ndarray:
+        """Draws boxes with "label: score" captions onto an image in place
+
+        Args:
+            image (np.ndarray): the image to draw on, in the RGB colorspace
+                (height, width, 3)
+            boxes (np.ndarray): normalized [ymin, xmin, ymax, xmax] boxes
+                (N, 4)
+            scores (np.ndarray): the detection score of each box (N,)
+            labels (Sequence[str]): the label of each box
+            score_threshold (float, optional): Defaults to 0.5. Boxes with a
+                lower score are not drawn
+            max_detections (int, optional): Defaults to 20. The maximum number
+                of (highest scoring) boxes to draw
+
+        Returns:
+            np.ndarray: `image`, with the boxes drawn on it
+        """
+
+        scores = np.asarray(scores).reshape(-1)
+        if not len(scores):
+            return image
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        order = np.argsort(-scores, kind="stable")
+        order = order[scores[order] >= score_threshold][:max_detections]
+        if not len(order):
+            return image
+
+        height, width = image.shape[:2]
+        pixel_boxes = np.round(
+            np.clip(boxes[order], 0.0, 1.0) *
+            np.array([height, width, height, width])).astype(np.int64)
+        thickness = self.line_thickness
+
+        # draw in reverse order so that the highest scoring boxes end up on
+        # top of lower scoring ones
+        for index, (top, left, bottom, right) in reversed(
+                list(zip(order, pixel_boxes))):
+            label = labels[index]
+            color = self.color_for(label)
+            bottom, right = max(bottom, top + 1), max(right, left + 1)
+
+            image[top:min(top + thickness, bottom), left:right] = color
+            image[max(bottom - thickness, top):bottom, left:right] = color
+            image[top:bottom, left:min(left + thickness, right)] = color
+            image[top:bottom, max(right - thickness, left):right] = color
+
+            self._draw_caption(
+                image, "{}: {}%".format(label, int(100 * scores[index])),
+                top, left, color)
+        return image
+
+    def _draw_caption(self, image: np.ndarray, caption: str, top: int,
+                      left: int, color: np.ndarray) -> None:
+        bitmap = self._caption_bitmap(caption)
+        margin = 2
+        box_height = bitmap.shape[0] + 2 * margin
+        box_width = bitmap.shape[1] + 2 * margin
+
+        # place the caption above the box, or inside it at the top edge of
+        # the image
+        caption_top = top - box_height if top >= box_height else top
+        caption_bottom = min(caption_top + box_height, image.shape[0])
+        caption_right = min(left + box_width, image.shape[1])
+        if caption_bottom <= caption_top or caption_right <= left:
+            return
+
+        image[caption_top:caption_bottom, left:caption_right] = color
+        text_top, text_left = caption_top + margin, left + margin
+        text_region = image[text_top:text_top + bitmap.shape[0],
+                            text_left:text_left + bitmap.shape[1]]
+        visible_bitmap = bitmap[:text_region.shape[0], :text_region.shape[1]]
+        text_region[visible_bitmap] = self.text_color
+
+    def render(self,
+               image: np.ndarray,
+               results,
+               inplace: bool = True,
+               score_threshold: float = 0.5,
+               max_detections: int = 20) -> np.ndarray:
+        """Draws a set of detection results onto an image
+
+        Args:
+            image (np.ndarray): the image to draw on, in the RGB colorspace
+                (height, width, 3)
+            results (Mapping): a `DetectionResults` (or any mapping of labels
+                to sequences of `DetectedBBox`-like objects); the arrays of a
+                `ColumnarDetectionResults` are used directly
+            inplace (bool, optional): Defaults to True. Whether to draw on
+                `image` directly or on a copy of it
+            score_threshold (float, optional): Defaults to 0.5. Detections
+                with a lower score are not drawn
+            max_detections (int, optional): Defaults to 20. The maximum number
+                of (highest scoring) detections to draw
+
+        Returns:
+            np.ndarray: the image with the detections drawn on it
+        """
+
+        if not inplace:
+            image = image.copy()
+        boxes, scores, labels = self._results_to_arrays(results)
+        return self.draw(image, boxes, scores, labels, score_threshold,
+                         max_detections)
+
+    def render_batch(self,
+                     images: Sequence[np.ndarray],
+                     results: Sequence,
+                     inplace: bool = True,
+                     score_threshold: float = 0.5,
+                     max_detections: int = 20) -> List[np.ndarray]:
+        """Draws detection results onto many images (e.g. video frames)
+
+        Args:
+            images (Sequence[np.ndarray]): the images to draw on; may also be
+                a single (batch, height, width, 3) array, which is then drawn
+                on in place unless `inplace` is False
+            results (Sequence): the results for each image; see `render`
+            inplace (bool, optional): Defaults to True. Whether to draw on
+                the images directly or on copies of them
+            score_threshold (float, optional): Defaults to 0.5. Detections
+                with a lower score are not drawn
+            max_detections (int, optional): Defaults to 20. The maximum number
+                of detections to draw per image
+
+        Returns:
+            list: the images with the detections drawn on them
+        """
+
+        if len(images) != len(results):
+            raise ValueError("got {} images but {} results".format(
+                len(images), len(results)))
+        return [
+            self.render(image, image_results, inplace, score_threshold,
+                        max_detections)
+            for image, image_results in zip(images, results)
+        ]
+
+    @staticmethod
+    def _results_to_arrays(results) -> Tuple[np.ndarray, np.ndarray, list]:
+        if hasattr(results, "boxes") and hasattr(results, "labels"):
+            return results.boxes, results.scores, results.labels
+        detections = [
+            detection for detections in results.values()
+            for detection in detections
+        ]
+        boxes = np.array(
+            [[d.ymin, d.xmin, d.ymax, d.xmax] for d in detections],
+            dtype=np.float32).reshape(-1, 4)
+        scores = np.array([d.confidence for d in detections],
+                          dtype=np.float32)
+        return boxes, scores, [d.label for d in detections]
+
+
+# the renderer used by the `overlay_*` methods of `detection_models.results`
+default_renderer = BoxRenderer()
@@ -2,10 +2,42 @@
 
 from abc import ABC, abstractmethod
 from collections import OrderedDict
+from collections.abc import MutableSequence
 
 import numpy as np
 
-from object_detection.utils import visualization_utils as vis_util
+import detection_models.ops
+import detection_models.rendering
+
+# the label of class IDs that the label map does not name
+UNKNOWN_LABEL_FORMAT = "unknown_{}"
+
+
+def lookup_labels(label_table: np.ndarray,
+                  class_ids: np.ndarray) -> np.ndarray:
+    """Maps class IDs to labels
+
+    Class IDs that are beyond the end of `label_table`, or that it maps to
+    `None`, are given the label `UNKNOWN_LABEL_FORMAT.format(class_id)`, so
+    that a model emitting classes missing from its label map still yields
+    results rather than an error.
+
+    Args:
+        label_table (np.ndarray): an object array mapping class IDs (as
+            indices) to labels
+        class_ids (np.ndarray): the class IDs to map
+
+    Returns:
+        np.ndarray: the label of each class ID, as an object array
+    """
+
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    known = (class_ids >= 0) & (class_ids < len(label_table))
+    labels = np.empty(class_ids.shape, dtype=object)
+    labels[known] = label_table[class_ids[known]]
+    for i in np.flatnonzero(~known | np.equal(labels, None)):
+        labels.flat[i] = UNKNOWN_LABEL_FORMAT.format(class_ids.flat[i])
+    return labels
 
 
 class DetectionResults(OrderedDict):
@@ -40,50 +72,438 @@ class DetectionResults(OrderedDict):
                 of detected objects to display on the image.
 
         Returns:
-            np.ndarray: the image with the associated visuals overlaid
+            np.ndarray: the image with the associated visuals overlaid; the
+                image is returned unchanged if there are no detections
         """
 
-        if not inplace:
-            image = image.copy()
-        all_detected_objects = []
+        return detection_models.rendering.default_renderer.render(
+            image,
+            self,
+            inplace=inplace,
+            score_threshold=score_threshold,
+            max_detections=max_detections)
+
+
+class ColumnarDetectionResults(DetectionResults):
+    """Stores bounding box detections as arrays rather than as objects
+
+    `ColumnarDetectionResults` holds all of the detections for an image in a
+    few NumPy arrays, sorted by descending detection score. It remains a
+    `DetectionResults`, so it can be used exactly like one: it is keyed with
+    the detected labels in descending order of their highest detection score,
+    and each value is a sequence of `DetectedBBox` objects. These sequences are
+    lightweight views (see `DetectedBBoxSequence`); a `DetectedBBox` is only
+    created when an element is accessed.
+
+    The results can also be changed like a `DetectionResults`. The first
+    change (setting, deleting, or popping a label, or changing one of the
+    sequences) turns every sequence into a list of `DetectedBBox` objects.
+    From then on the arrays below are rebuilt from the detections the results
+    hold whenever they are read, so they stay consistent with the dict, but
+    are no longer cheap to access.
+
+    Attributes:
+        boxes (np.ndarray): the normalized bounding boxes of all detections as
+            [ymin, xmin, ymax, xmax] rows (N, 4), float32
+        scores (np.ndarray): the detection scores of all detections (N,),
+            float32
+        class_ids (np.ndarray): the class IDs of all detections (N,), int64
+        label_table (np.ndarray): an object array mapping class IDs (as
+            indices) to labels; usually shared with the detector that produced
+            the results rather than copied. Class IDs it does not name are
+            labeled as described in `lookup_labels`
+    """
+
+    def __init__(self, boxes: np.ndarray, scores: np.ndarray,
+                 class_ids: np.ndarray, label_table: np.ndarray) -> None:
+        super().__init__()
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        order = np.argsort(-scores, kind="stable")
+        self._boxes = np.asarray(
+            boxes, dtype=np.float32).reshape(-1, 4)[order]
+        self._scores = scores[order]
+        self._class_ids = np.asarray(
+            class_ids, dtype=np.int64).reshape(-1)[order]
+        self._label_table = label_table
+        self._materialized = False
+
+        groups = self._group_by_class(self._class_ids)
+        group_labels = lookup_labels(
+            self._label_table, [class_id for class_id, _ in groups])
+        for label, (_, indices) in zip(group_labels, groups):
+            super().__setitem__(label, DetectedBBoxSequence(self, indices))
+
+    @staticmethod
+    def _group_by_class(class_ids: np.ndarray):
+        """Groups detection indices by class in order of first appearance
+
+        Args:
+            class_ids (np.ndarray): the class IDs of all detections (N,)
+
+        Returns:
+            list: (class_id, indices) tuples; `indices` is an array of the
+                (ascending) positions of that class's detections
+        """
+
+        unique_classes, first_index, inverse = np.unique(
+            class_ids, return_index=True, return_inverse=True)
+        group_order = np.argsort(first_index)
+        group_rank = np.empty_like(group_order)
+        group_rank[group_order] = np.arange(len(group_order))
+        detection_rank = group_rank[inverse.reshape(-1)]
+        order = np.argsort(detection_rank, kind="stable")
+        group_sizes = np.bincount(detection_rank, minlength=len(group_order))
+        groups = np.split(order, np.cumsum(group_sizes)[:-1])
+        return list(zip(unique_classes[group_order], groups))
+
+    @property
+    def boxes(self) -> np.ndarray:
+        if self._materialized:
+            return self._rebuild()[0]
+        return self._boxes
+
+    @property
+    def scores(self) -> np.ndarray:
+        if self._materialized:
+            return self._rebuild()[1]
+        return self._scores
+
+    @property
+    def class_ids(self) -> np.ndarray:
+        if self._materialized:
+            return self._rebuild()[2]
+        return self._class_ids
+
+    @property
+    def label_table(self) -> np.ndarray:
+        if self._materialized:
+            return self._rebuild()[3]
+        return self._label_table
+
+    def _detections_by_score(self) -> list:
+        """Returns the detections the results hold, by descending score"""
+        detections = [
+            detection for detections in self.values()
+            for detection in detections
+        ]
+        detections.sort(key=lambda detection: -detection.confidence)
+        return detections
+
+    def _rebuild(self) -> tuple:
+        """Rebuilds the arrays from the detections the results hold
+
+        Labels that the label table does not name (including ones it labels
+        as described in `lookup_labels`) are given new class IDs past its
+        end.
+
+        Returns:
+            tuple: the boxes, scores, class IDs, and label table
+        """
+
+        detections = self._detections_by_score()
+        class_ids = {}
+        for class_id, label in enumerate(self._label_table):
+            if label is not None:
+                class_ids.setdefault(label, class_id)
+        new_labels = []
+        for detection in detections:
+            if detection.label not in class_ids:
+                class_ids[detection.label] = (len(self._label_table) +
+                                              len(new_labels))
+                new_labels.append(detection.label)
+        label_table = self._label_table
+        if new_labels:
+            label_table = np.concatenate(
+                [label_table, np.array(new_labels, dtype=object)])
+        return (np.array([(detection.ymin, detection.xmin, detection.ymax,
+                           detection.xmax) for detection in detections],
+                         dtype=np.float32).reshape(-1, 4),
+                np.array([detection.confidence for detection in detections],
+                         dtype=np.float32),
+                np.array([class_ids[detection.label]
+                          for detection in detections], dtype=np.int64),
+                label_table)
+
+    def _materialize(self) -> None:
+        """Turns each `DetectedBBoxSequence` of the results into a list
+
+        Called before the results or one of their sequences are changed.
+        """
+
+        if self._materialized:
+            return
         for detections in self.values():
-            all_detected_objects.extend(detections)
-        all_detected_objects.sort(key=lambda obj: obj.confidence, reverse=True)
-
-        # construct a category index (this does not necessarily match that
-        # of the detection model; we can just construct an equivalent mapping
-        # such that the visualization utils associate the proper strings with
-        # each detected object), and construct a dict for quick lookups in the
-        # subsequent section
-        category_index = {}
-        label_to_int = {}
-        for i, label in enumerate(self.keys()):
-            category_index[i + 1] = {"id": i + 1, "name": label}
-            label_to_int[label] = i + 1
-
-        # TODO: handle empty list
-        if isinstance(all_detected_objects[0], DetectedBBox):
-            boxes = np.zeros((len(all_detected_objects), 4), dtype=np.float32)
-            classes = np.zeros((len(all_detected_objects), ), dtype=np.uint8)
-            scores = np.zeros((len(all_detected_objects), ), dtype=np.float32)
-
-            for i, obj in enumerate(all_detected_objects):
-                classes[i] = label_to_int[obj.label]
-                scores[i] = obj.confidence
-                boxes[i] = np.array([obj.ymin, obj.xmin, obj.ymax, obj.xmax])
-
-            return vis_util.visualize_boxes_and_labels_on_image_array(
-                image,
-                boxes,
-                classes,
-                scores,
-                category_index,
-                use_normalized_coordinates=True,
-                max_boxes_to_draw=max_detections,
-                min_score_thresh=score_threshold,
-            )
-        else:
-            return image
+            if (isinstance(detections, DetectedBBoxSequence) and
+                    detections._results is self):
+                detections._list = [
+                    self._make_detection(row) for row in detections._indices
+                ]
+        self._materialized = True
+
+    def __setitem__(self, key, value) -> None:
+        self._materialize()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key) -> None:
+        self._materialize()
+        super().__delitem__(key)
+
+    def pop(self, *args):
+        self._materialize()
+        return super().pop(*args)
+
+    def popitem(self, last: bool = True) -> tuple:
+        self._materialize()
+        return super().popitem(last)
+
+    def setdefault(self, key, default=None):
+        self._materialize()
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs) -> None:
+        self._materialize()
+        super().update(*args, **kwargs)
+
+    def clear(self) -> None:
+        self._materialize()
+        super().clear()
+
+    def copy(self) -> "ColumnarDetectionResults":
+        """Returns a copy of the results (of the same type)"""
+        return self._take(len(self.scores))
+
+    @property
+    def labels(self) -> np.ndarray:
+        """np.ndarray: the label of each detection (N,), as an object array"""
+        return lookup_labels(self.label_table, self.class_ids)
+
+    def filter(self, score_threshold: float) -> "ColumnarDetectionResults":
+        """Returns the detections with a score of at least `score_threshold`
+
+        Args:
+            score_threshold (float): the minimum detection score to keep
+
+        Returns:
+            ColumnarDetectionResults: a new set of results (of the same type)
+                holding only the high scoring detections
+        """
+
+        # scores are sorted in descending order, so the kept detections are
+        # a prefix of the arrays
+        count = int(np.count_nonzero(self.scores >= score_threshold))
+        return self._take(count)
+
+    def _take(self, count: int) -> "ColumnarDetectionResults":
+        """Returns new results holding the first `count` detections"""
+        return self.__class__(self.boxes[:count], self.scores[:count],
+                              self.class_ids[:count], self.label_table)
+
+    def denormalize(self, image_height: int, image_width: int) -> np.ndarray:
+        """Converts the boxes of all detections into pixel coordinates
+
+        The vectorized counterpart of `DetectedBBox.denormalize`.
+
+        Args:
+            image_height (int): the height of the image in pixels
+            image_width (int): the width of the image in pixels
+
+        Returns:
+            np.ndarray: [ymin, xmin, ymax, xmax] pixel boxes (N, 4), int64, in
+                the same (descending score) order as `boxes`
+        """
+
+        return detection_models.ops.denormalize_boxes(
+            self.boxes, image_height, image_width)
+
+    def to_detection_results(self) -> DetectionResults:
+        """Returns a mutable copy of the results
+
+        Returns:
+            DetectionResults: the same detections, with a list of
+                `DetectedBBox` objects (or objects of a subclass) per label
+        """
+
+        results = DetectionResults()
+        for label, detections in self.items():
+            results[label] = list(detections)
+        return results
+
+    @classmethod
+    def from_detection_results(cls, results: DetectionResults
+                               ) -> "ColumnarDetectionResults":
+        """Converts `DetectionResults` into columnar results
+
+        Only the bounding boxes of the detections are kept; the label table
+        of the new results holds the labels of `results` in order.
+
+        Args:
+            results (DetectionResults): results holding `DetectedBBox`
+                objects (or objects of a subclass)
+
+        Returns:
+            ColumnarDetectionResults: the same bounding box detections
+
+        Raises:
+            TypeError: if a detection is not a `DetectedBBox`
+        """
+
+        boxes, scores, class_ids = [], [], []
+        for class_id, detections in enumerate(results.values()):
+            for detection in detections:
+                if not isinstance(detection, DetectedBBox):
+                    raise TypeError(
+                        "cannot convert a {} into a bounding box".format(
+                            type(detection).__name__))
+                boxes.append((detection.ymin, detection.xmin, detection.ymax,
+                              detection.xmax))
+                scores.append(detection.confidence)
+                class_ids.append(class_id)
+        return ColumnarDetectionResults(
+            boxes=np.array(boxes, dtype=np.float32).reshape(-1, 4),
+            scores=np.array(scores, dtype=np.float32),
+            class_ids=np.array(class_ids, dtype=np.int64),
+            label_table=np.array(list(results.keys()), dtype=object))
+
+    def _make_detection(self, row: int) -> "DetectedBBox":
+        """Creates the `DetectedObject` for one row of the arrays"""
+        return DetectedBBox(
+            label=lookup_labels(self.label_table,
+                                self.class_ids[row]).item(),
+            confidence=self.scores[row],
+            box=self.boxes[row])
+
+    def __reduce__(self):
+        return (self.__class__, (self.boxes, self.scores, self.class_ids,
+                                 self.label_table))
+
+
+class MaskDetectionResults(ColumnarDetectionResults):
+    """Stores instance segmentation detections with run-length encoded masks
+
+    In addition to the arrays of `ColumnarDetectionResults`, each detection
+    has a full-image mask, stored run-length encoded (see `encode_rle`). The
+    sequences stored at each label yield `DetectedMask` objects.
+
+    Attributes:
+        mask_rles (list): the run-length encoded mask of each detection, in
+            the same (descending score) order as the other arrays
+        image_size (tuple): the (height, width) of the image the masks cover
+    """
+
+    def __init__(self, boxes: np.ndarray, scores: np.ndarray,
+                 class_ids: np.ndarray, label_table: np.ndarray,
+                 mask_rles: list, image_size: tuple) -> None:
+        # sort here so that the masks can be put in the same order as the
+        # arrays; the (stable) sort in the base class is then a no-op
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        order = np.argsort(-scores, kind="stable")
+        self._mask_rles = [mask_rles[i] for i in order]
+        self.image_size = tuple(image_size)
+        super().__init__(
+            np.asarray(boxes, dtype=np.float32).reshape(-1, 4)[order],
+            scores[order],
+            np.asarray(class_ids).reshape(-1)[order], label_table)
+
+    @property
+    def mask_rles(self) -> list:
+        if self._materialized:
+            return [
+                detection.mask_rle
+                for detection in self._detections_by_score()
+            ]
+        return self._mask_rles
+
+    def _take(self, count: int) -> "MaskDetectionResults":
+        return self.__class__(self.boxes[:count], self.scores[:count],
+                              self.class_ids[:count], self.label_table,
+                              self.mask_rles[:count], self.image_size)
+
+    def _make_detection(self, row: int) -> "DetectedMask":
+        return DetectedMask(
+            label=lookup_labels(self.label_table,
+                                self.class_ids[row]).item(),
+            confidence=self.scores[row],
+            box=self.boxes[row],
+            mask_rle=self.mask_rles[row],
+            image_size=self.image_size)
+
+    def __reduce__(self):
+        return (self.__class__,
+                (self.boxes, self.scores, self.class_ids, self.label_table,
+                 self.mask_rles, self.image_size))
+
+
+class DetectedBBoxSequence(MutableSequence):
+    """A lazily evaluated sequence of `DetectedBBox` objects
+
+    The sequence only stores the row indices of its detections within the
+    arrays of a `ColumnarDetectionResults`; `DetectedBBox` objects (or
+    objects of a `DetectedBBox` subclass, such as `DetectedMask`) are created
+    when elements are accessed.
+
+    It supports the methods and operators of the list it stands in for.
+    Changing it first turns every sequence of its results into a list (see
+    `ColumnarDetectionResults`); the sequence then wraps its list.
+    Concatenating or copying it returns a list.
+    """
+
+    __slots__ = ("_results", "_indices", "_list")
+
+    def __init__(self, results: ColumnarDetectionResults,
+                 indices: np.ndarray) -> None:
+        self._results = results
+        self._indices = indices
+        self._list = None
+
+    def _mutable(self) -> list:
+        """Returns the list of detections, converting the results first"""
+        if self._list is None:
+            self._results._materialize()
+        return self._list
+
+    def __len__(self) -> int:
+        if self._list is not None:
+            return len(self._list)
+        return len(self._indices)
+
+    def __getitem__(self, index):
+        if self._list is not None:
+            return self._list[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._results._make_detection(self._indices[index])
+
+    def __setitem__(self, index, value) -> None:
+        self._mutable()[index] = value
+
+    def __delitem__(self, index) -> None:
+        del self._mutable()[index]
+
+    def insert(self, index: int, value) -> None:
+        self._mutable().insert(index, value)
+
+    def sort(self, *, key=None, reverse: bool = False) -> None:
+        self._mutable().sort(key=key, reverse=reverse)
+
+    def copy(self) -> list:
+        return list(self)
+
+    def __add__(self, other) -> list:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> list:
+        return list(other) + list(self)
+
+    def __mul__(self, count: int) -> list:
+        return list(self) * count
+
+    __rmul__ = __mul__
+
+    def __reduce__(self):
+        return (list, (list(self), ))
+
+    def __repr__(self) -> str:
+        return repr(list(self))
 
 
 class DetectedObject(ABC):
@@ -94,6 +514,8 @@ class DetectedObject(ABC):
         confidence (float): the detection score for the detected object
     """
 
+    __slots__ = ("label", "confidence")
+
     def __init__(self, label: str, confidence: float):
         self.label = label
         self.confidence = confidence
@@ -123,6 +545,8 @@ class DetectedBBox(DetectedObject):
             pixel coordinates
     """
 
+    __slots__ = ("ymin", "xmin", "ymax", "xmax")
+
     def __init__(self, label: str, confidence: float, box: np.ndarray) -> None:
         super().__init__(label, confidence)
         self.ymin = box[0]
@@ -148,20 +572,13 @@ class DetectedBBox(DetectedObject):
 
         if not inplace:
             image = image.copy()
-        return vis_util.visualize_boxes_and_labels_on_image_array(
-            image=image,
-            boxes=np.array(
-                [[self.ymin, self.xmin, self.ymax, self.xmax]],
-                dtype=np.float32),
-            classes=np.array([1], dtype=np.uint8),
+        return detection_models.rendering.default_renderer.draw(
+            image,
+            boxes=np.array([[self.ymin, self.xmin, self.ymax, self.xmax]],
+                           dtype=np.float32),
             scores=np.array([self.confidence], dtype=np.float32),
-            category_index={1: {
-                "id": 1,
-                "name": self.label
-            }},
-            use_normalized_coordinates=True,
-            line_thickness=8,
-        )
+            labels=[self.label],
+            score_threshold=0.0)
 
     def denormalize(self, image_height: int, image_width: int):
         """Converts this objects normalized coordinates into pixel coordinates
@@ -204,3 +621,113 @@ class DetectedBBox(DetectedObject):
                 for l, v in zip(["ymin", "xmin", "ymax", "xmax"],
                                 [self.ymin, self.xmin, self.ymax, self.xmax])
             ]))
+
+
+class DetectedMask(DetectedBBox):
+    """Represents detected objects with a bounding box and instance mask
+
+    The mask covers the whole image but is stored run-length encoded (see
+    `encode_rle`); it is only decoded into a dense array when `mask` is
+    accessed.
+
+    Attributes:
+        label (str): the label (class name) for the detected object
+        confidence (float): the detection score for the detected object
+        ymin, xmin, ymax, xmax (float): the bounding box in normalized pixel
+            coordinates; see `DetectedBBox`
+        mask_rle (np.ndarray): the run-length encoded mask
+        image_size (tuple): the (height, width) of the image the mask covers
+    """
+
+    __slots__ = ("mask_rle", "image_size")
+
+    def __init__(self, label: str, confidence: float, box: np.ndarray,
+                 mask_rle: np.ndarray, image_size: tuple) -> None:
+        super().__init__(label, confidence, box)
+        self.mask_rle = mask_rle
+        self.image_size = tuple(image_size)
+
+    @property
+    def mask(self) -> np.ndarray:
+        """np.ndarray: the decoded boolean mask (height, width)"""
+        return decode_rle(self.mask_rle, self.image_size)
+
+    @property
+    def area(self) -> int:
+        """int: the number of pixels covered by the mask"""
+        return int(self.mask_rle[1::2].sum())
+
+    def overlay_on_image(self, image: np.ndarray, inplace=True,
+                         color=(0, 255, 0), alpha: float = 0.4) -> np.ndarray:
+        """Overlays the mask, bounding box, class label, and score on an image
+
+        Args:
+            image (np.ndarray): the image on which to overlay results; loaded
+                into memory as a numpy array in the RGB colorspace
+                (height, width, 3)
+            inplace (bool, optional): Defaults to True. Whether to modify the
+                input image directly or make a copy before adding visualized
+                results. The function will return an image with overlaid
+                results either way.
+            color (tuple, optional): Defaults to green. The RGB color of the
+                mask
+            alpha (float, optional): Defaults to 0.4. The opacity of the mask
+
+        Returns:
+            np.ndarray: the image with the mask, box, label, and score overlaid
+        """
+
+        if not inplace:
+            image = image.copy()
+        mask = self.mask
+        image[mask] = (image[mask] * (1 - alpha) +
+                       np.asarray(color) * alpha).astype(image.dtype)
+        return super().overlay_on_image(image, inplace=True)
+
+    def __repr__(self) -> str:
+        return (
+            "detection_models.results.DetectedMask({label}, {confidence}, "
+            "{box}, area={area})".format(
+                label=self.label,
+                confidence=self.confidence,
+                box=np.array([self.ymin, self.xmin, self.ymax, self.xmax]),
+                area=self.area))
+
+
+def encode_rle(mask: np.ndarray) -> np.ndarray:
+    """Run-length encodes a binary mask
+
+    The mask is flattened in row-major order and encoded as the lengths of
+    alternating runs of background and foreground pixels, starting with a
+    (possibly empty) background run.
+
+    Args:
+        mask (np.ndarray): a binary mask of any shape
+
+    Returns:
+        np.ndarray: the run lengths (uint32)
+    """
+
+    flat = np.asarray(mask, dtype=bool).reshape(-1)
+    boundaries = np.concatenate(
+        [[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]])
+    counts = np.diff(boundaries)
+    if flat.size and flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts.astype(np.uint32)
+
+
+def decode_rle(counts: np.ndarray, shape: tuple) -> np.ndarray:
+    """Decodes a mask encoded by `encode_rle`
+
+    Args:
+        counts (np.ndarray): the run lengths
+        shape (tuple): the shape of the original mask
+
+    Returns:
+        np.ndarray: the boolean mask
+    """
+
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, counts).reshape(shape)
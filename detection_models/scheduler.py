@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor
+
+import numpy as np
+
+import detection_models.results
+
+
+class BatchingStats:
+    """Counters describing the behavior of a `MicroBatchScheduler`
+
+    Attributes:
+        requests (int): the number of detection requests submitted
+        batches (int): the number of batches run through the model
+        batch_sizes (collections.Counter): a histogram of batch sizes, keyed
+            by batch size with the number of batches of that size as values
+        queue_depth (int): the number of requests currently waiting to be
+            batched
+        max_queue_depth (int): the largest `queue_depth` observed
+        total_queue_time (float): the total time (in seconds) requests spent
+            waiting in the queue before their batch started
+        total_inference_time (float): the total time (in seconds) spent in
+            `detect_batch` calls
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_queue_time = 0.0
+        self.total_inference_time = 0.0
+
+    @property
+    def mean_batch_size(self) -> float:
+        """float: the mean number of requests per batch"""
+        if not self.batches:
+            return 0.0
+        return sum(size * count for size, count in self.batch_sizes.items()
+                   ) / self.batches
+
+    @property
+    def mean_queue_time(self) -> float:
+        """float: the mean time (in seconds) a request waited to be batched"""
+        batched_requests = sum(
+            size * count for size, count in self.batch_sizes.items())
+        if not batched_requests:
+            return 0.0
+        return self.total_queue_time / batched_requests
+
+    def as_dict(self) -> dict:
+        """Returns the counters (and derived means) as a plain dictionary"""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "batch_sizes": dict(self.batch_sizes),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "mean_batch_size": self.mean_batch_size,
+            "mean_queue_time": self.mean_queue_time,
+            "total_inference_time": self.total_inference_time,
+        }
+
+
+class MicroBatchScheduler:
+    """Groups concurrent asyncio detection requests into batches
+
+    Requests submitted through `detect` are queued. Once a request arrives,
+    the scheduler waits at most `max_delay` seconds for more requests (up to
+    `max_batch_size` in total) and runs the whole group through the detector's
+    `detect_batch` on an executor thread, so the event loop is never blocked
+    by inference. Requests that arrive while a batch is running are collected
+    into the next batch. Each caller receives its own `DetectionResults`.
+
+    Larger `max_delay` values trade request latency for throughput; `stats`
+    reports the queue depths and batch sizes needed to tune it.
+
+    Attributes:
+        detector (detection_models.ObjectDetector): the detector that runs
+            the batches
+        max_batch_size (int): the maximum number of requests per batch
+        max_delay (float): the maximum time (in seconds) to wait for more
+            requests after the first request of a batch arrives
+        stats (BatchingStats): counters describing the batching behavior
+    """
+
+    def __init__(self,
+                 detector,
+                 max_batch_size: int = None,
+                 max_delay: float = 0.005,
+                 executor: Executor = None):
+        """Creates a scheduler for a detector
+
+        Args:
+            detector (detection_models.ObjectDetector): the detector that
+                runs the batches
+            max_batch_size (int, optional): Defaults to
+                `detector.max_batch_size`. The maximum number of requests per
+                batch
+            max_delay (float, optional): Defaults to 0.005. The maximum time
+                (in seconds) to wait for more requests after the first request
+                of a batch arrives
+            executor (concurrent.futures.Executor, optional): Defaults to
+                None. The executor on which batches are run; the event loop's
+                default executor is used if None
+        """
+
+        if max_batch_size is None:
+            max_batch_size = detector.max_batch_size
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = BatchingStats()
+        self._executor = executor
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._in_flight = []
+
+    async def detect(self, image: np.ndarray, detection_threshold: float = 0.5
+                     ) -> detection_models.results.DetectionResults:
+        """Queues an image for batched detection and waits for its results
+
+        Args:
+            image (np.ndarray): an image loaded into memory as a numpy array in
+                the RGB colorspace (height, width, 3)
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+
+        Returns:
+            detection_models.results.DetectionResults: the set of prediction
+                results for the image
+        """
+
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        future = loop.create_future()
+        self._queue.put_nowait((image, detection_threshold, future,
+                                time.perf_counter()))
+        self.stats.requests += 1
+        self.stats.queue_depth = self._queue.qsize()
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth,
+                                         self.stats.queue_depth)
+        return await future
+
+    async def close(self) -> None:
+        """Stops the background batching task
+
+        Requests that are still queued, or whose batch is running, fail with
+        a `RuntimeError`.
+        """
+
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            pending = list(self._in_flight)
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            for _, _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError("the batch scheduler was closed"))
+        self._loop = self._queue = self._worker = None
+        self._in_flight = []
+
+    def _ensure_worker(self, loop: asyncio.AbstractEventLoop) -> None:
+        # the queue and worker task are bound to the loop they were created
+        # in, so they are recreated if the scheduler is used from a new loop
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._process_queue())
+
+    async def _process_queue(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._in_flight = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.stats.queue_depth = self._queue.qsize()
+            await self._run_batch(loop, batch)
+            # release the images (which may be views of shared memory) while
+            # waiting for the next request
+            self._in_flight = []
+            del batch
+
+    async def _run_batch(self, loop: asyncio.AbstractEventLoop,
+                         batch: list) -> None:
+        start = time.perf_counter()
+        self.stats.batches += 1
+        self.stats.batch_sizes[len(batch)] += 1
+        self.stats.total_queue_time += sum(
+            start - enqueued for _, _, _, enqueued in batch)
+
+        # detect_batch takes a single threshold, so requests with different
+        # thresholds are run as separate groups
+        groups = OrderedDict()
+        for image, detection_threshold, future, _ in batch:
+            groups.setdefault(detection_threshold, []).append((image, future))
+
+        for detection_threshold, requests in groups.items():
+            images = [image for image, _ in requests]
+            try:
+                batch_results = await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(
+                        self.detector.detect_batch,
+                        images,
+                        detection_threshold,
+                        max_batch_size=len(images)))
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), results in zip(requests, batch_results):
+                if not future.done():
+                    future.set_result(results)
+
+        self.stats.total_inference_time += time.perf_counter() - start
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""A compact, append-only, columnar on-disk format for detection results
+
+A results store is a directory holding one raw binary file per column of
+detections (boxes, scores, class IDs, and the index of the result each
+detection belongs to), a JSON-lines file with one record per result (its key,
+e.g. the image's path, and the image size), and a JSON file with the label
+table. Columns are appended to as results are written and memory-mapped when
+read, so stores of tens of millions of detections can be reloaded and
+filtered without parsing or copying them.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Iterator, Sequence, Tuple
+
+import numpy as np
+
+import detection_models.ops
+import detection_models.results
+
+# bumped whenever the layout of a results store changes
+FORMAT_VERSION = 1
+
+META_FILE = "meta.json"
+RECORDS_FILE = "results.jsonl"
+
+# the number of records a writer buffers before making them durable
+RECORD_BUFFER_SIZE = 1024
+
+# column name -> (file name, dtype, shape of one row)
+COLUMNS = {
+    "result_indices": ("result_indices.i64", np.int64, ()),
+    "boxes": ("boxes.f32", np.float32, (4, )),
+    "scores": ("scores.f32", np.float32, ()),
+    "class_ids": ("class_ids.i32", np.int32, ()),
+}
+
+
+class ResultsWriter:
+    """Appends detection results to a results store as they are produced
+
+    Opening an existing store appends to it. Records are buffered in memory
+    and only written once the detections of their results (and the label
+    table) have been flushed and fsynced, on `flush`, on `close`, and every
+    `RECORD_BUFFER_SIZE` results. A record therefore never refers to
+    detections that did not reach the disk, and a store whose writer was
+    interrupted can still be read: detections without a record are ignored.
+
+    Only bounding boxes are stored; the masks of `MaskDetectionResults` are
+    not.
+
+    Attributes:
+        path (pathlib.Path): the directory of the store
+        labels (list): the labels of the store, indexed by stored class ID
+        num_results (int): the number of results in the store
+    """
+
+    def __init__(self, path: Path):
+        """Opens (or creates) a results store for appending
+
+        Args:
+            path (pathlib.Path): the directory of the store
+        """
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = _read_meta(self.path)
+        self.labels = meta["labels"] if meta is not None else []
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+
+        # drop a partially written record and the detections left behind by
+        # an interrupted writer
+        records_path = self.path / RECORDS_FILE
+        records = _read_records(records_path)
+        with open(str(records_path), "ab") as f:
+            f.truncate(sum(len(record) for record in records))
+        self.num_results = len(records)
+        num_detections = _num_complete_detections(self.path, self.num_results)
+        self._columns = {}
+        for name, (file_name, dtype, row_shape) in COLUMNS.items():
+            column_path = self.path / file_name
+            row_size = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+            with open(str(column_path), "ab") as f:
+                f.truncate(num_detections * row_size)
+            self._columns[name] = open(str(column_path), "ab")
+        self._records = open(str(records_path), "a")
+        self._pending_records = []
+        self._flush_meta()
+
+    def _class_ids(self, results) -> np.ndarray:
+        """Maps the class IDs of results to the store's label table"""
+        result_ids, inverse = np.unique(results.class_ids,
+                                        return_inverse=True)
+        store_ids = np.empty(len(result_ids), dtype=np.int32)
+        for i, label in enumerate(
+                detection_models.results.lookup_labels(
+                    results.label_table, result_ids)):
+            store_id = self._label_ids.get(label)
+            if store_id is None:
+                store_id = len(self.labels)
+                self.labels.append(label)
+                self._label_ids[label] = store_id
+            store_ids[i] = store_id
+        return store_ids[inverse.reshape(-1)]
+
+    def write(self,
+              results: detection_models.results.DetectionResults,
+              key: str = None,
+              image_size: Tuple[int, int] = None) -> int:
+        """Appends one image's results to the store
+
+        Args:
+            results (detection_models.results.DetectionResults): the results
+                to append; converted to `ColumnarDetectionResults` if
+                necessary
+            key (str, optional): Defaults to None. An identifier for the image
+                (e.g. its path), stored with the results
+            image_size (tuple, optional): Defaults to None. The (height, width)
+                of the image, used to denormalize the boxes when reading
+
+        Returns:
+            int: the index of the result within the store
+
+        Raises:
+            TypeError: if `results` is not a `DetectionResults` of bounding
+                boxes
+        """
+
+        if not isinstance(results,
+                          detection_models.results.ColumnarDetectionResults):
+            if not isinstance(results,
+                              detection_models.results.DetectionResults):
+                raise TypeError("expected DetectionResults, not {}".format(
+                    type(results).__name__))
+            results = (detection_models.results.ColumnarDetectionResults.
+                       from_detection_results(results))
+
+        count = len(results.scores)
+        columns = {
+            "result_indices": np.full(count, self.num_results,
+                                      dtype=np.int64),
+            "boxes": results.boxes,
+            "scores": results.scores,
+            "class_ids": self._class_ids(results),
+        }
+        for name, (_, dtype, _) in COLUMNS.items():
+            self._columns[name].write(
+                np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        height, width = (None, None) if image_size is None else image_size
+        self._pending_records.append(
+            json.dumps({
+                "key": key,
+                "height": height,
+                "width": width
+            }) + "\n")
+        self.num_results += 1
+        if len(self._pending_records) >= RECORD_BUFFER_SIZE:
+            self.flush()
+        return self.num_results - 1
+
+    def _flush_meta(self) -> None:
+        temp_path = self.path / "{}.{}.tmp".format(META_FILE, os.getpid())
+        with open(str(temp_path), "w") as f:
+            json.dump({"version": FORMAT_VERSION, "labels": self.labels}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(temp_path), str(self.path / META_FILE))
+
+    def flush(self) -> None:
+        """Writes all buffered results (and the label table) to disk
+
+        The columns and the label table are fsynced before the records that
+        refer to them are written.
+        """
+
+        for column in self._columns.values():
+            column.flush()
+            os.fsync(column.fileno())
+        self._flush_meta()
+        self._records.writelines(self._pending_records)
+        self._pending_records = []
+        self._records.flush()
+        os.fsync(self._records.fileno())
+
+    def close(self) -> None:
+        """Flushes and closes the store"""
+        if self._records.closed:
+            return
+        self.flush()
+        for column in self._columns.values():
+            column.close()
+        self._records.close()
+
+    def __enter__(self) -> "ResultsWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ResultsReader:
+    """Reads a results store through memory-mapped columns
+
+    The columns are memory-mapped, so opening a store is cheap and filtering
+    by label or score only touches the columns involved.
+
+    Attributes:
+        path (pathlib.Path): the directory of the store
+        labels (np.ndarray): an object array mapping stored class IDs (as
+            indices) to labels
+        records (list): the record of each result: a dict with its "key",
+            "height", and "width"
+        result_indices (np.ndarray): the index of the result each detection
+            belongs to (N,); non-decreasing
+        boxes (np.ndarray): the normalized [ymin, xmin, ymax, xmax] box of
+            each detection (N, 4)
+        scores (np.ndarray): the score of each detection (N,)
+        class_ids (np.ndarray): the stored class ID of each detection (N,)
+    """
+
+    def __init__(self, path: Path):
+        """Opens a results store
+
+        Args:
+            path (pathlib.Path): the directory of the store
+        """
+
+        self.path = Path(path)
+        meta = _read_meta(self.path)
+        if meta is None:
+            raise ValueError("{} is not a results store".format(self.path))
+        self.labels = np.array(meta["labels"], dtype=object)
+        self.records = [
+            json.loads(record.decode("utf-8"))
+            for record in _read_records(self.path / RECORDS_FILE)
+        ]
+
+        num_detections = _num_complete_detections(
+            self.path, len(self.records))
+        for name, (file_name, dtype, row_shape) in COLUMNS.items():
+            setattr(self, name,
+                    _map_column(self.path / file_name, dtype, row_shape,
+                                num_detections))
+        self._starts = np.searchsorted(self.result_indices,
+                                       np.arange(len(self.records) + 1))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index: int
+                    ) -> detection_models.results.ColumnarDetectionResults:
+        """Returns the results at `index` as `ColumnarDetectionResults`"""
+        if not -len(self) <= index < len(self):
+            raise IndexError("result index out of range")
+        index %= len(self)
+        rows = slice(self._starts[index], self._starts[index + 1])
+        return detection_models.results.ColumnarDetectionResults(
+            boxes=self.boxes[rows],
+            scores=self.scores[rows],
+            class_ids=self.class_ids[rows],
+            label_table=self.labels)
+
+    def __iter__(self) -> Iterator[Tuple[dict, detection_models.results.
+                                         ColumnarDetectionResults]]:
+        """Yields each result's record and results, in the order written"""
+        for index, record in enumerate(self.records):
+            yield record, self[index]
+
+    def select(self, labels: Sequence[str] = None,
+               min_score: float = None) -> np.ndarray:
+        """Finds the detections with the given labels and minimum score
+
+        Args:
+            labels (Sequence[str], optional): Defaults to None. The labels to
+                keep; all labels are kept if None
+            min_score (float, optional): Defaults to None. The minimum score
+                to keep; all scores are kept if None
+
+        Returns:
+            np.ndarray: the (ascending) indices of the matching detections;
+                index `result_indices`, `boxes`, etc. with it
+        """
+
+        keep = np.ones(len(self.scores), dtype=bool)
+        if labels is not None:
+            wanted = np.isin(self.labels, list(labels))
+            keep &= wanted[self.class_ids]
+        if min_score is not None:
+            keep &= self.scores >= min_score
+        return np.flatnonzero(keep)
+
+    def denormalize(self, rows: np.ndarray = None) -> np.ndarray:
+        """Converts the boxes of detections into pixel coordinates
+
+        Uses the image size stored with each detection's result.
+
+        Args:
+            rows (np.ndarray, optional): Defaults to all detections. The
+                indices of the detections to convert, e.g. from `select`
+
+        Returns:
+            np.ndarray: [ymin, xmin, ymax, xmax] pixel boxes (N, 4), int64
+
+        Raises:
+            ValueError: if a result was written without an image size
+        """
+
+        if rows is None:
+            rows = slice(None)
+        sizes = np.array(
+            [(record["height"], record["width"]) for record in self.records],
+            dtype=float).reshape(-1, 2)
+        sizes = sizes[self.result_indices[rows]]
+        if np.isnan(sizes).any():
+            raise ValueError(
+                "cannot denormalize results written without an image size")
+        return detection_models.ops.denormalize_boxes(
+            self.boxes[rows], sizes[:, 0], sizes[:, 1])
+
+
+def _read_meta(path: Path) -> dict:
+    try:
+        with open(str(path / META_FILE), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError("{} has an unsupported results store version".format(
+            path))
+    return meta
+
+
+def _read_records(path: Path) -> list:
+    """Reads the complete (newline-terminated) lines of the records file"""
+    try:
+        with open(str(path), "rb") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    if lines and not lines[-1].endswith(b"\n"):
+        lines.pop()
+    return lines
+
+
+def _map_column(path: Path, dtype, row_shape: tuple,
+                num_rows: int) -> np.ndarray:
+    """Memory-maps the first `num_rows` rows of a column file"""
+    if num_rows == 0:
+        return np.zeros((0, ) + row_shape, dtype=dtype)
+    return np.memmap(str(path), dtype=dtype, mode="r",
+                     shape=(num_rows, ) + row_shape)
+
+
+def _num_complete_detections(path: Path, num_results: int) -> int:
+    """Counts the detections that belong to results with a record"""
+    num_rows = []
+    for file_name, dtype, row_shape in COLUMNS.values():
+        column_path = path / file_name
+        row_size = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+        size = column_path.stat().st_size if column_path.exists() else 0
+        num_rows.append(size // row_size)
+    num_detections = min(num_rows)
+    result_indices = _map_column(path / COLUMNS["result_indices"][0],
+                                 np.int64, (), num_detections)
+    return int(np.searchsorted(result_indices, num_results))
@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""A local detection server, and a client for it
+
+A `DetectionServer` hosts one or more detectors behind a Unix domain socket,
+so that every process on a host can share one loaded copy of each model.
+Requests from all connected clients are grouped into batches by a
+`detection_models.scheduler.MicroBatchScheduler` per detector, which the
+server owns.
+
+Images are passed through POSIX shared memory: the client copies its images
+into a shared memory block and sends only the block's name and the layout of
+the images, and the server runs the model on views of the block. Encoded
+images (for detectors with `encoded_input`) are sent inline. Messages are a
+JSON header followed by a binary payload, so no pickled data is exchanged.
+"""
+
+import asyncio
+import itertools
+import json
+import socket
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+import detection_models.pool
+import detection_models.results
+import detection_models.scheduler
+
+# each message is framed by the lengths of its JSON header and its payload
+_FRAME = struct.Struct("!II")
+MAX_HEADER_SIZE = 1 << 24
+# the payload is read into memory in full, so its size is bounded too
+MAX_PAYLOAD_SIZE = 1 << 28
+
+
+def _encode_message(header: dict, payload: bytes = b"") -> bytes:
+    header = json.dumps(header).encode("utf-8")
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ValueError("message payload too large")
+    return _FRAME.pack(len(header), len(payload)) + header + payload
+
+
+def _decode_header(frame: bytes) -> Tuple[int, int]:
+    header_size, payload_size = _FRAME.unpack(frame)
+    if header_size > MAX_HEADER_SIZE:
+        raise ValueError("message header too large")
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise ValueError("message payload too large")
+    return header_size, payload_size
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Tuple[dict, bytes]:
+    """Reads one message, or returns (None, None) at the end of the stream
+
+    Raises:
+        asyncio.IncompleteReadError: if the stream ends within a message
+        ValueError: if the message is too large or its header is not JSON
+    """
+    try:
+        frame = await reader.readexactly(_FRAME.size)
+    except asyncio.IncompleteReadError:
+        return None, None
+    header_size, payload_size = _decode_header(frame)
+    header = await reader.readexactly(header_size)
+    header = json.loads(header.decode("utf-8"))
+    payload = await reader.readexactly(payload_size)
+    return header, payload
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("the detection server closed the connection")
+        received += count
+    return buffer
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Opens a block created by another process without taking ownership"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13, attaching registers the block with this
+        # process's resource tracker, which would unlink it at exit
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def _encode_results(all_results: Sequence[
+        detection_models.results.ColumnarDetectionResults]
+                    ) -> Tuple[List[dict], bytes]:
+    """Packs results into per-result headers and a binary payload"""
+    headers = []
+    chunks = []
+    for results in all_results:
+        header = {"count": len(results.scores)}
+        chunks += [
+            np.ascontiguousarray(results.boxes, dtype=np.float32).tobytes(),
+            np.ascontiguousarray(results.scores, dtype=np.float32).tobytes(),
+            np.ascontiguousarray(results.class_ids, dtype=np.int64).tobytes()
+        ]
+        if isinstance(results, detection_models.results.MaskDetectionResults):
+            header["image_size"] = list(results.image_size)
+            header["mask_lengths"] = [len(rle) for rle in results.mask_rles]
+            chunks += [
+                np.asarray(rle, dtype=np.uint32).tobytes()
+                for rle in results.mask_rles
+            ]
+        headers.append(header)
+    return headers, b"".join(chunks)
+
+
+def _decode_results(headers: Sequence[dict], payload: bytes,
+                    label_table: np.ndarray
+                    ) -> List[detection_models.results.DetectionResults]:
+    """Unpacks the results packed by `_encode_results`"""
+    offset = 0
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(payload, dtype=dtype, count=count,
+                              offset=offset)
+        offset += array.nbytes
+        return array
+
+    all_results = []
+    for header in headers:
+        count = header["count"]
+        boxes = take(np.float32, count * 4).reshape(count, 4)
+        scores = take(np.float32, count)
+        class_ids = take(np.int64, count)
+        if "mask_lengths" in header:
+            mask_rles = [
+                take(np.uint32, length) for length in header["mask_lengths"]
+            ]
+            all_results.append(
+                detection_models.results.MaskDetectionResults(
+                    boxes, scores, class_ids, label_table, mask_rles,
+                    header["image_size"]))
+        else:
+            all_results.append(
+                detection_models.results.ColumnarDetectionResults(
+                    boxes, scores, class_ids, label_table))
+    return all_results
+
+
+class DetectionServer:
+    """Serves detectors to local clients over a Unix domain socket
+
+    Each client request names a hosted detector and carries one or more
+    images; each image is submitted to a `MicroBatchScheduler` the server
+    creates for the detector, so images from concurrent requests (and
+    clients) are run together in batches. The detectors themselves are not
+    modified; in particular, their own `batch_scheduler`s are left alone. A
+    connection may have several requests in flight.
+
+    Any process that can connect to the socket can use the detectors, so
+    restrict access to it with the permissions of its directory.
+
+    Attributes:
+        detectors (dict): the hosted `detection_models.ObjectDetector`s,
+            keyed by the name clients request them by
+        socket_path (pathlib.Path): the path of the Unix domain socket
+    """
+
+    def __init__(self,
+                 detectors: Mapping[str, object],
+                 socket_path: Path,
+                 max_delay: float = 0.005,
+                 max_batch_size: int = None):
+        """Creates a server (without starting it)
+
+        Args:
+            detectors (Mapping[str, detection_models.ObjectDetector]): the
+                detectors to host, keyed by name
+            socket_path (pathlib.Path): the path of the Unix domain socket
+            max_delay (float, optional): Defaults to 0.005. The maximum time
+                (in seconds) to wait for more requests before running a batch
+            max_batch_size (int, optional): Defaults to each detector's
+                `max_batch_size`. The maximum number of images per batch
+        """
+
+        if not detectors:
+            raise ValueError("a DetectionServer needs at least one detector")
+        self.detectors = dict(detectors)
+        self.socket_path = Path(socket_path)
+        self._schedulers = {
+            name: detection_models.scheduler.MicroBatchScheduler(
+                detector, max_batch_size=max_batch_size, max_delay=max_delay)
+            for name, detector in self.detectors.items()
+        }
+        self._server = None
+        self._open_blocks = []
+
+    async def start(self) -> None:
+        """Starts listening on `socket_path`, replacing a stale socket"""
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, path=str(self.socket_path))
+
+    async def close(self) -> None:
+        """Stops listening and removes the socket"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for scheduler in self._schedulers.values():
+            await scheduler.close()
+        for block in self._open_blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass
+        self._open_blocks = []
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+
+    async def serve(self) -> None:
+        """Starts the server and serves clients until cancelled"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.close()
+
+    def serve_forever(self) -> None:
+        """Serves clients in a new event loop until interrupted"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def _release_block(self, block: shared_memory.SharedMemory) -> None:
+        """Closes a client's block, deferring it while views of it remain"""
+        self._open_blocks.append(block)
+        still_open = []
+        for block in self._open_blocks:
+            try:
+                block.close()
+            except BufferError:
+                still_open.append(block)
+        self._open_blocks = still_open
+
+    def _models(self) -> dict:
+        return {
+            name: {
+                "type": type(detector).__name__,
+                "labels": list(detector.label_table),
+                "encoded_input": detector.encoded_input
+            }
+            for name, detector in self.detectors.items()
+        }
+
+    async def _detect(self, header: dict,
+                      payload: bytes) -> Tuple[dict, bytes]:
+        name = header.get("model")
+        if name is None and len(self.detectors) == 1:
+            name = next(iter(self.detectors))
+        scheduler = self._schedulers.get(name)
+        if scheduler is None:
+            raise ValueError("unknown model {!r}".format(name))
+
+        block = None
+        if header.get("shm") is not None:
+            block = _attach_shared_memory(header["shm"])
+        try:
+            buffer = payload if block is None else block.buf
+            images = []
+            for image in header["images"]:
+                if "shape" in image:
+                    images.append(
+                        np.ndarray(image["shape"], dtype=np.uint8,
+                                   buffer=buffer, offset=image["offset"]))
+                else:
+                    images.append(
+                        bytes(buffer[image["offset"]:image["offset"] +
+                                     image["size"]]))
+            all_results = await asyncio.gather(*[
+                scheduler.detect(image, header.get("threshold", 0.5))
+                for image in images
+            ])
+            del images
+        finally:
+            if block is not None:
+                self._release_block(block)
+
+        result_headers, result_payload = _encode_results(all_results)
+        return {"results": result_headers}, result_payload
+
+    async def _respond(self, header: dict, payload: bytes,
+                       writer: asyncio.StreamWriter,
+                       lock: asyncio.Lock) -> None:
+        response, response_payload = {}, b""
+        try:
+            operation = header.get("op")
+            if operation == "detect":
+                response, response_payload = await self._detect(
+                    header, payload)
+            elif operation == "models":
+                response = {"models": self._models()}
+            elif operation == "stats":
+                response = {
+                    "stats": {
+                        name: scheduler.stats.as_dict()
+                        for name, scheduler in self._schedulers.items()
+                    }
+                }
+            else:
+                raise ValueError("unknown operation {!r}".format(operation))
+        except Exception as e:
+            response = {"error": "{}: {}".format(type(e).__name__, e)}
+        response["id"] = header.get("id")
+        async with lock:
+            writer.write(_encode_message(response, response_payload))
+            await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header, payload = await _read_message(reader)
+                if header is None:
+                    break
+                task = asyncio.ensure_future(
+                    self._respond(header, payload, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, EOFError, ValueError):
+            # a client that disconnects mid-message (IncompleteReadError is
+            # an EOFError) or sends a malformed one is dropped
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+class DetectionClient:
+    """A client of a `DetectionServer`
+
+    The client mirrors the `detect`/`detect_batch` API of `ObjectDetector`.
+    Decoded images are passed to the server through a shared memory block
+    owned by the client, which is reused (and grown as needed) across
+    requests; encoded images are sent inline. A client may be shared by
+    several threads, but its requests are then made one at a time; use one
+    client per thread to have the server batch them together.
+
+    The client can be used as a context manager, which calls `close` on exit.
+
+    Attributes:
+        socket_path (pathlib.Path): the path of the server's socket
+        models (dict): the hosted models, keyed by name; each value is a
+            dict with the detector's "type", "labels" (indexed by class ID),
+            and whether it takes "encoded_input"
+    """
+
+    def __init__(self, socket_path: Path, use_shared_memory: bool = True):
+        """Connects to a server
+
+        Args:
+            socket_path (pathlib.Path): the path of the server's socket
+            use_shared_memory (bool, optional): Defaults to True. Whether to
+                pass decoded images through shared memory; they are sent
+                inline otherwise
+        """
+
+        self.socket_path = Path(socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(str(self.socket_path))
+        self._use_shared_memory = use_shared_memory
+        self._block = None
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._label_tables = {}
+        self.models = self._request({"op": "models"})[0]["models"]
+
+    def _request(self, header: dict, payload: bytes = b""
+                 ) -> Tuple[dict, bytearray]:
+        header = dict(header, id=next(self._request_ids))
+        self._socket.sendall(_encode_message(header, payload))
+        response_frame = _receive_exactly(self._socket, _FRAME.size)
+        header_size, payload_size = _decode_header(response_frame)
+        response = json.loads(
+            _receive_exactly(self._socket, header_size).decode("utf-8"))
+        response_payload = _receive_exactly(self._socket, payload_size)
+        if "error" in response:
+            raise RuntimeError("the detection server failed: {}".format(
+                response["error"]))
+        return response, response_payload
+
+    def _label_table(self, name: str) -> np.ndarray:
+        label_table = self._label_tables.get(name)
+        if label_table is None:
+            label_table = self._label_tables[name] = np.array(
+                self.models[name]["labels"], dtype=object)
+        return label_table
+
+    def detect(self,
+               image: np.ndarray,
+               detection_threshold: float = 0.5,
+               model: str = None) -> detection_models.results.DetectionResults:
+        """Performs object detection on a given image on the server
+
+        Args:
+            image (np.ndarray): an image loaded into memory as a numpy array in
+                the RGB colorspace (height, width, 3); or, if the model has
+                `encoded_input`, the bytes of an encoded image
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            model (str, optional): Defaults to the only hosted model. The
+                name of the model to use
+
+        Returns:
+            detection_models.results.DetectionResults: the set of prediction
+                results for a given image
+        """
+
+        return self.detect_batch([image], detection_threshold, model)[0]
+
+    def detect_batch(self,
+                     images: Sequence[np.ndarray],
+                     detection_threshold: float = 0.5,
+                     model: str = None
+                     ) -> List[detection_models.results.DetectionResults]:
+        """Performs object detection on many images on the server
+
+        Args:
+            images (Sequence[np.ndarray]): images loaded into memory as numpy
+                arrays in the RGB colorspace (height, width, 3); or, if the
+                model has `encoded_input`, the bytes of encoded images
+            detection_threshold (float, optional): Defaults to 0.5. A threshold
+                with which to discard detected objects that have a low
+                detection score
+            model (str, optional): Defaults to the only hosted model. The
+                name of the model to use
+
+        Returns:
+            list: one `detection_models.results.DetectionResults` per image,
+                in the same order as `images`
+
+        Raises:
+            ValueError: if the model takes decoded images and an image is not
+                a uint8 array
+        """
+
+        if model is None:
+            if len(self.models) != 1:
+                raise ValueError("the server hosts several models; choose "
+                                 "one of {}".format(sorted(self.models)))
+            model = next(iter(self.models))
+        if model not in self.models:
+            raise ValueError("the server does not host {!r}".format(model))
+
+        header = {
+            "op": "detect",
+            "model": model,
+            "threshold": float(detection_threshold),
+            "shm": None
+        }
+        encoded = self.models[model]["encoded_input"]
+        if not encoded:
+            for image in images:
+                if (not isinstance(image, np.ndarray)
+                        or image.dtype != np.uint8):
+                    raise ValueError(
+                        "images must be uint8 arrays, not {}".format(
+                            getattr(image, "dtype", type(image).__name__)))
+            images = [np.ascontiguousarray(image) for image in images]
+
+        with self._lock:
+            if encoded or not self._use_shared_memory:
+                chunks, header["images"], offset = [], [], 0
+                for image in images:
+                    chunk = image.tobytes() if not encoded else bytes(image)
+                    header["images"].append(
+                        {"offset": offset, "size": len(chunk)} if encoded
+                        else {"offset": offset, "shape": image.shape})
+                    chunks.append(chunk)
+                    offset += len(chunk)
+                payload = b"".join(chunks)
+            else:
+                block, layout = (
+                    detection_models.pool.write_images_to_shared_memory(
+                        images, self._block))
+                if block is not self._block:
+                    self._release_block()
+                    self._block = block
+                header["shm"] = block.name
+                header["images"] = [{
+                    "shape": shape,
+                    "offset": offset
+                } for shape, offset in layout]
+                payload = b""
+            response, response_payload = self._request(header, payload)
+
+        return _decode_results(response["results"], bytes(response_payload),
+                               self._label_table(model))
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns the batching statistics of each hosted model
+
+        Returns:
+            dict: the `BatchingStats.as_dict()` of each model's scheduler,
+                keyed by model name
+        """
+
+        with self._lock:
+            return self._request({"op": "stats"})[0]["stats"]
+
+    def _release_block(self) -> None:
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def close(self) -> None:
+        """Disconnects from the server and frees the shared memory block"""
+        with self._lock:
+            self._socket.close()
+            self._release_block()
+
+    def __enter__(self) -> "DetectionClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,24 +1,95 @@
 # -*- coding: utf-8 -*-
 
+import importlib
+import io
+import mmap
 from pathlib import Path
+from types import ModuleType
+from typing import Tuple, Union
 
 import numpy as np
 
 from PIL import Image
 
+ImageSource = Union[Path, str, bytes, bytearray, memoryview, mmap.mmap]
+
+
+def import_object_detection(module_name: str) -> ModuleType:
+    """Imports a module of the TensorFlow Object Detection API on demand
+
+    The Object Detection API (and the TensorFlow and matplotlib imports it
+    brings with it) is slow to import, so `detection_models` only imports it
+    when it is actually needed.
+
+    Args:
+        module_name (str): the module to import, relative to the
+            `object_detection` package (e.g. "utils.label_map_util")
+
+    Returns:
+        types.ModuleType: the imported module
+
+    Raises:
+        ImportError: if the Object Detection API is not installed
+    """
+
+    try:
+        return importlib.import_module("object_detection." + module_name)
+    except ModuleNotFoundError as e:
+        if e.name is None or not e.name.startswith("object_detection"):
+            raise
+        raise ImportError(
+            "You must have the TensorFlow Object Detection API installed to "
+            "use detection_models. Follow the instructions at: "
+            "https://github.com/tensorflow/models/blob/master/research/"
+            "object_detection/g3doc/installation.md"
+        ) from e
+
+
+def load_image(source: ImageSource,
+               target_size: Tuple[int, int] = None) -> np.ndarray:
+    """Decodes an image into a uint8 RGB numpy array
+
+    The image is decoded by PIL and copied once into a contiguous uint8 array
+    through the array interface; grayscale, palette, and RGBA images are
+    converted to RGB.
+
+    Args:
+        source (ImageSource): the encoded image; either a filepath (as a
+            `pathlib.Path` or `str`), the raw encoded bytes (as `bytes`,
+            `bytearray`, or `memoryview`), or an `mmap.mmap` of an image file,
+            which is read in place without copying it into memory first
+        target_size (tuple, optional): Defaults to None. The (height, width)
+            the image will be used at, if known. JPEG images are then decoded
+            in draft mode at the smallest DCT scale (1/2, 1/4, or 1/8) that is
+            still at least this large, which is considerably faster than a
+            full-size decode. Other formats ignore this argument.
+
+    Returns:
+        np.ndarray: an image loaded into memory as a numpy array in the RGB
+            colorspace (height, width, 3)
+    """
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as image:
+        if target_size is not None:
+            target_height, target_width = target_size
+            image.draft("RGB", (target_width, target_height))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.array(image, dtype=np.uint8)
+
 
 def load_image_as_array(image_path: Path) -> np.ndarray:
     """Loads an image into memory as a numpy array
-    
+
     Args:
         image_path (pathlib.Path): the filepath at which the image is stored
-    
+
     Returns:
         np.ndarray: an image loaded into memory as a numpy array in the RGB
             colorspace (height, width, 3)
     """
 
-    image = Image.open(image_path)
-    (im_width, im_height) = image.size
-    return np.array(image.getdata()).reshape((im_height, im_width, 3)).astype(
-        np.uint8)
\ No newline at end of file
+    return load_image(image_path)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import detection_models.ops
+import detection_models.results
+
+VideoFrameResult = namedtuple("VideoFrameResult",
+                              ["index", "image", "results", "inferred"])
+VideoFrameResult.__doc__ = """The detection results for one frame of a video
+
+Attributes:
+    index (int): the index of the frame within the video
+    image (np.ndarray): the frame in the RGB colorspace (height, width, 3)
+    results (detection_models.results.ColumnarDetectionResults): the
+        detections for the frame
+    inferred (bool): True if the model was run on the frame (a keyframe),
+        False if its detections were interpolated from the surrounding
+        keyframes
+"""
+
+
+def iter_video_frames(video_path: Path) -> Iterator[np.ndarray]:
+    """Decodes the frames of a video file one at a time
+
+    imageio is used if it is installed, otherwise OpenCV.
+
+    Args:
+        video_path (pathlib.Path): the video file to read
+
+    Yields:
+        np.ndarray: each frame in the RGB colorspace (height, width, 3)
+
+    Raises:
+        ImportError: if neither imageio nor OpenCV is installed
+    """
+
+    try:
+        import imageio
+    except ImportError:
+        imageio = None
+
+    if imageio is not None:
+        reader = imageio.get_reader(str(video_path))
+        try:
+            for frame in reader:
+                yield np.asarray(frame)[..., :3]
+        finally:
+            reader.close()
+        return
+
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError(
+            "Reading videos requires either imageio (with an ffmpeg plugin) "
+            "or OpenCV to be installed")
+
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+
+
+def _thumbnail(image: np.ndarray, size: int = 32) -> np.ndarray:
+    """Downsamples an image to a small grayscale thumbnail by striding"""
+    height, width = image.shape[:2]
+    rows = np.linspace(0, height - 1, size).astype(np.int64)
+    columns = np.linspace(0, width - 1, size).astype(np.int64)
+    return image[rows][:, columns].mean(axis=2, dtype=np.float32)
+
+
+def _interpolate(start: detection_models.results.ColumnarDetectionResults,
+                 end: detection_models.results.ColumnarDetectionResults,
+                 fraction: float, min_iou: float
+                 ) -> detection_models.results.ColumnarDetectionResults:
+    """Interpolates detections between two keyframes
+
+    Detections of the same class in both keyframes are associated by IoU;
+    associated boxes and scores are linearly interpolated. Detections only
+    present in `start` are kept for the first half of the gap, and detections
+    only present in `end` appear for the second half.
+    """
+
+    iou = detection_models.ops.iou_matrix(start.boxes, end.boxes)
+    iou[start.class_ids[:, None] != end.class_ids[None, :]] = 0.0
+    matches = detection_models.ops.greedy_match(iou, min_iou)
+    start_rows, end_rows = matches[:, 0], matches[:, 1]
+
+    boxes = [(1 - fraction) * start.boxes[start_rows] +
+             fraction * end.boxes[end_rows]]
+    scores = [(1 - fraction) * start.scores[start_rows] +
+              fraction * end.scores[end_rows]]
+    class_ids = [start.class_ids[start_rows]]
+
+    if fraction < 0.5:
+        unmatched = np.setdiff1d(np.arange(len(start.scores)), start_rows)
+        source = start
+    else:
+        unmatched = np.setdiff1d(np.arange(len(end.scores)), end_rows)
+        source = end
+    boxes.append(source.boxes[unmatched])
+    scores.append(source.scores[unmatched])
+    class_ids.append(source.class_ids[unmatched])
+
+    return detection_models.results.ColumnarDetectionResults(
+        boxes=np.concatenate(boxes),
+        scores=np.concatenate(scores),
+        class_ids=np.concatenate(class_ids),
+        label_table=start.label_table)
+
+
+def detect_video(detector,
+                 frames: Iterable[np.ndarray],
+                 detection_threshold: float = 0.5,
+                 keyframe_interval: int = 10,
+                 scene_change_threshold: float = None,
+                 min_iou: float = 0.3) -> Iterator[VideoFrameResult]:
+    """Detects objects in a video by running the model on keyframes only
+
+    The model is run on every `keyframe_interval`-th frame, on the last
+    frame, and (if `scene_change_threshold` is set) on any frame that differs
+    too much from the previous keyframe. The detections of the frames in
+    between are interpolated from the surrounding keyframes by associating
+    boxes with IoU matching, which is accurate for slowly changing scenes
+    such as static camera feeds at a fraction of the inference cost.
+
+    Frames between keyframes are buffered until the next keyframe has been
+    processed, so at most `keyframe_interval` frames are held in memory.
+
+    Args:
+        detector (detection_models.BBoxDetector): the detector to run on
+            keyframes; must return `ColumnarDetectionResults`
+        frames (Iterable[np.ndarray]): the frames of the video in the RGB
+            colorspace (height, width, 3), e.g. from `iter_video_frames`
+        detection_threshold (float, optional): Defaults to 0.5. A threshold
+            with which to discard detected objects that have a low detection
+            score
+        keyframe_interval (int, optional): Defaults to 10. The maximum number
+            of frames between keyframes; 1 runs the model on every frame
+        scene_change_threshold (float, optional): Defaults to None. If set, a
+            frame whose mean absolute grayscale difference (0-255) from the
+            previous keyframe exceeds this value becomes a keyframe; the
+            detections of the frames before a scene change are held rather
+            than interpolated
+        min_iou (float, optional): Defaults to 0.3. The minimum IoU for
+            associating detections of consecutive keyframes
+
+    Yields:
+        VideoFrameResult: the results for each frame, in order
+    """
+
+    if keyframe_interval < 1:
+        raise ValueError("keyframe_interval must be a positive integer")
+
+    previous_keyframe = None
+    previous_thumbnail = None
+    buffered = []
+
+    def flush(keyframe_results, scene_changed):
+        gap = len(buffered) + 1
+        for offset, (index, image) in enumerate(buffered, 1):
+            if scene_changed:
+                results = _interpolate(previous_keyframe, previous_keyframe,
+                                       0.0, min_iou)
+            else:
+                results = _interpolate(previous_keyframe, keyframe_results,
+                                       offset / gap, min_iou)
+            yield VideoFrameResult(index, image, results, False)
+        del buffered[:]
+
+    frames = iter(frames)
+    next_frame = next(frames, None)
+    index = 0
+    while next_frame is not None:
+        image, next_frame = next_frame, next(frames, None)
+        thumbnail = (_thumbnail(image)
+                     if scene_change_threshold is not None else None)
+
+        scene_changed = (
+            previous_thumbnail is not None and thumbnail is not None
+            and np.abs(thumbnail - previous_thumbnail).mean() >
+            scene_change_threshold)
+        is_keyframe = (previous_keyframe is None or scene_changed
+                       or len(buffered) + 1 >= keyframe_interval
+                       or next_frame is None)
+
+        if is_keyframe:
+            results = detector.detect(image, detection_threshold)
+            if previous_keyframe is not None:
+                for frame_result in flush(results, scene_changed):
+                    yield frame_result
+            yield VideoFrameResult(index, image, results, True)
+            previous_keyframe = results
+            previous_thumbnail = thumbnail
+        else:
+            buffered.append((index, image))
+        index += 1
@@ -36,9 +36,13 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
     ],
+    entry_points={
+        'console_scripts': [
+            'detection-models=detection_models.cli:main',
+        ],
+    },
     description=
     "Data structures for running TensorFlow Object Detection API models",
     install_requires=requirements,
@@ -48,6 +52,7 @@ setup(
     keywords='detection_models',
     name='detection_models',
     packages=find_packages(include=['detection_models']),
+    python_requires='>=3.8',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import synthetic_graph
+
+
+def pytest_collection_modifyitems(config, items):
+    # the benchmarks are slow, so only `make benchmark` (--benchmark-only)
+    # runs them
+    if config.getoption("benchmark_only", default=False):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark-only")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def metadata_cache_home(tmp_path_factory):
+    """Keeps the cached model metadata out of the user's cache directory"""
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("cache"))
+    yield
+    if cache_home is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = cache_home
+
+
+@pytest.fixture(scope="session")
+def synthetic_model_files(tmp_path_factory):
+    """Returns (model_path, label_map_path) of a synthetic model
+
+    The returned function takes the keyword arguments of
+    `synthetic_graph.make_frozen_graph`; each distinct graph is only written
+    once per test session.
+    """
+
+    directory = tmp_path_factory.mktemp("models")
+    label_map_path = synthetic_graph.make_label_map(directory /
+                                                    "labels.pbtxt")
+    graphs = {}
+
+    def get(**kwargs):
+        key = tuple(sorted(kwargs.items()))
+        if key not in graphs:
+            graphs[key] = synthetic_graph.make_frozen_graph(
+                directory / "graph_{}.pb".format(len(graphs)), **kwargs)
+        return graphs[key], label_map_path
+
+    return get
+
+
+@pytest.fixture(scope="session")
+def model_files(synthetic_model_files):
+    """(model_path, label_map_path) of the default synthetic model"""
+    return synthetic_model_files()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Builds small frozen detection graphs for tests and benchmarks
+
+The graphs have the input and output tensors of a TF Object Detection API
+frozen inference graph, so they can be loaded by any `ObjectDetector`
+without downloading a real model.
+"""
+
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import tensorflow as tf
+
+import detection_models.loading
+
+DEFAULT_LABELS = ("person", "kite", "dog")
+
+
+def make_frozen_graph(path: Path,
+                      num_detections: int = 10,
+                      num_classes: int = len(DEFAULT_LABELS),
+                      compute_layers: int = 0,
+                      compute_channels: int = 16) -> Path:
+    """Writes a synthetic frozen detection graph
+
+    The graph outputs `num_detections` fixed boxes with descending scores
+    (from 1.0 down) and classes cycling through 1..`num_classes`, for every
+    image in the batch. `compute_layers` 3x3 convolutions are run over the
+    full-resolution input to give the graph a tunable, image-size dependent
+    compute cost; their result feeds into the scores (negligibly), so they
+    cannot be pruned.
+
+    Args:
+        path (pathlib.Path): the .pb file to write
+        num_detections (int, optional): Defaults to 10. The number of
+            detections per image
+        num_classes (int, optional): Defaults to 3. The number of classes
+        compute_layers (int, optional): Defaults to 0. The number of
+            convolutions run over the input
+        compute_channels (int, optional): Defaults to 16. The number of
+            channels of each convolution
+
+    Returns:
+        pathlib.Path: `path`
+    """
+
+    rng = np.random.RandomState(0)
+    graph = tf.Graph()
+    with graph.as_default():
+        image_tensor = tf.placeholder(
+            tf.uint8, [None, None, None, 3], name="image_tensor")
+        batch_size = tf.shape(image_tensor)[0]
+        features = tf.cast(image_tensor, tf.float32) / 255.0
+        channels = 3
+        for _ in range(compute_layers):
+            kernel = rng.normal(
+                0, 0.1, (3, 3, channels, compute_channels)).astype(np.float32)
+            features = tf.nn.relu(
+                tf.nn.conv2d(features, kernel, [1, 1, 1, 1], "SAME"))
+            channels = compute_channels
+        activation = tf.reduce_mean(features, axis=[1, 2, 3])
+
+        ranks = np.arange(num_detections, dtype=np.float32)
+        offsets = (ranks % 10) / 20.0
+        boxes = np.stack(
+            [offsets, offsets, offsets + 0.3, offsets + 0.4], axis=1)
+        scores = 1.0 - ranks / max(num_detections, 1)
+        classes = ranks % num_classes + 1
+
+        def per_image(array):
+            return tf.tile(
+                tf.expand_dims(tf.constant(array), 0),
+                tf.concat([[batch_size],
+                           tf.ones([array.ndim], tf.int32)], 0))
+
+        tf.identity(per_image(boxes), name="detection_boxes")
+        tf.identity(
+            per_image(scores) +
+            1e-9 * tf.tanh(tf.expand_dims(activation, 1)),
+            name="detection_scores")
+        tf.identity(per_image(classes), name="detection_classes")
+        tf.identity(
+            tf.fill([batch_size], float(num_detections)),
+            name="num_detections")
+
+    path = Path(path)
+    path.write_bytes(graph.as_graph_def().SerializeToString())
+    return path
+
+
+def make_label_map(path: Path,
+                   labels: Sequence[str] = DEFAULT_LABELS) -> Path:
+    """Writes a label map (and its cached label table) for a synthetic graph
+
+    The cached label table is written to the metadata cache (see
+    `detection_models.loading.metadata_cache_dir`), so loading the label map
+    does not require the Object Detection API.
+
+    Args:
+        path (pathlib.Path): the .pbtxt file to write
+        labels (Sequence[str], optional): Defaults to person, kite, and dog.
+            The labels of class IDs 1, 2, ...
+
+    Returns:
+        pathlib.Path: `path`
+    """
+
+    path = Path(path)
+    path.write_text("".join(
+        'item {{\n  name: "/m/{0}"\n  id: {0}\n  display_name: "{1}"\n}}\n'.
+        format(class_id, label)
+        for class_id, label in enumerate(labels, 1)))
+    detection_models.loading._write_metadata(
+        detection_models.loading._metadata_path(
+            path, detection_models.loading.LABEL_TABLE_SUFFIX),
+        detection_models.loading.file_identity(path), {
+            "categories": [[class_id, label]
+                           for class_id, label in enumerate(labels, 1)]
+        })
+    return path
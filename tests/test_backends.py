@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models
+import detection_models.backends
+import detection_models.cli
+
+INPUT_SIZE = (32, 48)
+
+
+@pytest.fixture(scope="module")
+def model_files(synthetic_model_files, tmp_path_factory):
+    model_path, label_map_path = synthetic_model_files(num_detections=6,
+                                                       compute_layers=1)
+    tflite_path = detection_models.backends.convert_to_tflite(
+        model_path,
+        tmp_path_factory.mktemp("tflite") / "graph.tflite", INPUT_SIZE)
+    return model_path, tflite_path, label_map_path
+
+
+def random_images(count, height, width):
+    return list(
+        np.random.RandomState(0).randint(
+            0, 256, (count, height, width, 3), dtype=np.uint8))
+
+
+def assert_same_results(results, expected):
+    np.testing.assert_allclose(results.boxes, expected.boxes, atol=1e-6)
+    np.testing.assert_allclose(results.scores, expected.scores, atol=1e-6)
+    np.testing.assert_array_equal(results.class_ids, expected.class_ids)
+    assert list(results.labels) == list(expected.labels)
+
+
+def test_tflite_backend_matches_session_backend(model_files):
+    model_path, tflite_path, label_map_path = model_files
+    session_detector = detection_models.BBoxDetector(model_path,
+                                                     label_map_path)
+    tflite_detector = detection_models.BBoxDetector(tflite_path,
+                                                    label_map_path)
+    assert isinstance(tflite_detector._backend,
+                      detection_models.backends.TFLiteBackend)
+    assert tflite_detector._session is None
+    assert tflite_detector.fingerprint != session_detector.fingerprint
+
+    # images of the model's input size, and images that must be resized
+    images = random_images(3, *INPUT_SIZE) + random_images(2, 60, 40)
+    for image in images:
+        assert_same_results(
+            tflite_detector.detect(image, 0.2),
+            session_detector.detect(image, 0.2))
+
+    for results, expected in zip(
+            tflite_detector.detect_batch(images, 0.2, max_batch_size=2),
+            session_detector.detect_batch(images, 0.2)):
+        assert_same_results(results, expected)
+
+
+def test_tflite_backend_rejects_encoded_input(model_files):
+    _, tflite_path, label_map_path = model_files
+    with pytest.raises(ValueError):
+        detection_models.BBoxDetector(
+            tflite_path, label_map_path, encoded_input=True)
+
+
+def test_convert_command_quantizes(model_files, tmp_path):
+    model_path, tflite_path, label_map_path = model_files
+    output_path = tmp_path / "quantized.tflite"
+    assert detection_models.cli.main([
+        "convert",
+        str(model_path),
+        str(output_path), "--input-size", "32x48", "--quantization",
+        "dynamic"
+    ]) == 0
+
+    detector = detection_models.BBoxDetector(output_path, label_map_path)
+    expected = detection_models.BBoxDetector(tflite_path, label_map_path)
+    image = random_images(1, *INPUT_SIZE)[0]
+    assert_same_results(detector.detect(image), expected.detect(image))
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 """Tests for `detection_models` package."""
 
+import asyncio
 import os
 from pathlib import Path
 
+import numpy as np
 import pytest
 
 import detection_models
+import detection_models.scheduler
 import detection_models.utils
 
 TESTS_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
@@ -21,7 +24,122 @@ def model():
         label_map_path=test_data_dir / "mscoco_label_map.pbtxt")
 
 
+def assert_same_detections(results, expected):
+    assert list(results.keys()) == list(expected.keys())
+    for name in ("boxes", "scores", "class_ids"):
+        np.testing.assert_allclose(getattr(results, name),
+                                   getattr(expected, name))
+
+
+@pytest.fixture
+def synthetic_model(model_files):
+    model_path, label_map_path = model_files
+    return detection_models.BBoxDetector(model_path=model_path,
+                                         label_map_path=label_map_path)
+
+
 def test_detect(model):
     sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
     image = detection_models.utils.load_image_as_array(sample_image_path)
     _ = model.detect(image)
+
+
+def test_detect_batch(synthetic_model):
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    image = detection_models.utils.load_image_as_array(sample_image_path)
+    small_image = image[:image.shape[0] // 2, :image.shape[1] // 2]
+    images = [image, small_image, image]
+    batch_results = synthetic_model.detect_batch(images, max_batch_size=2)
+    assert len(batch_results) == len(images)
+    for image, results in zip(images, batch_results):
+        assert_same_detections(results, synthetic_model.detect(image))
+
+
+def test_detect_stream(synthetic_model):
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    sources = [
+        sample_image_path,
+        sample_image_path.read_bytes(),
+        detection_models.utils.load_image_as_array(sample_image_path),
+    ]
+    streamed = list(
+        synthetic_model.detect_stream(sources, prefetch=2,
+                                      decode_workers=2, batch_size=2))
+    assert [source for source, _ in streamed] == sources
+    expected = synthetic_model.detect(sources[2])
+    for _, results in streamed:
+        assert_same_detections(results, expected)
+
+
+def test_detect_stream_returns_exceptions(synthetic_model):
+    image = detection_models.utils.load_image_as_array(
+        TESTS_DIR / "test_data" / "image.jpg")
+    sources = [image, b"not an image", image[:10, :10]]
+    streamed = list(
+        synthetic_model.detect_stream(sources, batch_size=3,
+                                      return_images=True,
+                                      return_exceptions=True))
+    assert [streamed_image is None for _, streamed_image, _ in streamed] == [
+        False, True, False
+    ]
+    assert streamed[2][1].shape == (10, 10, 3)
+    assert isinstance(streamed[1][2], Exception)
+    assert_same_detections(streamed[0][2], synthetic_model.detect(image))
+
+
+def test_adetect_batches_concurrent_requests(synthetic_model):
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    image = detection_models.utils.load_image_as_array(sample_image_path)
+    expected = synthetic_model.detect(image)
+
+    async def detect_concurrently():
+        return await asyncio.gather(
+            *[synthetic_model.adetect(image) for _ in range(6)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        all_results = loop.run_until_complete(detect_concurrently())
+        loop.run_until_complete(synthetic_model.batch_scheduler.close())
+    finally:
+        loop.close()
+
+    for results in all_results:
+        assert_same_detections(results, expected)
+    stats = synthetic_model.batch_scheduler.stats
+    assert stats.requests == 6
+    assert stats.batches < 6
+
+
+def test_closing_the_scheduler_fails_pending_requests(synthetic_model):
+    image = np.zeros((16, 24, 3), dtype=np.uint8)
+    scheduler = detection_models.scheduler.MicroBatchScheduler(
+        synthetic_model, max_delay=60.0)
+    synthetic_model.batch_scheduler = scheduler
+
+    async def close_while_waiting():
+        request = asyncio.ensure_future(synthetic_model.adetect(image))
+        await asyncio.sleep(0.05)
+        await synthetic_model.batch_scheduler.close()
+        return await asyncio.wait_for(request, 5.0)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(close_while_waiting())
+    finally:
+        loop.close()
+
+
+def test_tile_origins_cover_image():
+    origins = detection_models.BBoxDetector._tile_origins(2500, 1024, 128)
+    assert origins == [0, 896, 1476]
+    assert detection_models.BBoxDetector._tile_origins(500, 500, 128) == [0]
+
+
+def test_detect_tiled(synthetic_model):
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    image = detection_models.utils.load_image_as_array(sample_image_path)
+    tile_size = (image.shape[0] // 2 + 32, image.shape[1] // 2 + 32)
+    results = synthetic_model.detect_tiled(image, tile_size=tile_size,
+                                           overlap=64, max_batch_size=2)
+    assert np.all((results.boxes >= 0) & (results.boxes <= 1))
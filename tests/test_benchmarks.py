@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Performance benchmarks, run against synthetic frozen graphs
+
+Run with `make benchmark`, i.e. `py.test tests/test_benchmarks.py
+--benchmark-only`; other test runs skip them (see conftest.py). Each
+benchmark also records the peak Python heap usage of one call
+(`peak_python_bytes`) and the process's peak resident set size
+(`max_rss_bytes`) in its extra info.
+"""
+
+import io
+import resource
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+import detection_models
+import detection_models.utils
+
+pytest.importorskip("pytest_benchmark")
+
+IMAGE_SIZES = [(240, 320), (720, 1280), (1080, 1920)]
+DETECTION_COUNTS = [10, 100]
+
+
+def record_peak_memory(benchmark, function, *args, **kwargs):
+    """Runs `function` once more, recording its peak memory use"""
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_python_bytes"] = peak
+    # ru_maxrss is in kilobytes on Linux
+    benchmark.extra_info["max_rss_bytes"] = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def benchmark_model_files(synthetic_model_files, num_detections):
+    """Returns (model_path, label_map_path) for a given detection count"""
+    return synthetic_model_files(num_detections=num_detections,
+                                 compute_layers=2)
+
+
+@pytest.fixture(scope="module")
+def detectors(synthetic_model_files):
+    cache = {}
+
+    def get(num_detections):
+        if num_detections not in cache:
+            cache[num_detections] = detection_models.BBoxDetector(
+                *benchmark_model_files(synthetic_model_files,
+                                       num_detections))
+        return cache[num_detections]
+
+    return get
+
+
+def random_image(height, width):
+    return np.random.RandomState(0).randint(
+        0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_model_load(benchmark, synthetic_model_files):
+    model_path, label_map_path = benchmark_model_files(
+        synthetic_model_files, 100)
+
+    def load():
+        return detection_models.BBoxDetector(model_path, label_map_path)
+
+    benchmark.pedantic(load, rounds=5, warmup_rounds=1)
+    record_peak_memory(benchmark, load)
+
+
+@pytest.mark.parametrize("num_detections", DETECTION_COUNTS)
+@pytest.mark.parametrize("image_size", IMAGE_SIZES, ids=str)
+def test_detect_latency(benchmark, detectors, image_size, num_detections):
+    detector = detectors(num_detections)
+    image = random_image(*image_size)
+    detector.detect(image)
+
+    results = benchmark(detector.detect, image, 0.0)
+    assert len(results.scores) == num_detections
+    record_peak_memory(benchmark, detector.detect, image, 0.0)
+
+
+@pytest.mark.parametrize("batch_size", [1, 8])
+def test_detect_batch_throughput(benchmark, detectors, batch_size):
+    detector = detectors(10)
+    images = [random_image(240, 320)] * 32
+    benchmark.extra_info["images"] = len(images)
+
+    benchmark(detector.detect_batch, images, max_batch_size=batch_size)
+    record_peak_memory(benchmark, detector.detect_batch, images)
+
+
+@pytest.mark.parametrize("num_detections", DETECTION_COUNTS)
+def test_postprocessing(benchmark, detectors, num_detections):
+    detector = detectors(num_detections)
+    image = random_image(240, 320)
+    output_dict = detector._run(np.expand_dims(image, 0))
+
+    benchmark(detector._build_results, output_dict, 0, 0.0, image.shape[:2])
+    record_peak_memory(benchmark, detector._build_results, output_dict, 0,
+                       0.0, image.shape[:2])
+
+
+@pytest.mark.parametrize("image_size", IMAGE_SIZES, ids=str)
+def test_overlay(benchmark, detectors, image_size):
+    image = random_image(*image_size)
+    results = detectors(100).detect(image, 0.0)
+
+    benchmark(results.overlay_all_on_image, image, inplace=False,
+              score_threshold=0.0)
+    record_peak_memory(benchmark, results.overlay_all_on_image, image,
+                       inplace=False, score_threshold=0.0)
+
+
+@pytest.mark.parametrize("image_size", IMAGE_SIZES, ids=str)
+def test_load_image_as_array(benchmark, tmp_path, image_size):
+    image_path = tmp_path / "image.jpg"
+    buffer = io.BytesIO()
+    Image.fromarray(random_image(*image_size)).save(buffer, format="JPEG")
+    image_path.write_bytes(buffer.getvalue())
+    benchmark.extra_info["pixels"] = image_size[0] * image_size[1]
+
+    image = benchmark(detection_models.utils.load_image_as_array, image_path)
+    assert image.shape == image_size + (3, )
+    record_peak_memory(benchmark, detection_models.utils.load_image_as_array,
+                       image_path)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+import detection_models
+import detection_models.cache
+import detection_models.options
+import detection_models.results
+import synthetic_graph
+
+LABEL_TABLE = np.array([None, "person", "kite"], dtype=object)
+
+
+class CountingDetector:
+    fingerprint = "counting"
+
+    def __init__(self):
+        self.images_run = 0
+        self.thresholds = []
+
+    def _detect_batch(self, images, detection_threshold, max_batch_size):
+        self.images_run += len(images)
+        self.thresholds.append(detection_threshold)
+        return [
+            detection_models.results.ColumnarDetectionResults(
+                boxes=np.tile([[0.1, 0.1, 0.5, 0.5]], (3, 1)),
+                scores=np.array([0.9, 0.4, 0.1]),
+                class_ids=np.array([1, 2, 1]),
+                label_table=LABEL_TABLE) for _ in images
+        ]
+
+
+def make_image(value):
+    return np.full((4, 4, 3), value, dtype=np.uint8)
+
+
+def test_memory_tier_hits_and_filters():
+    cache = detection_models.cache.ResultCache(storage_threshold=0.05)
+    detector = CountingDetector()
+
+    first = cache.detect_batch(detector, [make_image(1), make_image(1)], 0.5)
+    assert detector.images_run == 1
+    assert detector.thresholds == [0.05]
+    assert [list(results) for results in first] == [["person"]] * 2
+
+    second = cache.detect_batch(detector, [make_image(1)], 0.3)
+    assert detector.images_run == 1
+    np.testing.assert_allclose(second[0].scores, [0.9, 0.4])
+    assert list(second[0]) == ["person", "kite"]
+    assert cache.stats.memory_hits == 1
+    assert cache.stats.misses == 1
+
+
+def test_changing_results_does_not_change_the_cache():
+    cache = detection_models.cache.ResultCache(storage_threshold=0.05)
+    detector = CountingDetector()
+
+    first, repeated = cache.detect_batch(detector,
+                                         [make_image(1), make_image(1)], 0.05)
+    del first["person"]
+    assert list(repeated) == ["person", "kite"]
+    again = cache.detect_batch(detector, [make_image(1)], 0.05)[0]
+    np.testing.assert_allclose(again.scores, [0.9, 0.4, 0.1])
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = detection_models.cache.ResultCache(max_memory_entries=2)
+    detector = CountingDetector()
+    for value in (1, 2, 1, 3):
+        cache.detect_batch(detector, [make_image(value)])
+    assert cache.stats.memory_evictions == 1
+
+    cache.detect_batch(detector, [make_image(1)])
+    assert cache.stats.memory_hits == 2
+    cache.detect_batch(detector, [make_image(2)])
+    assert detector.images_run == 4
+
+
+def test_disk_tier_persists(tmp_path):
+    path = tmp_path / "results.sqlite"
+    detector = CountingDetector()
+    cache = detection_models.cache.ResultCache(path=path, max_disk_entries=1)
+    cache.detect_batch(detector, [make_image(1)])
+    cache.detect_batch(detector, [make_image(2)])
+    assert cache.stats.disk_evictions == 1
+    cache.close()
+
+    reopened = detection_models.cache.ResultCache(path=path)
+    results = reopened.detect_batch(detector, [make_image(2)])[0]
+    assert reopened.stats.disk_hits == 1
+    assert detector.images_run == 2
+    np.testing.assert_allclose(results.scores, [0.9])
+    reopened.detect_batch(detector, [make_image(1)])
+    assert detector.images_run == 3
+
+
+def test_low_thresholds_are_cached_separately():
+    cache = detection_models.cache.ResultCache(storage_threshold=0.2)
+    detector = CountingDetector()
+    cache.detect_batch(detector, [make_image(1)], 0.5)
+    cache.detect_batch(detector, [make_image(1)], 0.01)
+    assert detector.thresholds == [0.2, 0.01]
+
+
+def test_rewritten_model_is_a_cache_miss(tmp_path):
+    model_path = synthetic_graph.make_frozen_graph(tmp_path / "graph.pb")
+    label_map_path = synthetic_graph.make_label_map(tmp_path / "labels.pbtxt")
+    replacement = synthetic_graph.make_frozen_graph(
+        tmp_path / "replacement.pb", num_classes=2).read_bytes()
+    assert len(replacement) == model_path.stat().st_size
+
+    cache = detection_models.cache.ResultCache()
+    image = make_image(1)
+    before = detection_models.BBoxDetector(
+        model_path, label_map_path, result_cache=cache).detect(image, 0.0)
+
+    # rewrite the model in place, keeping its size and modification time
+    stat = model_path.stat()
+    time.sleep(0.05)
+    model_path.write_bytes(replacement)
+    os.utime(str(model_path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    after = detection_models.BBoxDetector(
+        model_path, label_map_path, result_cache=cache).detect(image, 0.0)
+    assert cache.stats.misses == 2
+    assert list(after.labels) != list(before.labels)
+
+
+def test_fingerprint_includes_graph_transforms(model_files):
+    pytest.importorskip("tensorflow.tools.graph_transforms")
+    fingerprints = {
+        detection_models.BBoxDetector(
+            *model_files,
+            options=detection_models.options.SessionOptions(
+                optimize_graph=optimize_graph,
+                graph_transforms=transforms)).fingerprint
+        for optimize_graph, transforms in [
+            (False, ["strip_unused_nodes"]),
+            (False, ["fold_constants"]),
+            (True, ["strip_unused_nodes"]),
+            (True, ["fold_constants"]),
+        ]
+    }
+    assert len(fingerprints) == 3
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+
+import numpy as np
+import tensorflow as tf
+
+from PIL import Image
+
+import detection_models
+import detection_models.cli
+
+
+def encode(height, width):
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8)).save(
+        buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_images(directory, names):
+    directory.mkdir(parents=True, exist_ok=True)
+    for i, name in enumerate(names):
+        (directory / name).write_bytes(encode(10 + i, 20))
+
+
+def run_detect(model_files, output, *inputs):
+    return detection_models.cli.main(
+        ["detect", str(model_files[0]), str(model_files[1])] +
+        [str(value) for value in inputs] +
+        ["-o", str(output), "--threshold", "0.0", "--batch-size", "2"])
+
+
+def test_detect_resumes_where_it_stopped(model_files, tmp_path):
+    images = tmp_path / "images"
+    write_images(images, ["a.png", "b.png", "c.png"])
+    output = tmp_path / "results"
+
+    assert run_detect(model_files, output, images / "a.png",
+                      images / "b.png") == 0
+    assert run_detect(model_files, output, images) == 0
+
+    reader = detection_models.ResultsReader(output)
+    assert [record["key"] for record in reader.records] == [
+        str(images / name) for name in ["a.png", "b.png", "c.png"]
+    ]
+    assert [(record["height"], record["width"])
+            for record in reader.records] == [(10, 20), (11, 20), (12, 20)]
+    assert [len(results.scores) for _, results in reader] == [10, 10, 10]
+
+
+def test_detect_reads_globs_lists_and_tfrecords(model_files, tmp_path):
+    write_images(tmp_path / "images", ["a.png", "b.png"])
+    list_path = tmp_path / "images.txt"
+    list_path.write_text("images/b.png\n\n")
+    record_path = tmp_path / "images.tfrecord"
+    with tf.python_io.TFRecordWriter(str(record_path)) as writer:
+        example = tf.train.Example(features=tf.train.Features(
+            feature={
+                "image/encoded":
+                tf.train.Feature(bytes_list=tf.train.BytesList(
+                    value=[encode(30, 40)]))
+            }))
+        writer.write(example.SerializeToString())
+
+    output = tmp_path / "results"
+    assert run_detect(model_files, output, tmp_path / "images" / "*.png",
+                      list_path, record_path) == 0
+
+    reader = detection_models.ResultsReader(output)
+    # b.png is listed twice but only detected once
+    assert [record["key"] for record in reader.records] == [
+        str(tmp_path / "images" / "a.png"),
+        str(tmp_path / "images" / "b.png"), "{}:0".format(record_path)
+    ]
+    assert (reader.records[-1]["height"], reader.records[-1]["width"]) == (30,
+                                                                           40)
+
+
+def test_detect_records_failures_and_continues(model_files, tmp_path):
+    images = tmp_path / "images"
+    write_images(images, ["a.png", "b.png", "c.png"])
+    (images / "b.png").write_bytes(b"not an image")
+    output = tmp_path / "results"
+
+    assert run_detect(model_files, output, images) == 1
+
+    reader = detection_models.ResultsReader(output)
+    assert [record["key"] for record in reader.records] == [
+        str(images / "a.png"), str(images / "c.png")
+    ]
+    failures = [
+        json.loads(line) for line in (
+            output / detection_models.cli.FAILURES_FILE).read_text().
+        splitlines()
+    ]
+    assert [failure["key"] for failure in failures] == [str(images / "b.png")]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+
+import numpy as np
+
+from PIL import Image
+
+import detection_models
+import detection_models.loading
+
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_encoded_input_matches_decoded_input(model_files):
+    decoded_detector = detection_models.BBoxDetector(*model_files)
+    encoded_detector = detection_models.BBoxDetector(
+        *model_files, encoded_input=True)
+    assert encoded_detector.encoded_input
+
+    image = np.random.RandomState(0).randint(
+        0, 256, (24, 32, 3), dtype=np.uint8)
+    small_image = image[:12, :16].copy()
+    png = encode(image, "PNG")
+    assert encoded_detector._image_size(png) == (24, 32)
+
+    expected = decoded_detector.detect(image, 0.0)
+    results = encoded_detector.detect(png, 0.0)
+    np.testing.assert_allclose(results.boxes, expected.boxes)
+    assert list(results) == list(expected)
+
+    # images of different sizes and formats are bucketed by their headers
+    batch_results = encoded_detector.detect_batch(
+        [png, encode(small_image, "JPEG"), png], 0.0)
+    assert [len(results.scores) for results in batch_results] == [10, 10, 10]
+
+
+def test_encoded_input_resize_and_registry(model_files):
+    detector = detection_models.BBoxDetector(
+        *model_files, encoded_input=True, input_size=(16, 16), shared=True)
+    image = np.zeros((20, 10, 3), dtype=np.uint8)
+    assert detector._image_size(encode(image, "PNG")) == (16, 16)
+    assert len(detector.detect(encode(image, "PNG"), 0.0).scores) == 10
+
+    plain = detection_models.BBoxDetector(*model_files, shared=True)
+    assert plain._session is not detector._session
+    assert plain.fingerprint != detector.fingerprint
+    assert (detector._backend.image_tensor.name ==
+            detection_models.loading.ENCODED_INPUT_TENSOR_KEY + ":0")
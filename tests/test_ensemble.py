@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models.ensemble
+import detection_models.ops
+import detection_models.results
+
+
+class FixedDetector:
+    """Returns the same detections for every image"""
+
+    def __init__(self, boxes, scores, labels):
+        self.label_table = np.array([None] + sorted(set(labels)),
+                                    dtype=object)
+        self.boxes = np.array(boxes)
+        self.scores = np.array(scores)
+        self.class_ids = np.array(
+            [list(self.label_table).index(label) for label in labels])
+
+    def detect_batch(self, images, detection_threshold=0.5,
+                     max_batch_size=None):
+        return [
+            detection_models.results.ColumnarDetectionResults(
+                self.boxes, self.scores, self.class_ids, self.label_table)
+            for _ in images
+        ]
+
+
+def test_weighted_box_fusion():
+    boxes = np.array([[0, 0, 10, 10], [0, 2, 10, 12], [50, 50, 60, 60]])
+    scores = np.array([0.9, 0.3, 0.8])
+    fused_boxes, fused_scores, class_ids = (
+        detection_models.ops.weighted_box_fusion(
+            boxes, scores, np.array([1, 1, 1]), np.array([0, 1, 0]), 2))
+    np.testing.assert_allclose(fused_boxes[0], [0, 0.5, 10, 10.5])
+    np.testing.assert_allclose(fused_scores, [0.6, 0.4])
+    assert class_ids.tolist() == [1, 1]
+
+
+@pytest.mark.parametrize("fusion", ["wbf", "nms"])
+def test_ensemble_reconciles_labels(fusion):
+    first = FixedDetector(
+        boxes=[[0.1, 0.1, 0.5, 0.5], [0.6, 0.6, 0.9, 0.9]],
+        scores=[0.9, 0.7],
+        labels=["person", "motorbike"])
+    second = FixedDetector(
+        boxes=[[0.1, 0.1, 0.5, 0.52], [0.6, 0.6, 0.9, 0.9]],
+        scores=[0.8, 0.6],
+        labels=["person", "motorcycle"])
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+
+    with detection_models.ensemble.EnsembleDetector(
+            [first, second],
+            fusion=fusion,
+            label_aliases={"motorbike": "motorcycle"}) as ensemble:
+        results = ensemble.detect(image)
+    assert list(results) == ["person", "motorcycle"]
+    assert len(results["person"]) == len(results["motorcycle"]) == 1
+    assert results["person"][0].confidence == pytest.approx(
+        0.85 if fusion == "wbf" else 0.9)
+
+
+def test_ensemble_rejects_unknown_fusion():
+    with pytest.raises(ValueError):
+        detection_models.ensemble.EnsembleDetector(
+            [FixedDetector([], [], [])], fusion="vote")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models.evaluation
+import detection_models.ops
+from detection_models.evaluation import Evaluator, GroundTruth
+from detection_models.results import ColumnarDetectionResults
+
+LABEL_TABLE = np.array([None, "person", "kite", "dog"], dtype=object)
+
+
+def make_results(boxes, scores, class_ids):
+    return ColumnarDetectionResults(
+        np.asarray(boxes, dtype=np.float32).reshape(-1, 4), scores,
+        class_ids, LABEL_TABLE)
+
+
+def random_image(rng, num_objects, num_detections):
+    corners = rng.uniform(0, 0.7, (num_objects, 2))
+    gt_boxes = np.hstack([corners, corners + rng.uniform(0.1, 0.3, (
+        num_objects, 2))])
+    gt_class_ids = rng.randint(1, 4, num_objects)
+    # jittered copies of some objects, plus unrelated boxes
+    copies = rng.randint(0, max(num_objects, 1), num_detections)
+    boxes = rng.uniform(0, 0.7, (num_detections, 4))
+    boxes[:, 2:] = boxes[:, :2] + 0.2
+    class_ids = rng.randint(1, 4, num_detections)
+    if num_objects:
+        jittered = rng.rand(num_detections) < 0.7
+        boxes[jittered] = (gt_boxes[copies[jittered]] +
+                           rng.normal(0, 0.03, (jittered.sum(), 4)))
+        class_ids[jittered] = gt_class_ids[copies[jittered]]
+    results = make_results(boxes, rng.rand(num_detections), class_ids)
+    return results, GroundTruth(gt_boxes, list(LABEL_TABLE[gt_class_ids]))
+
+
+def exact_average_precision(pairs, label, iou_threshold):
+    """A direct (unbinned) implementation of COCO's AP for one label"""
+    scores, outcomes, num_ground_truth = [], [], 0
+    for results, ground_truth in pairs:
+        is_label = results.labels[:100] == label
+        boxes = results.boxes[:100][is_label]
+        gt_boxes = np.asarray(ground_truth.boxes)[np.array(
+            ground_truth.labels, dtype=object) == label]
+        num_ground_truth += len(gt_boxes)
+        matched = set()
+        for box, score in zip(boxes, results.scores[:100][is_label]):
+            ious = detection_models.ops.iou_matrix(box, gt_boxes)[0]
+            best, best_iou = None, iou_threshold
+            for j, iou in enumerate(ious):
+                if j not in matched and iou >= best_iou:
+                    best, best_iou = j, iou
+            if best is not None:
+                matched.add(best)
+            scores.append(score)
+            outcomes.append(best is not None)
+
+    order = np.argsort(-np.array(scores), kind="stable")
+    outcomes = np.array(outcomes, dtype=bool)[order]
+    true_positives = np.cumsum(outcomes)
+    recall = true_positives / num_ground_truth
+    precision = true_positives / np.arange(1, len(outcomes) + 1)
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    interpolated = [
+        precision[np.searchsorted(recall, level)]
+        if np.searchsorted(recall, level) < len(recall) else 0.0
+        for level in detection_models.evaluation.RECALL_LEVELS
+    ]
+    return np.mean(interpolated)
+
+
+def test_perfect_detections():
+    evaluator = Evaluator(LABEL_TABLE[1:])
+    boxes = [[0.1, 0.1, 0.4, 0.4], [0.5, 0.5, 0.9, 0.9]]
+    evaluator.add(make_results(boxes, [0.9, 0.8], [1, 3]),
+                  GroundTruth(boxes, ["person", "dog"]))
+    summary = evaluator.summarize()
+    assert summary["AP"] == pytest.approx(1.0)
+    assert summary["AP50"] == pytest.approx(1.0)
+    assert summary["AR"] == pytest.approx(1.0)
+    assert np.isnan(summary["labels"]["kite"]["AP"])
+    assert summary["labels"]["dog"]["num_ground_truth"] == 1
+
+
+def test_duplicates_and_misses():
+    evaluator = Evaluator(LABEL_TABLE[1:], iou_thresholds=[0.5])
+    box = [0.1, 0.1, 0.4, 0.4]
+    # a false positive scoring above the true positive, and a duplicate
+    evaluator.add(
+        make_results([[0.6, 0.6, 0.9, 0.9], box, box], [0.9, 0.8, 0.7],
+                     [1, 1, 1]), GroundTruth([box], ["person"]))
+    evaluator.add(make_results([], [], []),
+                  GroundTruth([box], ["person"]))
+    summary = evaluator.summarize()
+    # recall 0.5 is reached at precision 0.5
+    assert summary["AP"] == pytest.approx(51 * 0.5 / 101)
+    assert summary["AR"] == pytest.approx(0.5)
+
+
+def test_matches_exact_computation_and_merges():
+    rng = np.random.RandomState(0)
+    pairs = [
+        random_image(rng, rng.randint(0, 8), rng.randint(0, 30))
+        for _ in range(60)
+    ]
+    first, second = Evaluator(LABEL_TABLE[1:]), Evaluator(LABEL_TABLE[1:])
+    first.add_all(pairs[:30])
+    second.add_all(pairs[30:])
+    evaluator = first.merge(second)
+    assert evaluator.num_images == 60
+
+    precision, _ = evaluator.precision_recall()
+    for i, label in enumerate(LABEL_TABLE[1:]):
+        for t, threshold in enumerate(evaluator.iou_thresholds):
+            assert precision[i, t].mean() == pytest.approx(
+                exact_average_precision(pairs, label, threshold), abs=0.005)
+
+
+def test_unknown_ground_truth_label():
+    with pytest.raises(ValueError):
+        Evaluator(["person"]).add(make_results([], [], []),
+                                  GroundTruth([[0, 0, 1, 1]], ["cat"]))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models
+
+
+@pytest.mark.parametrize("allowed_labels", [None, ["kite", "dog"], []])
+@pytest.mark.parametrize("max_detections", [None, 4])
+def test_in_graph_filtering_matches_python_filtering(
+        model_files, allowed_labels, max_detections):
+    kwargs = dict(allowed_labels=allowed_labels,
+                  max_detections=max_detections)
+    filtered = detection_models.BBoxDetector(
+        *model_files, filter_in_graph=True, **kwargs)
+    unfiltered = detection_models.BBoxDetector(*model_files, **kwargs)
+    assert filtered.fingerprint == unfiltered.fingerprint
+
+    images = [np.zeros((16, 24, 3), dtype=np.uint8)] * 3
+    for threshold in (0.0, 0.5, 0.99):
+        for results, expected in zip(
+                filtered.detect_batch(images, threshold),
+                unfiltered.detect_batch(images, threshold)):
+            np.testing.assert_array_equal(results.boxes, expected.boxes)
+            np.testing.assert_array_equal(results.scores, expected.scores)
+            assert list(results.labels) == list(expected.labels)
+            if allowed_labels is not None:
+                assert set(results.labels) <= set(allowed_labels)
+            if max_detections is not None:
+                assert len(results.scores) <= max_detections
+
+
+def test_only_surviving_detections_are_fetched(model_files):
+    detector = detection_models.BBoxDetector(
+        *model_files, filter_in_graph=True, allowed_labels=["person"])
+    batch = np.zeros((2, 16, 24, 3), dtype=np.uint8)
+
+    # persons are every third detection, with scores 1.0, 0.7, 0.4, 0.1
+    output_dict = detector._run(batch, 0.3)
+    assert output_dict["detection_boxes"].shape == (2, 3, 4)
+    np.testing.assert_array_equal(output_dict["num_detections"], [3, 3])
+    np.testing.assert_array_equal(output_dict["detection_classes"], 1)
+
+    assert detector._run(batch, 2.0)["detection_scores"].shape == (2, 0)
+
+
+def test_unknown_allowed_label(model_files):
+    with pytest.raises(ValueError):
+        detection_models.BBoxDetector(*model_files, allowed_labels=["cat"])
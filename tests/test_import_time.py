@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Guards the import time of the lightweight parts of `detection_models`."""
+
+import json
+import subprocess
+import sys
+
+# generous enough for slow CI machines, but far below the several seconds
+# TensorFlow and the Object Detection API take to import
+IMPORT_TIME_BUDGET = 1.5
+
+HEAVY_MODULES = ["tensorflow", "object_detection", "matplotlib"]
+
+MEASURE_IMPORT_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import detection_models
+import detection_models.results
+import detection_models.utils
+elapsed = time.perf_counter() - start
+
+print(json.dumps({
+    "elapsed": elapsed,
+    "heavy_modules": [name for name in %r if name in sys.modules],
+}))
+""" % HEAVY_MODULES
+
+
+def test_lightweight_import_time():
+    # run in a fresh interpreter so modules imported by other tests do not
+    # hide the cost of the import
+    output = subprocess.check_output(
+        [sys.executable, "-c", MEASURE_IMPORT_SCRIPT])
+    measurement = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    assert measurement["heavy_modules"] == []
+    assert measurement["elapsed"] < IMPORT_TIME_BUDGET
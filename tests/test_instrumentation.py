@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+import detection_models
+import detection_models.instrumentation
+
+
+def test_prometheus_export():
+    metrics = detection_models.instrumentation.MetricsHook(
+        latency_buckets=(0.01, 0.1), batch_size_buckets=(1, 8))
+    metrics.on_stage("session_run", 0.05)
+    metrics.on_stage("session_run", 0.5)
+    metrics.on_batch(4)
+    metrics.on_detections(3)
+
+    text = metrics.to_prometheus()
+    assert "# TYPE detection_models_stage_seconds histogram" in text
+    assert ('detection_models_stage_seconds_bucket{stage="session_run",'
+            'le="0.1"} 1') in text
+    assert ('detection_models_stage_seconds_bucket{stage="session_run",'
+            'le="+Inf"} 2') in text
+    assert 'detection_models_stage_seconds_count{stage="session_run"} 2' in (
+        text)
+    assert 'detection_models_batch_size_bucket{le="8.0"} 1' in text
+    assert "detection_models_detections_per_image_sum 3.0" in text
+
+
+def test_detector_reports_stages_and_traces(model_files, tmp_path):
+    metrics = detection_models.MetricsHook()
+    detector = detection_models.BBoxDetector(
+        *model_files,
+        instrumentation=detection_models.Instrumentation(
+            [metrics], trace_dir=tmp_path / "traces", trace_every=2))
+
+    images = [np.zeros((32, 32, 3), dtype=np.uint8)] * 3
+    detector.detect(images[0], 0.0)
+    detector.detect_batch(images, 0.0)
+    detector.detect(images[0], 0.0)
+
+    for stage in detection_models.instrumentation.STAGES:
+        assert metrics.stage_seconds[stage].count > 0
+    assert metrics.batch_sizes.count == 3
+    assert metrics.detections_per_image.count == 5
+    assert metrics.detections_per_image.total == 50
+
+    traces = sorted((tmp_path / "traces").iterdir())
+    assert len(traces) == 2
+    assert all("_{}_".format(os.getpid()) in trace.name for trace in traces)
+    assert "traceEvents" in json.loads(traces[0].read_text())
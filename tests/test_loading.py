@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+
+import detection_models
+import detection_models.loading
+
+TESTS_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
+
+
+def test_build_label_lookup():
+    category_index = {
+        1: {"id": 1, "name": "person"},
+        300: {"id": 300, "name": "rare thing"},
+    }
+    label_lookup = detection_models.loading.build_label_lookup(category_index)
+    assert label_lookup[1] == "person"
+    assert label_lookup[300] == "rare thing"
+    assert label_lookup[2] is None
+
+
+def test_load_label_map_cache(tmp_path):
+    label_map_path = tmp_path / "mscoco_label_map.pbtxt"
+    shutil.copy(
+        str(TESTS_DIR / "test_data" / "mscoco_label_map.pbtxt"),
+        str(label_map_path))
+
+    parsed, digest = detection_models.loading.load_label_map(label_map_path)
+    cache_path = detection_models.loading._metadata_path(
+        label_map_path, detection_models.loading.LABEL_TABLE_SUFFIX)
+    assert cache_path.parent == detection_models.loading.metadata_cache_dir()
+    assert cache_path.exists()
+    assert not list(tmp_path.glob("*.json"))
+
+    cached, cached_digest = detection_models.loading.load_label_map(
+        label_map_path)
+    assert cached == parsed
+    assert cached_digest == digest
+
+    # a modified label map invalidates the cache
+    with open(str(label_map_path), "a") as f:
+        f.write('\nitem {\n  name: "/m/extra"\n  id: 1000\n'
+                '  display_name: "extra"\n}\n')
+    updated, updated_digest = detection_models.loading.load_label_map(
+        label_map_path)
+    assert updated_digest != digest
+    assert updated[1000]["name"] == "extra"
+
+
+def test_shared_detectors_share_session(model_files):
+    model_path, label_map_path = model_files
+    first = detection_models.BBoxDetector(
+        model_path, label_map_path, shared=True)
+    second = detection_models.BBoxDetector(
+        model_path, label_map_path, shared=True)
+    unshared = detection_models.BBoxDetector(model_path, label_map_path)
+    assert first._session is second._session
+    assert unshared._session is not first._session
+
+
+def test_metadata_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert (detection_models.loading.metadata_cache_dir() == tmp_path /
+            "detection_models")
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert (detection_models.loading.metadata_cache_dir() ==
+            Path.home() / ".cache" / "detection_models")
+
+
+def test_file_digest_tracks_modification(tmp_path):
+    path = tmp_path / "model.pb"
+    path.write_bytes(b"graph")
+    digest = detection_models.loading.file_digest(path)
+    assert digest == hashlib.sha256(b"graph").hexdigest()
+    assert detection_models.loading.file_digest(path) == digest
+
+    # a rewrite with the same size and modification time is still noticed
+    # (once the file system's clock has ticked)
+    stat = path.stat()
+    time.sleep(0.05)
+    path.write_bytes(b"GRAPH")
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert (detection_models.loading.file_digest(path) ==
+            hashlib.sha256(b"GRAPH").hexdigest())
+
+    # a copy has the same digest, cached or not
+    copy_path = tmp_path / "copy.pb"
+    shutil.copy(str(path), str(copy_path))
+    copy_digest = detection_models.loading.file_digest(copy_path,
+                                                       cache_metadata=False)
+    assert copy_digest == detection_models.loading.file_digest(path)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import detection_models.ops
+
+
+def test_non_max_suppression():
+    boxes = np.array([
+        [0, 0, 10, 10],
+        [1, 1, 10, 10],
+        [0, 0, 10, 10],
+        [20, 20, 30, 30],
+    ])
+    scores = np.array([0.8, 0.9, 0.7, 0.5])
+    keep = detection_models.ops.non_max_suppression(boxes, scores, 0.5)
+    assert keep.tolist() == [1, 3]
+
+    # boxes of different classes do not suppress each other
+    class_ids = np.array([1, 1, 2, 1])
+    keep = detection_models.ops.non_max_suppression(
+        boxes, scores, 0.5, class_ids)
+    assert keep.tolist() == [1, 2, 3]
+
+    keep = detection_models.ops.non_max_suppression(
+        boxes, scores, 0.5, class_ids, max_detections=2)
+    assert keep.tolist() == [1, 2]
+
+
+def test_non_max_suppression_empty():
+    keep = detection_models.ops.non_max_suppression(
+        np.zeros((0, 4)), np.zeros(0), class_ids=np.zeros(0))
+    assert keep.shape == (0, )
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from tensorflow.core.protobuf import rewriter_config_pb2
+
+import detection_models.options
+
+
+def test_to_config_proto():
+    options = detection_models.options.SessionOptions(
+        intra_op_threads=2,
+        inter_op_threads=1,
+        constant_folding=True,
+        layout_optimizer=False)
+    config = options.to_config_proto()
+    assert config.intra_op_parallelism_threads == 2
+    assert config.inter_op_parallelism_threads == 1
+    rewrite_options = config.graph_options.rewrite_options
+    assert rewrite_options.constant_folding == (
+        rewriter_config_pb2.RewriterConfig.ON)
+    assert rewrite_options.layout_optimizer == (
+        rewriter_config_pb2.RewriterConfig.OFF)
+    assert rewrite_options.arithmetic_optimization == (
+        rewriter_config_pb2.RewriterConfig.DEFAULT)
+
+
+def test_default_options_keep_tensorflow_defaults():
+    config = detection_models.options.SessionOptions().to_config_proto()
+    assert config.intra_op_parallelism_threads == 0
+    assert config.inter_op_parallelism_threads == 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import detection_models
+import detection_models.pool
+import detection_models.results
+import detection_models.utils
+
+TESTS_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
+
+
+class CrashingDetector:
+    """A detector whose process dies on its first batch"""
+
+    def __init__(self, model_path, label_map_path, options=None):
+        pass
+
+    def detect_batch(self, images, detection_threshold):
+        os._exit(3)
+
+
+class UnloadableDetector:
+    """A detector that always fails to load"""
+
+    def __init__(self, model_path, label_map_path, options=None):
+        raise IOError("cannot load {}".format(model_path))
+
+
+class FirstLoadFailsDetector:
+    """A detector that fails to load in the first worker that loads it"""
+
+    def __init__(self, model_path, label_map_path, options=None):
+        # model_path is a marker file; only the first worker creates it
+        try:
+            os.close(os.open(str(model_path), os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return
+        raise IOError("cannot load {}".format(model_path))
+
+    def detect_batch(self, images, detection_threshold):
+        return [detection_models.results.DetectionResults() for _ in images]
+
+
+def test_shared_memory_round_trip():
+    images = [
+        np.random.randint(0, 255, (4, 5, 3), dtype=np.uint8),
+        np.random.randint(0, 255, (2, 7, 3), dtype=np.uint8),
+    ]
+    block, layout = detection_models.pool.write_images_to_shared_memory(
+        images)
+    try:
+        views = detection_models.pool.read_images_from_shared_memory(
+            block, layout)
+        for image, view in zip(images, views):
+            np.testing.assert_array_equal(image, view)
+        del views
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_detector_pool_matches_detector(model_files):
+    model_path, label_map_path = model_files
+    image = detection_models.utils.load_image_as_array(
+        TESTS_DIR / "test_data" / "image.jpg")
+
+    expected = detection_models.BBoxDetector(model_path,
+                                             label_map_path).detect(image)
+    with detection_models.DetectorPool(
+            model_path, label_map_path, num_workers=2) as pool:
+        single = pool.detect(image)
+        batch = pool.detect_batch([image, image, image], max_batch_size=2)
+
+    for results in [single] + batch:
+        assert list(results.keys()) == list(expected.keys())
+
+
+def test_shared_memory_rejects_other_dtypes():
+    with pytest.raises(ValueError):
+        detection_models.pool.write_images_to_shared_memory(
+            [np.zeros((4, 5, 3), dtype=np.float32)])
+
+
+def test_detector_pool_fails_tasks_of_dead_workers():
+    image = np.zeros((4, 5, 3), dtype=np.uint8)
+    with detection_models.DetectorPool(
+            "model.pb", "labels.pbtxt", num_workers=1,
+            detector_class=CrashingDetector) as pool:
+        with pytest.raises(RuntimeError):
+            pool.submit_batch([image]).result(timeout=60)
+        # no worker is left to run later tasks
+        with pytest.raises(RuntimeError):
+            pool.submit_batch([image]).result(timeout=60)
+
+
+def test_detector_pool_fails_tasks_if_loading_fails():
+    image = np.zeros((4, 5, 3), dtype=np.uint8)
+    with detection_models.DetectorPool(
+            "model.pb", "labels.pbtxt", num_workers=2,
+            detector_class=UnloadableDetector) as pool:
+        futures = [pool.submit_batch([image]) for _ in range(4)]
+        for future in futures:
+            with pytest.raises(IOError):
+                future.result(timeout=60)
+
+
+def test_detector_pool_runs_tasks_on_the_workers_that_loaded(tmp_path):
+    image = np.zeros((4, 5, 3), dtype=np.uint8)
+    with detection_models.DetectorPool(
+            tmp_path / "marker", "labels.pbtxt", num_workers=2,
+            detector_class=FirstLoadFailsDetector) as pool:
+        futures = [pool.submit_batch([image, image]) for _ in range(4)]
+        for future in futures:
+            assert len(future.result(timeout=60)) == 2
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import detection_models.rendering
+import detection_models.results
+
+
+def test_render_batch_draws_in_place():
+    renderer = detection_models.rendering.BoxRenderer(line_thickness=2)
+    frames = np.zeros((3, 64, 64, 3), dtype=np.uint8)
+    boxes = np.array([[0.25, 0.25, 0.75, 0.75]])
+    results = [{
+        "person": [
+            detection_models.results.DetectedBBox("person", 0.9, boxes[0])
+        ]
+    }] * 2 + [{}]
+    renderer.render_batch(frames, results)
+
+    color = renderer.color_for("person")
+    np.testing.assert_array_equal(frames[0, 40, 16], color)
+    np.testing.assert_array_equal(frames[1, 40, 16], color)
+    assert not frames[0, 40, 32].any()
+    assert not frames[2].any()
+
+
+def test_draw_respects_threshold_and_limit():
+    renderer = detection_models.rendering.BoxRenderer()
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    renderer.draw(
+        image,
+        boxes=np.array([[0.5, 0.5, 0.9, 0.9]]),
+        scores=np.array([0.2]),
+        labels=["kite"],
+        score_threshold=0.5)
+    assert not image.any()
+
+
+def test_caption_bitmaps_are_cached():
+    renderer = detection_models.rendering.BoxRenderer(max_cached_captions=1)
+    first = renderer._caption_bitmap("kite: 90%")
+    assert renderer._caption_bitmap("kite: 90%") is first
+    renderer._caption_bitmap("kite: 91%")
+    assert renderer._caption_bitmap("kite: 90%") is not first
+
+
+def test_caption_cache_is_thread_safe():
+    renderer = detection_models.rendering.BoxRenderer(max_cached_captions=8)
+
+    def render(index):
+        for score in range(100):
+            renderer._caption_bitmap("kite {}: {}%".format(index, score))
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(render, range(8)))
+    assert len(renderer._caption_cache) == 8
@@ -53,3 +53,137 @@ def test_bbox_overlay_on_image(detected_bbox):
     sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
     image = detection_models.utils.load_image_as_array(sample_image_path)
     _ = detected_bbox.overlay_on_image(image)
+
+
+@pytest.fixture
+def columnar_results():
+    label_table = np.array([None, "person", "kite"], dtype=object)
+    return detection_models.results.ColumnarDetectionResults(
+        boxes=np.array([[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4],
+                        [0.5, 0.5, 0.6, 0.6]]),
+        scores=np.array([0.7, 0.9, 0.8]),
+        class_ids=np.array([1, 2, 1]),
+        label_table=label_table)
+
+
+def test_columnar_results_dict_access(columnar_results):
+    assert list(columnar_results.keys()) == ["kite", "person"]
+    assert len(columnar_results["person"]) == 2
+    first_person = columnar_results["person"][0]
+    assert isinstance(first_person, detection_models.results.DetectedBBox)
+    assert first_person.confidence == pytest.approx(0.8)
+    assert first_person.ymin == pytest.approx(0.5)
+    assert list(columnar_results.labels) == ["kite", "person", "person"]
+
+
+def test_columnar_results_unknown_class_ids():
+    results = detection_models.results.ColumnarDetectionResults(
+        boxes=np.zeros((3, 4)),
+        scores=np.array([0.9, 0.8, 0.7]),
+        class_ids=np.array([3, 0, 1]),
+        label_table=np.array([None, "person"], dtype=object))
+    assert list(results.keys()) == ["unknown_3", "unknown_0", "person"]
+    assert list(results.labels) == ["unknown_3", "unknown_0", "person"]
+    assert results["unknown_3"][0].label == "unknown_3"
+
+
+def test_columnar_results_can_be_changed(columnar_results, detected_bbox):
+    persons = columnar_results["person"]
+    persons.append(detected_bbox)
+    persons.sort(key=lambda detection: detection.confidence)
+    assert columnar_results["person"] is persons
+    assert [detection.confidence for detection in persons + []] == [
+        pytest.approx(0.7), pytest.approx(0.8), pytest.approx(0.9601364)
+    ]
+
+    columnar_results["dog"] = [
+        detection_models.results.DetectedBBox("dog", 0.5,
+                                              np.array([0, 0, 1, 1]))
+    ]
+    kites = columnar_results.pop("kite")
+    assert isinstance(kites[0], detection_models.results.DetectedBBox)
+    assert list(columnar_results.keys()) == ["person", "dog"]
+
+    # the arrays follow the changes
+    assert list(columnar_results.labels) == [
+        "person", "person", "person", "dog"
+    ]
+    np.testing.assert_allclose(columnar_results.scores,
+                               [0.9601364, 0.8, 0.7, 0.5])
+    assert list(columnar_results.filter(0.75).labels) == ["person", "person"]
+    copied = columnar_results.copy()
+    assert list(copied.labels) == list(columnar_results.labels)
+    copied["person"].clear()
+    assert len(columnar_results["person"]) == 3
+
+
+def test_columnar_results_from_detection_results(detection_results):
+    columnar = (detection_models.results.ColumnarDetectionResults.
+                from_detection_results(detection_results))
+    assert list(columnar.keys()) == ["person", "kite"]
+    assert list(columnar.labels) == ["person", "kite", "person", "kite"]
+    np.testing.assert_allclose(
+        columnar.scores, [0.9601364, 0.9470245, 0.9334038, 0.9046292])
+    assert columnar["kite"][1].xmin == pytest.approx(0.3519255)
+
+
+def test_detected_bbox_has_slots(detected_bbox):
+    with pytest.raises(AttributeError):
+        detected_bbox.extra_attribute = None
+
+
+def test_rle_round_trip():
+    mask = np.random.rand(13, 17) > 0.5
+    counts = detection_models.results.encode_rle(mask)
+    assert counts.sum() == mask.size
+    np.testing.assert_array_equal(
+        detection_models.results.decode_rle(counts, mask.shape), mask)
+
+
+def test_mask_detection_results():
+    image_mask = np.zeros((10, 10), dtype=bool)
+    image_mask[2:5, 3:7] = True
+    results = detection_models.results.MaskDetectionResults(
+        boxes=np.array([[0.2, 0.3, 0.5, 0.7]]),
+        scores=np.array([0.9]),
+        class_ids=np.array([1]),
+        label_table=np.array([None, "person"], dtype=object),
+        mask_rles=[detection_models.results.encode_rle(image_mask)],
+        image_size=(10, 10))
+    detected_mask = results["person"][0]
+    assert isinstance(detected_mask, detection_models.results.DetectedMask)
+    assert detected_mask.area == 12
+    np.testing.assert_array_equal(detected_mask.mask, image_mask)
+
+
+def test_overlay_all_on_image_empty_results():
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    image = detection_models.utils.load_image_as_array(sample_image_path)
+    original = image.copy()
+    overlaid = detection_models.results.DetectionResults(
+    ).overlay_all_on_image(image)
+    np.testing.assert_array_equal(overlaid, original)
+
+
+def test_overlay_all_on_image_not_inplace(detection_results):
+    sample_image_path = TESTS_DIR / "test_data" / "image.jpg"
+    image = detection_models.utils.load_image_as_array(sample_image_path)
+    original = image.copy()
+    overlaid = detection_results.overlay_all_on_image(image, inplace=False)
+    np.testing.assert_array_equal(image, original)
+    assert (overlaid != original).any()
+
+
+def test_columnar_filter_keeps_type():
+    results = detection_models.results.MaskDetectionResults(
+        boxes=np.array([[0, 0, 1, 1], [0, 0, 0.5, 0.5]]),
+        scores=np.array([0.3, 0.8]),
+        class_ids=np.array([1, 2]),
+        label_table=np.array([None, "person", "kite"], dtype=object),
+        mask_rles=[np.array([0, 4], dtype=np.uint32),
+                   np.array([4], dtype=np.uint32)],
+        image_size=(2, 2))
+    filtered = results.filter(0.5)
+    assert type(filtered) is detection_models.results.MaskDetectionResults
+    assert list(filtered) == ["kite"]
+    assert filtered["kite"][0].area == 0
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models.results
+import detection_models.serialization
+
+
+def make_results(label_table, class_ids, scores):
+    count = len(scores)
+    boxes = np.tile([[0.1, 0.2, 0.5, 0.6]], (count, 1))
+    return detection_models.results.ColumnarDetectionResults(
+        boxes, scores, class_ids, label_table)
+
+
+def test_round_trip_and_select(tmp_path):
+    first_table = np.array([None, "person", "kite"], dtype=object)
+    second_table = np.array([None, "kite", "dog"], dtype=object)
+    path = tmp_path / "store"
+
+    with detection_models.serialization.ResultsWriter(path) as writer:
+        writer.write(make_results(first_table, [1, 2], [0.9, 0.4]),
+                     key="a.jpg", image_size=(100, 200))
+        writer.write(make_results(first_table, [], []), key="b.jpg")
+    # reopening appends, with label tables reconciled by name
+    with detection_models.serialization.ResultsWriter(path) as writer:
+        assert writer.write(make_results(second_table, [1, 2], [0.8, 0.7]),
+                            key="c.jpg", image_size=(10, 10)) == 2
+
+    reader = detection_models.serialization.ResultsReader(path)
+    assert len(reader) == 3
+    assert [record["key"] for record, _ in reader] == [
+        "a.jpg", "b.jpg", "c.jpg"
+    ]
+    assert list(reader[0]) == ["person", "kite"]
+    assert len(reader[1]) == 0
+    assert list(reader[2]) == ["kite", "dog"]
+    np.testing.assert_allclose(reader[2].scores, [0.8, 0.7])
+
+    kites = reader.select(labels=["kite"])
+    assert reader.result_indices[kites].tolist() == [0, 2]
+    assert reader.select(labels=["kite", "dog"], min_score=0.5).tolist() == [
+        2, 3
+    ]
+    np.testing.assert_array_equal(
+        reader.denormalize(kites), [[10, 40, 50, 120], [1, 2, 5, 6]])
+
+
+def test_interrupted_write_is_ignored(tmp_path):
+    label_table = np.array([None, "person"], dtype=object)
+    path = tmp_path / "store"
+    with detection_models.serialization.ResultsWriter(path) as writer:
+        writer.write(make_results(label_table, [1], [0.9]))
+    # the detections of an unfinished result, without its record
+    with open(str(path / "scores.f32"), "ab") as f:
+        f.write(np.float32(0.5).tobytes())
+
+    assert len(detection_models.serialization.ResultsReader(path).scores) == 1
+    with detection_models.serialization.ResultsWriter(path) as writer:
+        writer.write(make_results(label_table, [1, 1], [0.8, 0.7]))
+    reader = detection_models.serialization.ResultsReader(path)
+    np.testing.assert_allclose(reader.scores, [0.9, 0.8, 0.7])
+    # no image sizes were written
+    with pytest.raises(ValueError):
+        reader.denormalize()
+
+
+def test_columnar_denormalize_matches_detected_bbox():
+    results = make_results(np.array([None, "person"], dtype=object), [1],
+                           [0.9])
+    expected = results["person"][0].denormalize(480, 640)
+    assert results.denormalize(480, 640).tolist() == [[
+        expected["ymin"], expected["xmin"], expected["ymax"], expected["xmax"]
+    ]]
+
+
+def test_records_follow_durable_detections(tmp_path):
+    label_table = np.array([None, "person"], dtype=object)
+    path = tmp_path / "store"
+    writer = detection_models.serialization.ResultsWriter(path)
+    writer.write(make_results(label_table, [1], [0.9]), key="a.jpg")
+    writer.flush()
+    writer.write(make_results(label_table, [1], [0.8]), key="b.jpg")
+    # the second record is only written once its detections are flushed
+    reader = detection_models.serialization.ResultsReader(path)
+    assert [record["key"] for record, _ in reader] == ["a.jpg"]
+    writer.close()
+    assert len(detection_models.serialization.ResultsReader(path)) == 2
+
+
+def test_write_converts_detection_results(tmp_path):
+    results = make_results(np.array([None, "person", "kite"], dtype=object),
+                           [1, 2], [0.9, 0.4]).to_detection_results()
+    path = tmp_path / "store"
+    with detection_models.serialization.ResultsWriter(path) as writer:
+        writer.write(results)
+        with pytest.raises(TypeError):
+            writer.write({"person": []})
+
+    reader = detection_models.serialization.ResultsReader(path)
+    assert len(reader) == 1
+    assert list(reader[0]) == ["person", "kite"]
+    np.testing.assert_allclose(reader[0].scores, [0.9, 0.4])
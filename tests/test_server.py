@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import detection_models
+import detection_models.server
+import synthetic_graph
+from detection_models.server import DetectionClient, DetectionServer
+
+
+@pytest.fixture
+def detector(model_files):
+    return detection_models.BBoxDetector(*model_files, max_batch_size=8)
+
+
+@pytest.fixture
+def socket_path(detector, tmp_path):
+    server = DetectionServer({"boxes": detector},
+                             tmp_path / "detector.sock",
+                             max_delay=0.05)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server.socket_path
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    assert not server.socket_path.exists()
+    # the server batches through its own schedulers
+    assert detector.batch_scheduler is None
+
+
+def assert_same_results(results, expected):
+    np.testing.assert_array_equal(results.boxes, expected.boxes)
+    np.testing.assert_array_equal(results.scores, expected.scores)
+    assert list(results.labels) == list(expected.labels)
+
+
+def test_concurrent_clients_match_direct_detection(model_files, detector,
+                                                   socket_path):
+    expected = detection_models.BBoxDetector(*model_files).detect(
+        np.zeros((16, 24, 3), dtype=np.uint8), 0.4)
+
+    def request(index):
+        with DetectionClient(socket_path) as client:
+            assert client.models["boxes"]["labels"][1:] == list(
+                synthetic_graph.DEFAULT_LABELS)
+            assert client.models["boxes"]["labels"] == list(
+                detector.label_table)
+            # images of varying size reuse (and grow) the client's block
+            images = [
+                np.zeros((16 + i, 24, 3), dtype=np.uint8)
+                for i in range(index % 3 + 1)
+            ]
+            return client.detect_batch(images, 0.4)
+
+    with ThreadPoolExecutor(6) as executor:
+        all_results = list(executor.map(request, range(6)))
+
+    for results in all_results:
+        for image_results in results:
+            assert_same_results(image_results, expected)
+
+    with DetectionClient(socket_path) as client:
+        stats = client.stats()["boxes"]
+    assert stats["requests"] == 12
+    assert stats["batches"] < 12
+
+
+def test_inline_transport_and_errors(model_files, socket_path):
+    image = np.zeros((10, 12, 3), dtype=np.uint8)
+    expected = detection_models.BBoxDetector(*model_files).detect(image)
+    with DetectionClient(socket_path, use_shared_memory=False) as client:
+        assert_same_results(client.detect(image), expected)
+        with pytest.raises(ValueError):
+            client.detect(image, model="masks")
+        with pytest.raises(RuntimeError):
+            client._request({"op": "reload"})
+        with pytest.raises(ValueError):
+            client.detect(image.astype(np.float32))
+        # the connection survives a failed request
+        assert_same_results(client.detect(image, model="boxes"), expected)
+
+
+@pytest.mark.parametrize("frame, end_stream", [
+    # too large to read; dropped without waiting for the payload
+    (detection_models.server._FRAME.pack(
+        2, detection_models.server.MAX_PAYLOAD_SIZE + 1) + b"{}", False),
+    # the stream ends within the header
+    (detection_models.server._FRAME.pack(100, 0) + b'{"op":', True),
+])
+def test_malformed_messages_drop_only_their_connection(
+        model_files, socket_path, frame, end_stream):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(10)
+    connection.connect(str(socket_path))
+    connection.sendall(frame)
+    if end_stream:
+        connection.shutdown(socket.SHUT_WR)
+    assert connection.recv(1) == b""
+    connection.close()
+
+    image = np.zeros((10, 12, 3), dtype=np.uint8)
+    expected = detection_models.BBoxDetector(*model_files).detect(image)
+    with DetectionClient(socket_path) as client:
+        assert_same_results(client.detect(image), expected)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import detection_models.utils
+
+TESTS_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
+SAMPLE_IMAGE_PATH = TESTS_DIR / "test_data" / "image.jpg"
+
+
+def test_load_image_sources_match():
+    from_path = detection_models.utils.load_image(SAMPLE_IMAGE_PATH)
+    from_bytes = detection_models.utils.load_image(
+        SAMPLE_IMAGE_PATH.read_bytes())
+    with open(str(SAMPLE_IMAGE_PATH), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            from_mmap = detection_models.utils.load_image(mapped)
+
+    assert from_path.dtype == np.uint8
+    assert from_path.shape[2] == 3
+    assert from_path.flags.writeable
+    np.testing.assert_array_equal(from_path, from_bytes)
+    np.testing.assert_array_equal(from_path, from_mmap)
+
+
+@pytest.mark.parametrize("mode", ["L", "P", "RGBA"])
+def test_load_image_converts_to_rgb(mode):
+    buffer = io.BytesIO()
+    Image.new(mode, (12, 8)).save(buffer, format="PNG")
+    image = detection_models.utils.load_image(buffer.getvalue())
+    assert image.shape == (8, 12, 3)
+
+
+def test_load_image_draft_mode():
+    full_size = detection_models.utils.load_image(SAMPLE_IMAGE_PATH)
+    target_size = (full_size.shape[0] // 4, full_size.shape[1] // 4)
+    draft = detection_models.utils.load_image(
+        SAMPLE_IMAGE_PATH, target_size=target_size)
+    assert target_size[0] <= draft.shape[0] < full_size.shape[0]
+    assert target_size[1] <= draft.shape[1] < full_size.shape[1]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import detection_models.ops
+import detection_models.results
+import detection_models.video
+
+LABEL_TABLE = np.array([None, "person", "kite"], dtype=object)
+
+
+class MovingBoxDetector:
+    """Detects one person moving right by 0.01 per frame"""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, image, detection_threshold=0.5):
+        index = int(image[0, 0, 0])
+        self.calls.append(index)
+        offset = 0.01 * index
+        return detection_models.results.ColumnarDetectionResults(
+            boxes=np.array([[0.1, 0.1 + offset, 0.5, 0.5 + offset]]),
+            scores=np.array([0.9]),
+            class_ids=np.array([1]),
+            label_table=LABEL_TABLE)
+
+
+def make_frames(count):
+    frames = np.zeros((count, 8, 8, 3), dtype=np.uint8)
+    frames[:, 0, 0, 0] = np.arange(count)
+    return list(frames)
+
+
+def test_iou_matrix():
+    boxes_a = np.array([[0, 0, 1, 1], [0, 0, 2, 2]])
+    boxes_b = np.array([[0, 0, 1, 1], [1, 1, 2, 2], [5, 5, 6, 6]])
+    np.testing.assert_allclose(
+        detection_models.ops.iou_matrix(boxes_a, boxes_b),
+        [[1.0, 0.0, 0.0], [0.25, 0.25, 0.0]])
+    assert detection_models.ops.iou_matrix(boxes_a, []).shape == (2, 0)
+
+
+def test_greedy_match_prefers_highest_iou():
+    iou = np.array([[0.5, 0.9], [0.6, 0.1]])
+    matches = detection_models.ops.greedy_match(iou, 0.3)
+    assert matches.tolist() == [[0, 1], [1, 0]]
+    assert detection_models.ops.greedy_match(iou, 0.95).shape == (0, 2)
+
+
+def test_detect_video_interpolates_between_keyframes():
+    detector = MovingBoxDetector()
+    frames = list(
+        detection_models.video.detect_video(detector,
+                                            make_frames(12),
+                                            keyframe_interval=5))
+
+    assert [frame.index for frame in frames] == list(range(12))
+    assert detector.calls == [0, 5, 10, 11]
+    assert [frame.inferred for frame in frames] == [
+        index in detector.calls for index in range(12)
+    ]
+    for frame in frames:
+        assert list(frame.results.keys()) == ["person"]
+        np.testing.assert_allclose(frame.results.boxes[0, 1],
+                                   0.1 + 0.01 * frame.index,
+                                   atol=1e-6)
+
+
+def test_detect_video_scene_change_forces_keyframe():
+    detector = MovingBoxDetector()
+    images = make_frames(6)
+    for image in images[3:]:
+        image[1:] = 255
+    frames = list(
+        detection_models.video.detect_video(detector,
+                                            images,
+                                            keyframe_interval=10,
+                                            scene_change_threshold=30))
+
+    assert detector.calls == [0, 3, 5]
+    # detections are held, not interpolated, across the cut
+    np.testing.assert_allclose(frames[2].results.boxes,
+                               frames[0].results.boxes)
+
+
+def test_detect_video_rejects_bad_interval():
+    with pytest.raises(ValueError):
+        list(
+            detection_models.video.detect_video(MovingBoxDetector(),
+                                                make_frames(2),
+                                                keyframe_interval=0))